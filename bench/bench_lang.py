@@ -0,0 +1,107 @@
+"""Compares the fixed 400 lines window with the adaptive sampling used to
+identify the language of subtitle files.
+
+The expected language is read from the file name: <name>.<lang>.<ext>
+    python bench/bench_lang.py [folder] [--lines 1200] [--repeat N]
+        [--json out.json]
+
+Without a folder, the files are built from bench/samples (see fixtures.py):
+a full episode, a short signs track and, for every language but English,
+an episode starting with an English song.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import episodus  # noqa: E402
+import fixtures  # noqa: E402
+
+LANGS = {"de": "srt", "en": "srt", "es": "ass", "fr": "ass"}
+SHORT_LINES = 8
+
+
+def build_samples(folder: str, lines: int) -> None:
+    songs = fixtures.sample_lines("songs.en.txt")
+    for lang, ext in LANGS.items():
+        episode = fixtures.dialog_lines(lang, lines)
+        fixtures.write_subtitle(os.path.join(folder, f"episode.{lang}.{ext}"), episode)
+        fixtures.write_subtitle(
+            os.path.join(folder, f"signs.{lang}.{ext}"),
+            fixtures.dialog_lines(lang, SHORT_LINES, seed=1),
+        )
+        if lang != "en":
+            fixtures.write_subtitle(
+                os.path.join(folder, f"opening.{lang}.{ext}"), songs + episode
+            )
+
+
+def fixed_window(sub_path: str) -> tuple[str, float]:
+    content = episodus.read_sub_file(sub_path)
+    if sub_path.endswith("srt"):
+        dialogs = episodus.read_srt_dialogs(content)
+    else:
+        dialogs = episodus.read_ass_dialogs(content)
+    return episodus.classify(dialogs)
+
+
+def adaptive(sub_path: str) -> tuple[str, float]:
+    lines = episodus.iter_sub_file_dialogs(sub_path)
+    return episodus.classify_adaptive(lines, cached=False)
+
+
+def run(sub_path: str, method, repeat: int) -> tuple[str, float]:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        lang, _ = method(sub_path)
+    return lang, (time.perf_counter() - start) / repeat
+
+
+def main() -> None:
+    arg = argparse.ArgumentParser(description="Language identification benchmark")
+    arg.add_argument("folder", nargs="?", help="Files named <name>.<lang>.<ext>")
+    arg.add_argument("--lines", type=int, default=1200, help="Of a built episode")
+    arg.add_argument("--repeat", type=int, default=20)
+    arg.add_argument("--json", help="Write the results to this file")
+    args = arg.parse_args()
+    if args.folder is None:
+        args.folder = tempfile.mkdtemp(prefix="bench-lang-")
+        build_samples(args.folder, args.lines)
+    files = sorted(
+        f for f in os.listdir(args.folder) if f.endswith(("ass", "ssa", "srt"))
+    )
+    # Loads the model before timing anything
+    episodus.classify("warm up")
+    results = []
+    totals = {"fixed": [0.0, 0], "adaptive": [0.0, 0]}
+    print(f"{'file':<20} {'expected':<8} {'fixed':>16} {'adaptive':>16}")
+    for file in files:
+        expected = file.split(".")[-2]
+        sub_path = os.path.join(args.folder, file)
+        row = {"file": file, "expected": expected}
+        cells = []
+        for name, method in [("fixed", fixed_window), ("adaptive", adaptive)]:
+            lang, seconds = run(sub_path, method, args.repeat)
+            row[name] = {"lang": lang, "ms": round(seconds * 1000, 3)}
+            totals[name][0] += seconds
+            totals[name][1] += int(lang == expected)
+            mark = "ok" if lang == expected else "KO"
+            cells.append(f"{lang} {mark} {seconds * 1000:8.2f}ms")
+        results.append(row)
+        print(f"{file:<20} {expected:<8} {cells[0]:>16} {cells[1]:>16}")
+    for name, (seconds, correct) in totals.items():
+        print(
+            f"{name:<9} accuracy {correct}/{len(files)} "
+            f"total {seconds * 1000:.2f}ms per pass"
+        )
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump({"results": results, "totals": totals}, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
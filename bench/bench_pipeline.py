@@ -0,0 +1,221 @@
+"""Pipeline benchmark: builds synthetic episodes with ffmpeg and mkvmerge (a
+tiny video plus subtitle tracks made from bench/samples) and new releases
+in a subtitle store tree, then runs the real export_ep of main.py with
+remux (-m) on every one of them.
+
+    python bench/bench_pipeline.py [--episodes 3] [--tracks ass:fr,srt:en,ass:und]
+        [--dialogs 400] [--new-subs fr] [--pgs sample.sup] [--warm]
+        [--json out.json] [--compare baseline.json]
+
+The stages are the spans of metricus, so they always follow the actual
+code path: the steps of export_ep (analyze_folder, analyze,
+guess_lang_harder, compare_with_mkv, subsync, import_tracks) and the
+tools and libraries they call (mkvmerge.identify, ffmpeg.stream, langid,
+mkvextract, sync, sync.speech, mkvmerge.remux, mkvmerge.verify,
+mkvpropedit...). Nested stages are counted in their parent too. Caches are
+emptied before every episode unless --warm. ffmpeg cannot encode PGS, pass
+an existing .sup with --pgs to get image tracks. Needs ffmpeg, mkvmerge,
+mkvextract and mkvpropedit.
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+import fixtures  # noqa: E402
+
+TOOLS = ["ffmpeg", "mkvmerge", "mkvextract", "mkvpropedit"]
+TVDBID = "900001"
+RELEASE = "Bench"
+
+
+def write_subtitle(
+    path: str, lang: str, dialogs: int, shift: float = 0.0, title: str = ""
+) -> None:
+    """Subtitle of dialogs lines of lang (French for und)"""
+    fixtures.write_subtitle(path, fixtures.dialog_lines(lang, dialogs), shift, title)
+
+
+def run(cmd: list[str]) -> None:
+    subprocess.run(cmd, check=True, capture_output=True)
+
+
+def build_video(path: str, duration: float) -> None:
+    """Tiny test pattern with a tone, the subtitles are what matters"""
+    cmd = ["ffmpeg", "-y", "-v", "error"]
+    cmd += ["-f", "lavfi", "-i", f"testsrc=size=64x36:rate=10:duration={duration}"]
+    cmd += ["-f", "lavfi", "-i", f"sine=frequency=440:duration={duration}"]
+    cmd += ["-c:v", "libx264", "-preset", "ultrafast", "-c:a", "aac", path]
+    run(cmd)
+
+
+def build_episode(
+    folder: str, base: str, number: int, tracks: list[tuple[str, str]], args
+) -> str:
+    """Muxes the subtitle tracks into a copy of base, returns its path"""
+    work = os.path.join(folder, f"tracks{number}")
+    os.makedirs(work, exist_ok=True)
+    video = os.path.join(folder, f"fixture.E{number:02d}.mkv")
+    cmd = ["mkvmerge", "-q", "-o", video, base]
+    for i, (ext, lang) in enumerate(tracks):
+        track_path = os.path.join(work, f"{i}.{ext}")
+        if ext == "sup":
+            shutil.copy(args.pgs, track_path)
+        else:
+            write_subtitle(track_path, lang, args.dialogs, title=f"Track {i}")
+        cmd += ["--language", f"0:{lang}", "--track-name", f"0:Track {i}"]
+        cmd += ["--default-track-flag", f"0:{int(i == 0)}", track_path]
+    run(cmd)
+    return video
+
+
+def lay_out_store(store_folder: str, season: str, ep: str, langs: list[str], args):
+    """New releases in the subtitle store, shifted so they need a sync"""
+    import episodus
+
+    os.makedirs(store_folder, exist_ok=True)
+    for i, lang in enumerate(langs):
+        t = episodus.TrackInfo(
+            season=season,
+            episode=ep,
+            release=f"New{i}",
+            trackname="Full",
+            subtype="srt",
+            language_ietf=lang,
+        )
+        path = os.path.join(store_folder, episodus.subtitle_export_name(t))
+        write_subtitle(path, lang, args.dialogs, shift=1.5)
+
+
+def clear_caches() -> None:
+    from cachus import IDENTIFY_CACHE, LANG_CACHE, SPEECH_CACHE
+
+    for cache, table in [(IDENTIFY_CACHE, "identify"), (LANG_CACHE, "lang_prob")]:
+        with cache._lock:
+            cache.db.execute(f"DELETE FROM {table}")
+            cache.db.commit()
+    shutil.rmtree(SPEECH_CACHE._folder, ignore_errors=True)
+
+
+def compare(current: dict, baseline_path: str) -> None:
+    with open(baseline_path, "r") as file:
+        baseline = json.load(file)["stages"]
+    print(f"\n{'stage':<20} {'baseline ms':>12} {'current ms':>12} {'delta':>8}")
+    for name, stats in current.items():
+        new = stats["sum_s"] * 1000 / stats["count"]
+        if name not in baseline:
+            print(f"{name:<20} {'-':>12} {new:>12.2f} {'new':>8}")
+            continue
+        old = baseline[name]["sum_s"] * 1000 / baseline[name]["count"]
+        delta = f"{(new - old) * 100 / old:+.0f}%" if old > 0 else "-"
+        print(f"{name:<20} {old:>12.2f} {new:>12.2f} {delta:>8}")
+
+
+def main() -> None:
+    arg = argparse.ArgumentParser(description="Pipeline benchmark")
+    arg.add_argument("--episodes", type=int, default=3)
+    arg.add_argument(
+        "--tracks",
+        default="ass:fr,srt:en,ass:und,srt:de",
+        help="Subtitle tracks of every episode, ext:lang separated by commas",
+    )
+    arg.add_argument("--dialogs", type=int, default=400, help="Lines per track")
+    arg.add_argument("--duration", type=float, help="Video length in seconds")
+    arg.add_argument("--new-subs", default="fr", help="Store languages to remux")
+    arg.add_argument("--pgs", help="A .sup file muxed as an extra track")
+    arg.add_argument("--warm", action="store_true", help="Keep the caches")
+    arg.add_argument("--keep", action="store_true", help="Keep the fixtures")
+    arg.add_argument("--json", help="Write the results to this file")
+    arg.add_argument("--compare", help="Previous --json output to compare with")
+    args = arg.parse_args()
+    missing = [tool for tool in TOOLS if shutil.which(tool) is None]
+    if len(missing) > 0:
+        print(f"Missing tool(s): {', '.join(missing)}")
+        sys.exit(2)
+    json_path = os.path.abspath(args.json) if args.json else None
+    baseline = os.path.abspath(args.compare) if args.compare else None
+    tracks = [tuple(t.split(":")) for t in args.tracks.split(",") if t]
+    if args.pgs:
+        args.pgs = os.path.abspath(args.pgs)
+        tracks.append(("sup", "en"))
+    workdir = tempfile.mkdtemp(prefix="bench-pipeline-")
+    os.chdir(workdir)
+    # configus reads its settings on import
+    os.environ["CACHE_FOLDER"] = os.path.join(workdir, "cache", "")
+    os.environ["TEMP_FOLDER"] = os.path.join(workdir, "temp")
+    os.environ["METRICS_FILE"] = ""
+    sys.path.insert(0, ROOT)
+    import configus
+    import main as submanagerr
+    from metricus import METRICS
+    from progressus import PROGRESS
+
+    configus.CONF_LOGGER.setLevel("WARNING")
+    # export_ep -m, every episode is treated even if its manifest is current
+    submanagerr.SUBTITLE_PATH = os.path.join(workdir, "subtitles", "")
+    submanagerr.to_remux = True
+    submanagerr.force_export = True
+    duration = args.duration or args.dialogs * 2.5 + 5
+    fixture_dir = os.path.join(workdir, "fixtures")
+    season_folder = os.path.join(workdir, "library", "Bench Serie", "Season 01")
+    store = os.path.join(submanagerr.SUBTITLE_PATH, TVDBID, "S01")
+    os.makedirs(fixture_dir)
+    os.makedirs(season_folder)
+    setup_start = time.perf_counter()
+    base = os.path.join(fixture_dir, "base.mkv")
+    build_video(base, duration)
+    episodes = []
+    for number in range(1, args.episodes + 1):
+        fixture = build_episode(fixture_dir, base, number, tracks, args)
+        video = os.path.join(season_folder, f"Bench Serie - S01E{number:02d}.mkv")
+        shutil.copy(fixture, video)
+        store_folder = os.path.join(store, f"E{number:02d}", "")
+        lay_out_store(
+            store_folder, "01", f"{number:02d}", args.new_subs.split(","), args
+        )
+        episodes.append((video, f"{number:02d}"))
+    setup = time.perf_counter() - setup_start
+    print(f"{args.episodes} episode(s) built in {setup:.1f}s in {workdir}")
+    statuses = []
+    for video, number in episodes:
+        if not args.warm:
+            clear_caches()
+        submanagerr.export_ep(video, TVDBID, number, "01", RELEASE)
+        statuses.append(PROGRESS.status(video))
+    submanagerr.stop_workers()
+    metrics = METRICS.to_json()
+    summary = metrics["stages"]
+    print(f"{'stage':<20} {'count':>6} {'mean ms':>10} {'p90 ms':>10} {'total ms':>10}")
+    for name, s in sorted(summary.items(), key=lambda s: -s[1]["sum_s"]):
+        print(
+            f"{name:<20} {s['count']:>6} {s['sum_s'] * 1000 / s['count']:>10.2f} "
+            f"{s['p90_s'] * 1000:>10.2f} {s['sum_s'] * 1000:>10.2f}"
+        )
+    print(f"episode status: {', '.join(statuses)}")
+    if baseline:
+        compare(summary, baseline)
+    if json_path:
+        meta = {k: v for k, v in vars(args).items() if k not in ["json", "compare"]}
+        with open(json_path, "w") as file:
+            json.dump(
+                {
+                    "meta": dict(meta, date=time.strftime("%Y-%m-%dT%H:%M:%S")),
+                    "stages": summary,
+                    "episodes": metrics["episodes"],
+                    "statuses": statuses,
+                },
+                file,
+                indent=2,
+            )
+    if not args.keep:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
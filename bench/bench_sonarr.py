@@ -0,0 +1,186 @@
+"""Load harness: runs the full export (-a) or the grab queue (-g) of main.py
+in process against the fake Sonarr of bench/mock_sonarr.py, and reports
+the Sonarr API calls, wall time and memory.
+
+    python bench/bench_sonarr.py [--mode all|queue] [--series 200] [--jobs N]
+        [--latency-ms 20] [--error-rate 0.01] [--retries 2] [--retry-delay 0.1]
+        [--export skip|real] [--json out.json]
+
+Every library option of mock_sonarr.py is accepted. With --export skip
+(default) episodes are only marked done, which measures the Sonarr side,
+the progress store and the scheduling. --export real runs the actual
+export on the generated paths, it needs mkvmerge and the videos won't
+exist. With --error-rate, Sonarr errors are retried --retries times and
+the series (or grab files) still failing are reported.
+Runs in a temporary folder, nothing of the real setup is touched.
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from mock_sonarr import API_KEY, MockSonarr  # noqa: E402
+from mock_sonarr import add_library_args, library_from_args  # noqa: E402
+
+
+def write_grabs(library, count: int, folder: str, seed: int) -> int:
+    """Grab files like subs.sh writes them, for random episodes with a file"""
+    os.makedirs(folder, exist_ok=True)
+    rand = random.Random(seed)
+    written = 0
+    for _ in range(count * 10):
+        if written == count:
+            break
+        serie_id = rand.randint(1, library.series)
+        ep = library.episode(rand.choice(library.episode_ids(serie_id)), full=True)
+        if ep is None or "episodeFile" not in ep:
+            continue
+        serie = ep["series"]
+        lines = {
+            "sonarr_eventtype": "Download",
+            "sonarr_series_id": serie["id"],
+            "sonarr_series_title": serie["title"],
+            "sonarr_series_path": serie["path"],
+            "sonarr_series_tvdbid": serie["tvdbId"],
+            "sonarr_episodefile_id": ep["episodeFileId"],
+            "sonarr_episodefile_path": ep["episodeFile"]["path"],
+            "sonarr_episodefile_releasegroup": ep["episodeFile"]["releaseGroup"],
+            "sonarr_episodefile_seasonnumber": ep["seasonNumber"],
+            "sonarr_episodefile_episodenumbers": ep["episodeNumber"],
+            "sonarr_episodefile_episodeids": ep["id"],
+        }
+        with open(os.path.join(folder, f"grab-{written:06d}"), "w") as file:
+            file.writelines(f"{k}={v}\n" for k, v in lines.items())
+        written += 1
+    return written
+
+
+def main() -> None:
+    arg = argparse.ArgumentParser(description="Sonarr load harness")
+    add_library_args(arg)
+    arg.set_defaults(series=200)
+    arg.add_argument("--mode", choices=["all", "queue"], default="all")
+    arg.add_argument("--grabs", type=int, default=1000, help="Queue size")
+    arg.add_argument("--jobs", type=int, default=1)
+    arg.add_argument("--export", choices=["skip", "real"], default="skip")
+    arg.add_argument("--retries", type=int, default=2, help="Per Sonarr call")
+    arg.add_argument("--retry-delay", type=float, default=0.1, help="Seconds")
+    arg.add_argument("--log-level", default="WARNING")
+    arg.add_argument("--json", help="Write the results to this file")
+    args = arg.parse_args()
+    json_path = os.path.abspath(args.json) if args.json else None
+    library = library_from_args(args)
+    server = MockSonarr(
+        library,
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        error_rate=args.error_rate,
+    )
+    server.start()
+    workdir = tempfile.mkdtemp(prefix="bench-sonarr-")
+    os.chdir(workdir)
+    # configus reads its settings on import
+    os.environ["HOST_URL"] = server.url
+    os.environ["HOST_API"] = API_KEY
+    os.environ["CACHE_FOLDER"] = os.path.join(workdir, "cache", "")
+    os.environ["TEMP_FOLDER"] = os.path.join(workdir, "temp")
+    os.environ["SONARR_RETRIES"] = str(args.retries)
+    os.environ["SONARR_RETRY_DELAY"] = str(args.retry_delay)
+    import configus
+    import main as submanagerr
+    from metricus import METRICS
+    from progressus import DONE, PROGRESS
+
+    configus.CONF_LOGGER.setLevel(getattr(logging, args.log_level.upper()))
+    exported = []
+
+    def skip_export(ep_path, tvid, ep_num, season, rel_group, serie_id=""):
+        exported.append(ep_path)
+        PROGRESS.set_status(ep_path, DONE, serie_id)
+
+    if args.export == "skip":
+        submanagerr.export_ep = skip_export
+    grabs = 0
+    if args.mode == "queue":
+        grabs = write_grabs(library, args.grabs, "./grabs/", args.seed)
+    submanagerr.start_workers(args.jobs)
+    server.reset_stats()
+    error = ""
+    failed_series = []
+    tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        if args.mode == "all":
+            failed_series = submanagerr.export_all_from_sonarr()
+        else:
+            submanagerr.treat_queue_from_sonarr("./grabs/")
+        submanagerr.stop_workers()
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+    wall = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    max_rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    stats = server.stats()
+    server.stop()
+    # Grab files are only removed once treated
+    grabs_left = len(os.listdir("./grabs/")) if args.mode == "queue" else 0
+    results = {
+        "mode": args.mode,
+        "series": library.series,
+        "episodes": library.episode_count,
+        "grabs": grabs,
+        "jobs": args.jobs,
+        "latency_ms": args.latency_ms,
+        "error_rate": args.error_rate,
+        "wall_s": round(wall, 3),
+        "api_requests": stats["requests"],
+        "api_errors": stats["errors"],
+        "requests_by_endpoint": stats["by_endpoint"],
+        "exported": len(exported),
+        "failed_series": failed_series,
+        "grabs_left": grabs_left,
+        "python_peak_mb": round(peak / 1024 / 1024, 1),
+        "max_rss_mb": round(max_rss_kb / 1024, 1),
+        "stages": METRICS.to_json()["stages"],
+        "error": error,
+        "workdir": workdir,
+    }
+    print(f"{args.mode}: {library.series} series, {library.episode_count} episodes")
+    print(f"wall time        {wall:.2f}s")
+    print(f"API requests     {stats['requests']} ({stats['errors']} injected errors)")
+    for endpoint, count in sorted(stats["by_endpoint"].items()):
+        print(f"  {endpoint:<22} {count}")
+    if wall > 0:
+        print(f"requests/s       {stats['requests'] / wall:.1f}")
+    print(f"episodes handled {len(exported) if args.export == 'skip' else '-'}")
+    if args.mode == "all":
+        print(f"failed series    {len(failed_series)}")
+    else:
+        print(f"grabs left       {grabs_left}")
+    print(f"python peak      {results['python_peak_mb']}MB (tracemalloc)")
+    print(f"max RSS          {results['max_rss_mb']}MB")
+    for stage, s in sorted(results["stages"].items()):
+        print(
+            f"  {stage:<26} {s['count']:>7} p50 {s['p50_s'] * 1000:.1f}ms "
+            f"p99 {s['p99_s'] * 1000:.1f}ms"
+        )
+    if error != "":
+        print(f"Stopped by {error}")
+    if json_path:
+        with open(json_path, "w") as file:
+            json.dump(results, file, indent=2)
+    sys.exit(1 if error != "" else 0)
+
+
+if __name__ == "__main__":
+    main()
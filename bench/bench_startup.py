@@ -0,0 +1,99 @@
+"""Startup benchmark: import time of main.py (python -X importtime) and wall
+time of a --grabs run on an empty queue.
+
+    python bench/bench_startup.py [--repeat N] [--max-ms 1000] [--json out.json]
+
+Exits with 1 when a heavy dependency is imported at startup or when the
+empty queue run is slower than --max-ms.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Must only be imported once they are actually needed
+HEAVY_MODULES = [
+    "langcodes",
+    "py3langid",
+    "pyarr",
+    "ass_parser",
+    "ass_tag_parser",
+    "ffsubsync",
+    "numpy",
+]
+
+
+def import_times(cwd: str) -> dict[str, tuple[int, int]]:
+    """Returns module -> (self us, cumulative us) for 'import main'"""
+    cmd = [sys.executable, "-X", "importtime", "-c", "import main"]
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    out = subprocess.run(cmd, cwd=cwd, env=env, capture_output=True, text=True)
+    times = {}
+    for line in out.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:") :].split("|")
+        times[name.strip()] = (int(self_us), int(cumulative_us))
+    return times
+
+
+def empty_queue_run(cwd: str) -> float:
+    start = time.perf_counter()
+    subprocess.run(
+        [sys.executable, os.path.join(ROOT, "main.py"), "--grabs"],
+        cwd=cwd,
+        capture_output=True,
+        check=True,
+    )
+    return time.perf_counter() - start
+
+
+def main() -> None:
+    arg = argparse.ArgumentParser(description="Startup benchmark")
+    arg.add_argument("--repeat", type=int, default=5)
+    arg.add_argument("--top", type=int, default=15)
+    arg.add_argument("--max-ms", type=float, default=1000)
+    arg.add_argument("--json", help="Write the results to this file")
+    args = arg.parse_args()
+    with tempfile.TemporaryDirectory() as cwd:
+        os.makedirs(os.path.join(cwd, "grabs"))
+        times = import_times(cwd)
+        runs = [empty_queue_run(cwd) for _ in range(args.repeat)]
+    print(f"{'module':<40} {'self ms':>8} {'cumul. ms':>10}")
+    ranked = sorted(times.items(), key=lambda t: t[1][1], reverse=True)
+    for name, (self_us, cumulative_us) in ranked[: args.top]:
+        print(f"{name:<40} {self_us / 1000:>8.1f} {cumulative_us / 1000:>10.1f}")
+    main_ms = times.get("main", (0, 0))[1] / 1000
+    median_ms = statistics.median(runs) * 1000
+    heavy = [m for m in HEAVY_MODULES if m in times]
+    print(f"import main: {main_ms:.1f}ms")
+    print(f"empty queue run (median of {args.repeat}): {median_ms:.1f}ms")
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(
+                {
+                    "import_main_ms": main_ms,
+                    "empty_queue_ms": median_ms,
+                    "heavy_imported": heavy,
+                    "imports": {k: v for k, v in ranked[: args.top]},
+                },
+                file,
+                indent=2,
+            )
+    failed = False
+    if len(heavy) > 0:
+        print(f"Heavy modules imported at startup: {', '.join(heavy)}")
+        failed = True
+    if median_ms > args.max_ms:
+        print(f"Empty queue run is slower than {args.max_ms}ms")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
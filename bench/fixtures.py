@@ -0,0 +1,72 @@
+"""Subtitle files built from the short dialog samples of bench/samples, so
+the benchmarks can have episodes of any size without committing them.
+
+dialogs.<lang>.txt hold a few dozen everyday lines per language, shuffled
+again on every pass so no two windows of a generated file are the same.
+songs.en.txt is an English opening, put in front of other languages to
+mimic a release that starts with a song.
+"""
+import os
+import random
+
+SAMPLES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "samples")
+# Tracks of undefined language are made of French dialogs
+FALLBACK_LANG = "fr"
+
+
+def sample_lines(name: str) -> list[str]:
+    with open(os.path.join(SAMPLES, name), encoding="utf-8") as file:
+        return [line.strip() for line in file if line.strip() != ""]
+
+
+def dialog_lines(lang: str, count: int, seed: int = 0) -> list[str]:
+    """count lines of lang, shuffled differently on every pass"""
+    file = f"dialogs.{lang}.txt"
+    if not os.path.exists(os.path.join(SAMPLES, file)):
+        file = f"dialogs.{FALLBACK_LANG}.txt"
+    pool = sample_lines(file)
+    rand = random.Random(f"{lang}-{seed}")
+    lines: list[str] = []
+    while len(lines) < count:
+        rand.shuffle(pool)
+        lines += pool
+    return lines[:count]
+
+
+def timestamp(seconds: float, sep: str) -> str:
+    ms = int(seconds * 1000)
+    h, ms = divmod(ms, 3600000)
+    m, ms = divmod(ms, 60000)
+    s, ms = divmod(ms, 1000)
+    if sep == ".":
+        return f"{h}:{m:02d}:{s:02d}.{ms // 10:02d}"
+    return f"{h:02d}:{m:02d}:{s:02d},{ms:03d}"
+
+
+def write_subtitle(
+    path: str, lines: list[str], shift: float = 0.0, title: str = ""
+) -> None:
+    """ASS or SRT depending on the extension, 2s per line shifted by
+    shift seconds"""
+    with open(path, "w", encoding="utf-8") as file:
+        if path.endswith("ass"):
+            file.write(
+                "[Script Info]\n"
+                f"Title: {title}\n"
+                "ScriptType: v4.00+\n\n"
+                "[Events]\n"
+                "Format: Layer, Start, End, Style, Name, MarginL, MarginR, "
+                "MarginV, Effect, Text\n"
+            )
+        for i, text in enumerate(lines):
+            start = 1 + i * 2.5 + shift
+            if path.endswith("ass"):
+                file.write(
+                    f"Dialogue: 0,{timestamp(start, '.')},"
+                    f"{timestamp(start + 2, '.')},Default,,0,0,0,,{text}\n"
+                )
+            else:
+                file.write(
+                    f"{i + 1}\n{timestamp(start, ',')} --> "
+                    f"{timestamp(start + 2, ',')}\n{text}\n\n"
+                )
@@ -0,0 +1,317 @@
+"""Fake Sonarr serving the v3 endpoints used by the Sonarr class (series,
+episode, episodefile, system/status) from a generated library, with
+optional latency and errors.
+
+    python bench/mock_sonarr.py [--series 5000] [--seasons 4] [--episodes 10]
+        [--latency-ms 20] [--jitter-ms 5] [--error-rate 0.01] [--port 8989]
+
+Then run main.py with HOST_URL=http://127.0.0.1:8989 and HOST_API=mock.
+Episodes are computed from their ID, a 200,000 episodes library doesn't
+need to be held in memory. GET /stats returns the request counters.
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+API_KEY = "mock"
+# Episode IDs are serie_id * EP_BASE + index, so both can be found back
+EP_BASE = 10000
+RELEASE_GROUPS = ["Erai-raws", "NTb", "FLUX", "Kitsune", "SubsPlease", ""]
+
+
+@dataclass
+class Library:
+    series: int = 5000
+    seasons: int = 4
+    episodes: int = 10
+    root: str = "/tv"
+    # Share of episodes with a file, and of monitored episodes
+    file_ratio: float = 1.0
+    monitored_ratio: float = 1.0
+    seed: int = 0
+
+    @property
+    def episode_count(self) -> int:
+        return self.series * self.seasons * self.episodes
+
+    def _rand(self, *key: int) -> random.Random:
+        return random.Random(hash((self.seed, *key)))
+
+    def serie(self, serie_id: int) -> dict | None:
+        if not 1 <= serie_id <= self.series:
+            return None
+        title = f"Serie {serie_id:05d}"
+        return {
+            "id": serie_id,
+            "title": title,
+            "tvdbId": 100000 + serie_id,
+            "path": f"{self.root}/{title}",
+            "monitored": True,
+            "seasonCount": self.seasons,
+        }
+
+    def serie_by_tvdbid(self, tvdbid: int) -> dict | None:
+        return self.serie(tvdbid - 100000)
+
+    def _locate(self, ep_id: int) -> tuple[int, int, int] | None:
+        serie_id, index = divmod(ep_id, EP_BASE)
+        if self.serie(serie_id) is None or index >= self.seasons * self.episodes:
+            return None
+        season, number = divmod(index, self.episodes)
+        return serie_id, season + 1, number + 1
+
+    def episode_file(self, file_id: int) -> dict | None:
+        location = self._locate(file_id)
+        if location is None:
+            return None
+        serie_id, season, number = location
+        rand = self._rand(file_id)
+        if rand.random() >= self.file_ratio:
+            return None
+        serie = self.serie(serie_id)
+        group = rand.choice(RELEASE_GROUPS)
+        name = f"{serie['title']} - S{season:02d}E{number:02d}"  # type: ignore
+        return {
+            "id": file_id,
+            "seriesId": serie_id,
+            "seasonNumber": season,
+            "relativePath": f"Season {season:02d}/{name}.mkv",
+            "path": f"{serie['path']}/Season {season:02d}/{name}.mkv",  # type: ignore
+            "size": rand.randint(200, 4000) * 1024 * 1024,
+            "releaseGroup": group,
+        }
+
+    def episode(self, ep_id: int, full: bool = False) -> dict | None:
+        """full adds the serie and the file, like GET /episode/{id}"""
+        location = self._locate(ep_id)
+        if location is None:
+            return None
+        serie_id, season, number = location
+        ep_file = self.episode_file(ep_id)
+        episode = {
+            "id": ep_id,
+            "seriesId": serie_id,
+            "seasonNumber": season,
+            "episodeNumber": number,
+            "title": f"Episode {number}",
+            "hasFile": ep_file is not None,
+            "episodeFileId": ep_id if ep_file is not None else 0,
+            "monitored": self._rand(ep_id, 1).random() < self.monitored_ratio,
+        }
+        if full:
+            episode["series"] = self.serie(serie_id)
+            if ep_file is not None:
+                episode["episodeFile"] = ep_file
+        return episode
+
+    def episode_ids(self, serie_id: int) -> range:
+        start = serie_id * EP_BASE
+        return range(start, start + self.seasons * self.episodes)
+
+    def all_series(self) -> list[dict]:
+        return [self.serie(i) for i in range(1, self.series + 1)]  # type: ignore
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    server: "MockSonarr"
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written separately, without this every
+    # keep-alive request waits for a delayed ACK
+    disable_nagle_algorithm = True
+
+    def _reply(self, code: int, body) -> None:
+        data = json.dumps(body).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _route(self, parts: list[str], query: dict) -> tuple[str, object]:
+        """Returns the endpoint name (for the counters) and the body,
+        None as body means 404"""
+        lib = self.server.library
+        endpoint = parts[0] if parts else ""
+        arg = int(parts[1]) if len(parts) > 1 and parts[1].isdigit() else None
+        if endpoint == "system" and parts[1:] == ["status"]:
+            return "system/status", {"appName": "Sonarr", "version": "3.0.0-mock"}
+        if endpoint == "series":
+            if arg is not None:
+                return "series/{id}", lib.serie(arg)
+            if "tvdbId" in query:
+                s = lib.serie_by_tvdbid(int(query["tvdbId"]))
+                return "series?tvdbId", [s] if s is not None else []
+            return "series", lib.all_series()
+        if endpoint == "episode":
+            if arg is not None:
+                return "episode/{id}", lib.episode(arg, full=True)
+            serie_id = int(query.get("seriesId", 0))
+            eps = [lib.episode(i) for i in lib.episode_ids(serie_id)]
+            return "episode?seriesId", [e for e in eps if e is not None]
+        if endpoint == "episodefile":
+            if arg is not None:
+                return "episodefile/{id}", lib.episode_file(arg)
+            serie_id = int(query.get("seriesId", 0))
+            files = [lib.episode_file(i) for i in lib.episode_ids(serie_id)]
+            return "episodefile?seriesId", [f for f in files if f is not None]
+        return endpoint, None
+
+    def do_GET(self) -> None:
+        url = urlparse(self.path)
+        if url.path == "/stats":
+            self._reply(200, self.server.stats())
+            return
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+        api_key = self.headers.get("X-Api-Key", query.get("apikey", ""))
+        if api_key != self.server.api_key:
+            self._reply(401, {"error": "Unauthorized"})
+            return
+        parts = [p for p in url.path.split("/") if p != ""]
+        if parts[:2] != ["api", "v3"]:
+            self._reply(404, {"message": "NotFound"})
+            return
+        self.server.wait()
+        endpoint, body = self._route(parts[2:], query)
+        if self.server.fail(endpoint):
+            self._reply(503, {"message": "Injected error"})
+        elif body is None:
+            self._reply(404, {"message": "NotFound"})
+        else:
+            self._reply(200, body)
+
+    def log_message(self, format: str, *args) -> None:
+        pass
+
+
+class MockSonarr(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(
+        self,
+        library: Library,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        latency_ms: float = 0,
+        jitter_ms: float = 0,
+        error_rate: float = 0,
+        api_key: str = API_KEY,
+    ) -> None:
+        super().__init__((host, port), MockHandler)
+        self.library = library
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.api_key = api_key
+        self._counters: dict[str, int] = {}
+        self._errors: dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._rand = random.Random(library.seed)
+        self._thread: threading.Thread | None = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def wait(self) -> None:
+        delay = self.latency_ms
+        if self.jitter_ms > 0:
+            with self._lock:
+                delay += self._rand.uniform(-self.jitter_ms, self.jitter_ms)
+        if delay > 0:
+            time.sleep(delay / 1000)
+
+    def fail(self, endpoint: str) -> bool:
+        """Counts the request, True when an error must be injected"""
+        with self._lock:
+            self._counters[endpoint] = self._counters.get(endpoint, 0) + 1
+            if self.error_rate > 0 and self._rand.random() < self.error_rate:
+                self._errors[endpoint] = self._errors.get(endpoint, 0) + 1
+                return True
+        return False
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "requests": sum(self._counters.values()),
+                "errors": sum(self._errors.values()),
+                "by_endpoint": dict(self._counters),
+                "errors_by_endpoint": dict(self._errors),
+            }
+
+    def reset_stats(self) -> None:
+        with self._lock:
+            self._counters = {}
+            self._errors = {}
+
+    def start(self) -> None:
+        self._thread = threading.Thread(
+            target=self.serve_forever, name="mock-sonarr", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+
+def add_library_args(arg: argparse.ArgumentParser) -> None:
+    arg.add_argument("--series", type=int, default=5000)
+    arg.add_argument("--seasons", type=int, default=4)
+    arg.add_argument("--episodes", type=int, default=10, help="Per season")
+    arg.add_argument("--root", default="/tv", help="Library path of the series")
+    arg.add_argument("--file-ratio", type=float, default=1.0)
+    arg.add_argument("--monitored-ratio", type=float, default=1.0)
+    arg.add_argument("--seed", type=int, default=0)
+    arg.add_argument("--latency-ms", type=float, default=0)
+    arg.add_argument("--jitter-ms", type=float, default=0)
+    arg.add_argument("--error-rate", type=float, default=0)
+
+
+def library_from_args(args: argparse.Namespace) -> Library:
+    return Library(
+        series=args.series,
+        seasons=args.seasons,
+        episodes=args.episodes,
+        root=args.root,
+        file_ratio=args.file_ratio,
+        monitored_ratio=args.monitored_ratio,
+        seed=args.seed,
+    )
+
+
+def main() -> None:
+    arg = argparse.ArgumentParser(description="Fake Sonarr")
+    add_library_args(arg)
+    arg.add_argument("--host", default="127.0.0.1")
+    arg.add_argument("--port", type=int, default=8989)
+    args = arg.parse_args()
+    library = library_from_args(args)
+    server = MockSonarr(
+        library,
+        args.host,
+        args.port,
+        args.latency_ms,
+        args.jitter_ms,
+        args.error_rate,
+    )
+    print(
+        f"Fake Sonarr on {server.url} (API key: {API_KEY}), "
+        f"{library.series} series, {library.episode_count} episodes"
+    )
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+
+
+if __name__ == "__main__":
+    main()
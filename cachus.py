@@ -0,0 +1,559 @@
+from dataclasses import asdict
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import configus
+
+CACHE_FOLDER = configus.CONF_CACHE_FOLDER
+IDENTIFY_CACHE_MAX = configus.CONF_IDENTIFY_CACHE_MAX
+LANG_CACHE_MAX = configus.CONF_LANG_CACHE_MAX
+SPEECH_CACHE_MAX = configus.CONF_SPEECH_CACHE_MAX
+LOG = configus.CONF_LOGGER
+
+
+def file_fingerprint(file_path: str) -> tuple[int, int, int] | None:
+    """Returns (size, mtime_ns, inode) or None if the file is gone"""
+    try:
+        st = os.stat(file_path)
+        return st.st_size, st.st_mtime_ns, st.st_ino
+    except OSError:
+        return None
+
+
+class CacheStats:
+    hits = 0
+    misses = 0
+
+    def log_stats(self, name: str) -> None:
+        total = self.hits + self.misses
+        if total > 0:
+            LOG.info(
+                f"{name} cache: {self.hits} hit(s), {self.misses} miss(es) "
+                f"({int(self.hits * 100 / total)}% hit rate)"
+            )
+
+
+class SqliteStore:
+    """Base class for the small sqlite files, one per store.
+    A single connection is shared between threads behind a lock"""
+
+    schema = ""
+
+    def __init__(self, db_path: str) -> None:
+        self._db_path = db_path
+        self._lock = threading.Lock()
+        self._db: sqlite3.Connection | None = None
+
+    @property
+    def db(self) -> sqlite3.Connection:
+        if self._db is None:
+            folder = os.path.dirname(self._db_path)
+            if folder != "" and not os.path.exists(folder):
+                os.makedirs(folder)
+            self._db = sqlite3.connect(self._db_path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.executescript(self.schema)
+        return self._db
+
+    def close(self) -> None:
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+
+class SqliteCache(SqliteStore, CacheStats):
+    """Sqlite store keeping at most max_entries, with hit/miss counters"""
+
+    def __init__(self, db_path: str, max_entries: int) -> None:
+        super().__init__(db_path)
+        self._max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+
+class IdentifyCache(SqliteCache):
+    """Keeps the output of 'mkvmerge -J' and the subtitle tracks derived
+    from it, keyed by path and validated by size, mtime and inode"""
+
+    schema = """
+        CREATE TABLE IF NOT EXISTS identify (
+            path TEXT PRIMARY KEY,
+            size INTEGER,
+            mtime_ns INTEGER,
+            inode INTEGER,
+            tracks TEXT,
+            subs TEXT,
+            last_used REAL
+        );
+        CREATE INDEX IF NOT EXISTS identify_last_used ON identify (last_used);
+    """
+
+    def get(self, video_path: str) -> tuple[dict, list[dict] | None] | None:
+        fp = file_fingerprint(video_path)
+        with self._lock:
+            row = self.db.execute(
+                "SELECT size, mtime_ns, inode, tracks, subs "
+                "FROM identify WHERE path = ?",
+                (video_path,),
+            ).fetchone()
+            if row is None or fp is None or tuple(row[:3]) != fp:
+                if row is not None:
+                    LOG.debug(f"Stale identify cache entry for {video_path}")
+                    self.db.execute(
+                        "DELETE FROM identify WHERE path = ?", (video_path,)
+                    )
+                    self.db.commit()
+                self.misses += 1
+                return None
+            self.db.execute(
+                "UPDATE identify SET last_used = ? WHERE path = ?",
+                (time.time(), video_path),
+            )
+            self.db.commit()
+            self.hits += 1
+        subs = json.loads(row[4]) if row[4] is not None else None
+        return json.loads(row[3]), subs
+
+    def put(self, video_path: str, tracks: dict, subs: list | None = None) -> None:
+        fp = file_fingerprint(video_path)
+        if fp is None:
+            return
+        subs_json = None
+        if subs is not None:
+            subs_json = json.dumps([asdict(s) for s in subs])
+        with self._lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO identify VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (video_path, *fp, json.dumps(tracks), subs_json, time.time()),
+            )
+            self.db.commit()
+        self._evict()
+
+    def _evict(self) -> None:
+        with self._lock:
+            count = self.db.execute("SELECT COUNT(*) FROM identify").fetchone()[0]
+            if count > self._max_entries:
+                overflow = count - self._max_entries
+                self.db.execute(
+                    "DELETE FROM identify WHERE path IN "
+                    "(SELECT path FROM identify ORDER BY last_used LIMIT ?)",
+                    (overflow,),
+                )
+                self.db.commit()
+                LOG.debug(f"Evicted {overflow} identify cache entries")
+
+    def evict_stale(self) -> int:
+        """Drops entries for files that were deleted or modified"""
+        stale = []
+        with self._lock:
+            rows = self.db.execute(
+                "SELECT path, size, mtime_ns, inode FROM identify"
+            ).fetchall()
+            for row in rows:
+                if file_fingerprint(row[0]) != tuple(row[1:]):
+                    stale.append((row[0],))
+            self.db.executemany("DELETE FROM identify WHERE path = ?", stale)
+            self.db.commit()
+        if len(stale) > 0:
+            LOG.info(f"Removed {len(stale)} stale identify cache entries")
+        return len(stale)
+
+
+IDENTIFY_CACHE = IdentifyCache(
+    os.path.join(CACHE_FOLDER, "identify.sqlite"), IDENTIFY_CACHE_MAX
+)
+
+
+def text_digest(text: str) -> str:
+    """Hash of the text ignoring case and whitespace differences"""
+    normalized = " ".join(text.lower().split())
+    return hashlib.blake2b(normalized.encode("utf-8"), digest_size=20).hexdigest()
+
+
+class LangCache(SqliteCache):
+    """Language identified by langid for a dialog sample, keyed by the hash
+    of the normalized text, least recently used entries are evicted.
+    confidence is a probability (0 to 1). The old "lang" table held raw
+    langid scores, it is dropped rather than compared with LANG_CONFIDENCE"""
+
+    schema = """
+        DROP TABLE IF EXISTS lang;
+        CREATE TABLE IF NOT EXISTS lang_prob (
+            digest TEXT PRIMARY KEY,
+            lang TEXT,
+            confidence REAL,
+            last_used REAL
+        );
+        CREATE INDEX IF NOT EXISTS lang_prob_last_used ON lang_prob (last_used);
+    """
+
+    def get(self, digest: str) -> tuple[str, float] | None:
+        with self._lock:
+            row = self.db.execute(
+                "SELECT lang, confidence FROM lang_prob WHERE digest = ?", (digest,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.db.execute(
+                "UPDATE lang_prob SET last_used = ? WHERE digest = ?",
+                (time.time(), digest),
+            )
+            self.db.commit()
+            self.hits += 1
+        return row[0], row[1]
+
+    def put(self, digest: str, lang: str, confidence: float) -> None:
+        with self._lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO lang_prob VALUES (?, ?, ?, ?)",
+                (digest, lang, confidence, time.time()),
+            )
+            count = self.db.execute("SELECT COUNT(*) FROM lang_prob").fetchone()[0]
+            if count > self._max_entries:
+                self.db.execute(
+                    "DELETE FROM lang_prob WHERE digest IN "
+                    "(SELECT digest FROM lang_prob ORDER BY last_used LIMIT ?)",
+                    (count - self._max_entries,),
+                )
+            self.db.commit()
+
+
+LANG_CACHE = LangCache(os.path.join(CACHE_FOLDER, "lang.sqlite"), LANG_CACHE_MAX)
+
+
+class SpeechCache(CacheStats):
+    """ffsubsync serialized speech (.npz) of whole videos, one file per
+    video fingerprint (size, mtime, inode) so a changed video is never
+    matched. ffsubsync reads the .npz directly as a reference. Least
+    recently used files are deleted past max_entries"""
+
+    def __init__(self, folder: str, max_entries: int) -> None:
+        self._folder = folder
+        self._max_entries = max_entries
+        self._lock = threading.Lock()
+        self._building: dict[str, threading.Lock] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def path(self, video_path: str) -> str:
+        """Where the speech of video_path is (or will be) stored,
+        empty if the video can't be read"""
+        fingerprint = file_fingerprint(video_path)
+        if fingerprint is None:
+            return ""
+        key = hashlib.blake2b(repr(fingerprint).encode(), digest_size=16).hexdigest()
+        return os.path.join(self._folder, f"{key}.npz")
+
+    def lock(self, npz_path: str) -> threading.Lock:
+        """One lock per entry, so a video is only decoded once at a time"""
+        with self._lock:
+            return self._building.setdefault(npz_path, threading.Lock())
+
+    def get(self, video_path: str) -> str | None:
+        npz_path = self.path(video_path)
+        if npz_path == "" or not os.path.exists(npz_path):
+            self.misses += 1
+            return None
+        # The mtime of the entry is its last use
+        os.utime(npz_path)
+        self.hits += 1
+        return npz_path
+
+    def put(self, built_path: str, video_path: str) -> str:
+        """Moves a freshly serialized speech file into the cache"""
+        npz_path = self.path(video_path)
+        os.replace(built_path, npz_path)
+        self.evict()
+        return npz_path
+
+    def evict(self) -> int:
+        with self._lock:
+            entries = [
+                os.path.join(self._folder, f)
+                for f in os.listdir(self._folder)
+                if f.endswith(".npz")
+            ]
+            if len(entries) <= self._max_entries:
+                return 0
+            entries.sort(key=os.path.getmtime)
+            old = entries[: len(entries) - self._max_entries]
+            for entry in old:
+                os.remove(entry)
+        LOG.debug(f"Removed {len(old)} speech reference(s) from cache")
+        return len(old)
+
+
+SPEECH_CACHE = SpeechCache(os.path.join(CACHE_FOLDER, "speech"), SPEECH_CACHE_MAX)
+
+
+class SubtitleCatalog(SqliteStore, CacheStats):
+    """Every subtitle file of the subtitle library with its parsed track,
+    size, mtime and content hash. It is refreshed incrementally: a folder
+    is only listed again when its mtime changed, so an unchanged folder
+    costs one stat. Rewriting a file in place doesn't change the mtime of
+    its folder, whoever does it must call invalidate() on the folder, and
+    verify() compares the files of a folder one by one for the others.
+    parse(path) -> TrackInfo, files it can't parse are kept without track.
+    hits are folders reused as they were, misses folders listed again"""
+
+    schema = """
+        CREATE TABLE IF NOT EXISTS dirs (
+            path TEXT PRIMARY KEY,
+            parent TEXT,
+            mtime_ns INTEGER
+        );
+        CREATE INDEX IF NOT EXISTS dirs_parent ON dirs (parent);
+        CREATE TABLE IF NOT EXISTS subs (
+            path TEXT PRIMARY KEY,
+            dir TEXT,
+            tvdbid TEXT,
+            season TEXT,
+            episode TEXT,
+            language TEXT,
+            size INTEGER,
+            mtime_ns INTEGER,
+            digest TEXT,
+            track TEXT
+        );
+        CREATE INDEX IF NOT EXISTS subs_dir ON subs (dir);
+        CREATE INDEX IF NOT EXISTS subs_episode ON subs (tvdbid, season, episode);
+        CREATE INDEX IF NOT EXISTS subs_language ON subs (language);
+    """
+
+    def __init__(self, db_path: str, root: str, parse) -> None:
+        super().__init__(db_path)
+        self.hits = 0
+        self.misses = 0
+        self._root = os.path.normpath(root)
+        self._parse = parse
+
+    def _location(self, folder: str) -> tuple[str, str, str]:
+        """(tvdbid, season, episode) from <root>/<tvdbid>/Sxx/Exx"""
+        parts = os.path.relpath(folder, self._root).split(os.sep)
+        if parts[0] in [".", ".."]:
+            return "", "", ""
+        parts += ["", ""]
+        return parts[0], parts[1].lstrip("S"), parts[2].lstrip("E")
+
+    def _mtime(self, folder: str) -> int | None:
+        row = self.db.execute(
+            "SELECT mtime_ns FROM dirs WHERE path = ?", (folder,)
+        ).fetchone()
+        return None if row is None else row[0]
+
+    def _forget(self, folder: str) -> None:
+        like = f"{folder}{os.sep}%"
+        with self._lock:
+            self.db.execute(
+                "DELETE FROM dirs WHERE path = ? OR path LIKE ?", (folder, like)
+            )
+            self.db.execute(
+                "DELETE FROM subs WHERE dir = ? OR dir LIKE ?", (folder, like)
+            )
+            self.db.commit()
+
+    def _scan(self, folder: str, mtime_ns: int) -> list[str]:
+        """Lists folder, only new or changed files are parsed again.
+        Returns the sub folders"""
+        with self._lock:
+            known = {
+                row[0]: (row[1], row[2])
+                for row in self.db.execute(
+                    "SELECT path, size, mtime_ns FROM subs WHERE dir = ?", (folder,)
+                )
+            }
+            known_dirs = {
+                row[0]
+                for row in self.db.execute(
+                    "SELECT path FROM dirs WHERE parent = ?", (folder,)
+                )
+            }
+        location = self._location(folder)
+        rows = []
+        present = set()
+        subdirs = []
+        for entry in os.scandir(folder):
+            if entry.name.startswith("."):
+                continue
+            if entry.is_dir():
+                subdirs.append(entry.path)
+                continue
+            st = entry.stat()
+            present.add(entry.path)
+            if known.get(entry.path) == (st.st_size, st.st_mtime_ns):
+                continue
+            try:
+                track = asdict(self._parse(entry.path))
+            except Exception:
+                LOG.debug(f"Not a subtitle export name: {entry.path}")
+                track = None
+            lang = track["language_ietf"] if track else ""
+            track_json = json.dumps(track) if track else None
+            rows.append(
+                (entry.path, folder, *location, lang, st.st_size, st.st_mtime_ns)
+                + ("", track_json)
+            )
+        for gone in set(known_dirs) - set(subdirs):
+            self._forget(gone)
+        with self._lock:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO subs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            self.db.executemany(
+                "DELETE FROM subs WHERE path = ?",
+                [(p,) for p in set(known) - present],
+            )
+            self.db.executemany(
+                "INSERT OR IGNORE INTO dirs VALUES (?, ?, 0)",
+                [(d, folder) for d in subdirs],
+            )
+            self.db.execute(
+                "INSERT OR REPLACE INTO dirs VALUES (?, ?, ?)",
+                (folder, os.path.dirname(folder), mtime_ns),
+            )
+            self.db.commit()
+        return subdirs
+
+    def _changed_files(self, folder: str) -> bool:
+        """True when a known file of folder was rewritten or removed"""
+        with self._lock:
+            rows = self.db.execute(
+                "SELECT path, size, mtime_ns FROM subs WHERE dir = ?", (folder,)
+            ).fetchall()
+        for row in rows:
+            try:
+                st = os.stat(row[0])
+            except OSError:
+                return True
+            if (st.st_size, st.st_mtime_ns) != tuple(row[1:]):
+                return True
+        return False
+
+    def _refresh_folder(self, folder: str) -> list[str] | None:
+        """Returns the sub folders, None if folder doesn't exist"""
+        try:
+            mtime_ns = os.stat(folder).st_mtime_ns
+        except OSError:
+            self._forget(folder)
+            return None
+        with self._lock:
+            known = self._mtime(folder)
+            if known == mtime_ns:
+                self.hits += 1
+                return [
+                    row[0]
+                    for row in self.db.execute(
+                        "SELECT path FROM dirs WHERE parent = ?", (folder,)
+                    )
+                ]
+        self.misses += 1
+        return self._scan(folder, mtime_ns)
+
+    def refresh(self, root: str = "") -> int:
+        """Brings the whole tree under root (the library by default) up to
+        date, returns how many folders had to be listed. Only the folder
+        mtimes are compared, see verify() for files rewritten in place"""
+        scanned = self.misses
+        stack = [os.path.normpath(root or self._root)]
+        while stack:
+            subdirs = self._refresh_folder(stack.pop())
+            if subdirs is not None:
+                stack.extend(subdirs)
+        return self.misses - scanned
+
+    def verify(self, folder: str) -> bool:
+        """Compares the known files of folder one by one, a stat each, and
+        invalidates it when one was rewritten or removed. True if it was"""
+        folder = os.path.normpath(folder)
+        if not self._changed_files(folder):
+            return False
+        LOG.debug(f"Files changed in place in {folder}")
+        self.invalidate(folder)
+        return True
+
+    def invalidate(self, folder: str) -> None:
+        with self._lock:
+            self.db.execute(
+                "UPDATE dirs SET mtime_ns = 0 WHERE path = ?",
+                (os.path.normpath(folder),),
+            )
+            self.db.commit()
+
+    def files(self, folder: str) -> list[str]:
+        """Paths of every file of folder, hidden ones excepted"""
+        folder = os.path.normpath(folder)
+        if self._refresh_folder(folder) is None:
+            return []
+        with self._lock:
+            rows = self.db.execute(
+                "SELECT path FROM subs WHERE dir = ? ORDER BY path", (folder,)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def tracks(self, folder: str) -> list[dict]:
+        """Parsed tracks of folder, as TrackInfo dicts"""
+        folder = os.path.normpath(folder)
+        if self._refresh_folder(folder) is None:
+            return []
+        with self._lock:
+            rows = self.db.execute(
+                "SELECT track FROM subs WHERE dir = ? AND track IS NOT NULL "
+                "ORDER BY path",
+                (folder,),
+            ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def query(
+        self, tvdbid: str = "", season: str = "", episode: str = "", language: str = ""
+    ) -> list[dict]:
+        """Tracks of the catalog, as it is (see refresh). language matches
+        the tag and its subtags: 'fr' matches 'fr-CA'"""
+        where = ["track IS NOT NULL"]
+        params: list[str] = []
+        for column, value in [
+            ("tvdbid", tvdbid),
+            ("season", season),
+            ("episode", episode),
+        ]:
+            if value != "":
+                where.append(f"{column} = ?")
+                params.append(str(value))
+        if language != "":
+            where.append("(language = ? OR language LIKE ?)")
+            params += [language, f"{language}-%"]
+        with self._lock:
+            rows = self.db.execute(
+                f"SELECT track FROM subs WHERE {' AND '.join(where)} ORDER BY path",
+                params,
+            ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def digest(self, file_path: str, compute) -> str:
+        """Content hash of a cataloged file, compute(path) -> str is only
+        called when it isn't known yet or the file changed"""
+        try:
+            st = os.stat(file_path)
+        except OSError:
+            return ""
+        with self._lock:
+            row = self.db.execute(
+                "SELECT size, mtime_ns, digest FROM subs WHERE path = ?", (file_path,)
+            ).fetchone()
+        current = row is not None and tuple(row[:2]) == (st.st_size, st.st_mtime_ns)
+        if current and row[2]:
+            return row[2]
+        digest = compute(file_path)
+        # A changed file is only stored again by the next scan of its folder
+        if current:
+            with self._lock:
+                self.db.execute(
+                    "UPDATE subs SET digest = ? WHERE path = ?", (digest, file_path)
+                )
+                self.db.commit()
+        return digest
@@ -1,35 +1,99 @@
 import logging
 import os
 
+
+class JobFilter(logging.Filter):
+    """Fills %(job)s with the worker thread name once episodes are
+    processed in parallel, it is empty otherwise"""
+
+    enabled = False
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.job = f"[{record.threadName}] " if self.enabled else ""
+        return True
+
+
 logger = logging.getLogger("submanagerr")
-handler = logging.FileHandler("logs.log")
+# The log file is only opened on the first record
+handler = logging.FileHandler("logs.log", delay=True)
 console_handler = logging.StreamHandler()
-console_formater = logging.Formatter("%(levelname)s - %(message)s")
-formatter = logging.Formatter("%(asctime)s - %(levelname)s - %(message)s")
+console_formater = logging.Formatter("%(levelname)s - %(job)s%(message)s")
+formatter = logging.Formatter("%(asctime)s - %(levelname)s - %(job)s%(message)s")
+job_filter = JobFilter()
 handler.setFormatter(formatter)
+handler.addFilter(job_filter)
 console_handler.setFormatter(console_formater)
+console_handler.addFilter(job_filter)
 logger.addHandler(handler)
 logger.addHandler(console_handler)
 logger.setLevel(logging.DEBUG)
 CONF_LOGGER = logger
+CONF_JOB_FILTER = job_filter
 
 host_url = os.getenv("HOST_URL", "http://10.100.3.2:8989")
 sonarr_api = os.getenv("HOST_API", "6339d80ef2354a8dbdf3ce8fd4528d4d")
 is_prod = True if os.getenv("ISDOCKER") == "docker" else False
-CONF_LOGGER.info(f"HOST_URL={host_url}")
-CONF_LOGGER.info(f"API={sonarr_api}")
 CONF_SONARR_HOST_URL = host_url
 CONF_SONARR_API = sonarr_api
-CONF_TEMP_FOLDER = os.path.dirname(os.path.abspath(__file__)) + "/temp/"
+# Sonarr calls answered with an error (503...) are tried again this many
+# times, RETRY_DELAY seconds apart (doubled every time)
+CONF_SONARR_RETRIES = int(os.getenv("SONARR_RETRIES", "2"))
+CONF_SONARR_RETRY_DELAY = float(os.getenv("SONARR_RETRY_DELAY", "1"))
+# Root of the per-episode temp workspaces, can point to a tmpfs
+CONF_TEMP_FOLDER = os.path.join(
+    os.getenv("TEMP_FOLDER", os.path.dirname(os.path.abspath(__file__)) + "/temp"),
+    "",
+)
+# Maximum space used by all the temp workspaces at once, 0 means no limit
+CONF_TEMP_BUDGET_MB = int(os.getenv("TEMP_BUDGET_MB", "0"))
+# Space reserved by every job for the subtitle intermediates
+CONF_TEMP_JOB_RESERVE_MB = int(os.getenv("TEMP_JOB_RESERVE_MB", "64"))
+# ffsubsync worker processes, shared by every job
+CONF_SYNC_JOBS = int(os.getenv("SYNC_JOBS", "2"))
 CONF_GRABING_FOLDER = "./grabs/"
+# Watch mode: seconds a grab file must stay unchanged before being treated,
+# and how often the folder is rescanned (only interval used without inotify)
+CONF_WATCH_DEBOUNCE = float(os.getenv("WATCH_DEBOUNCE", "2"))
+CONF_WATCH_POLL_INTERVAL = float(os.getenv("WATCH_POLL_INTERVAL", "5"))
+# Built-in receiver for Sonarr's Webhook connection, leave user and password
+# empty to disable basic authentication
+CONF_WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+CONF_WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8990"))
+CONF_WEBHOOK_USER = os.getenv("WEBHOOK_USER", "")
+CONF_WEBHOOK_PASSWORD = os.getenv("WEBHOOK_PASSWORD", "")
+# How big episodes are staged in TEMP_FOLDER before extraction:
+# "inplace" reads the original file, "link" tries a reflink then a hardlink
+# (same filesystem only), "copy" always makes a full copy
+CONF_TEMP_SOURCE_MODE = os.getenv("TEMP_SOURCE_MODE", "inplace")
+# With "link", fall back to a full copy when no link can be made
+CONF_TEMP_COPY_FALLBACK = os.getenv("TEMP_COPY_FALLBACK", "false") == "true"
 if is_prod:
-    CONF_LOGGER.info("Running in production environement")
     CONF_SUBTITLE_PATH = "/subtitles/"
 else:
-    CONF_LOGGER.info("Running in development environement")
     CONF_SUBTITLE_PATH = "/home/monheim/Documents/subtitles/"
 CONF_PROGRESS_FOLDER = "./progress/current.txt"
+CONF_PROGRESS_DB = "./progress/progress.sqlite"
+CONF_CACHE_FOLDER = os.getenv("CACHE_FOLDER", "./cache/")
+CONF_IDENTIFY_CACHE_MAX = int(os.getenv("IDENTIFY_CACHE_MAX", "100000"))
+CONF_LANG_CACHE_MAX = int(os.getenv("LANG_CACHE_MAX", "50000"))
+# Timings per stage, Prometheus text format or JSON if it ends with .json,
+# empty to disable. Long running modes rewrite it every METRICS_INTERVAL s
+CONF_METRICS_FILE = os.getenv("METRICS_FILE", "./metrics/metrics.prom")
+CONF_METRICS_INTERVAL = float(os.getenv("METRICS_INTERVAL", "30"))
+# Speech activity of the videos (ffsubsync .npz) used to sync subtitles
+# against the audio when no subtitle track of the video can be used.
+# Decoding the audio is expensive, so it is opt-in
+CONF_SYNC_AUDIO = os.getenv("SYNC_AUDIO", "false").lower() in ["true", "1", "yes"]
+CONF_SPEECH_CACHE_MAX = int(os.getenv("SPEECH_CACHE_MAX", "500"))
 CONF_DEFAULT_LANG = "fr"
+# Number of dialog lines read to identify the language of a subtitle track
+CONF_LANG_SAMPLE_LINES = int(os.getenv("LANG_SAMPLE_LINES", "400"))
+# Adaptive mode classifies chunks of LANG_FIRST_CHUNK, then 2x, 4x... lines
+# and stops once langid's probability reaches LANG_CONFIDENCE
+CONF_LANG_ADAPTIVE = os.getenv("LANG_ADAPTIVE", "true") == "true"
+CONF_LANG_CONFIDENCE = float(os.getenv("LANG_CONFIDENCE", "0.95"))
+CONF_LANG_FIRST_CHUNK = int(os.getenv("LANG_FIRST_CHUNK", "20"))
+CONF_LANG_MAX_LINES = int(os.getenv("LANG_MAX_LINES", "2000"))
 # Ressources for languages :
 # https://partnerhub.warnermediagroup.com/metadata/languages
 # https://www.techonthenet.com/js/language_tags.php
@@ -67,3 +131,12 @@ COMMON_LANGUAGE_TAGS = {
     "ar": "Arabic",
     "ru-RU": "Russian as spoken in Russia",
 }
+
+
+def log_settings() -> None:
+    CONF_LOGGER.info(f"HOST_URL={host_url}")
+    CONF_LOGGER.info(f"API={sonarr_api}")
+    if is_prod:
+        CONF_LOGGER.info("Running in production environement")
+    else:
+        CONF_LOGGER.info("Running in development environement")
@@ -1,31 +1,71 @@
-from dataclasses import dataclass
-from typing import Optional
+from dataclasses import dataclass, field
+from typing import Iterable, Iterator, Optional
+from itertools import islice
 from os.path import isdir
 from os import path
 import re
 import shutil
-from langcodes import Language
-from langcodes import standardize_tag
-from langcodes import closest_match
-import langcodes
-import py3langid as langid
-from pyarr import SonarrAPI
-from ass_parser import read_ass
-from ass_tag_parser import ass_to_plaintext
+import codecs
+import importlib
+import io
 import json
 import os
 import subprocess
+import fcntl
+import hashlib
+import tempfile
+import threading
+import time
 import configus
+from cachus import IDENTIFY_CACHE
+from cachus import file_fingerprint
+from cachus import LANG_CACHE, text_digest
+from cachus import SPEECH_CACHE, SubtitleCatalog
+from syncus import SYNC_ENGINE, SyncResult
+from metricus import METRICS, file_size
 
 SONARR_HOST_URL = configus.CONF_SONARR_HOST_URL
 SONARR_API = configus.CONF_SONARR_API
+SONARR_RETRIES = configus.CONF_SONARR_RETRIES
+SONARR_RETRY_DELAY = configus.CONF_SONARR_RETRY_DELAY
 TEMP_FOLDER = configus.CONF_TEMP_FOLDER
+TEMP_SOURCE_MODE = configus.CONF_TEMP_SOURCE_MODE
+TEMP_COPY_FALLBACK = configus.CONF_TEMP_COPY_FALLBACK
+TEMP_BUDGET = configus.CONF_TEMP_BUDGET_MB * 1024 * 1024
+TEMP_JOB_RESERVE = configus.CONF_TEMP_JOB_RESERVE_MB * 1024 * 1024
+SYNC_AUDIO = configus.CONF_SYNC_AUDIO
 DEFAULT_LANG = configus.CONF_DEFAULT_LANG
+LANG_SAMPLE_LINES = configus.CONF_LANG_SAMPLE_LINES
+LANG_ADAPTIVE = configus.CONF_LANG_ADAPTIVE
+LANG_CONFIDENCE = configus.CONF_LANG_CONFIDENCE
+LANG_FIRST_CHUNK = configus.CONF_LANG_FIRST_CHUNK
+LANG_MAX_LINES = configus.CONF_LANG_MAX_LINES
 SUBTITLE_PATH = configus.CONF_SUBTITLE_PATH
+CACHE_FOLDER = configus.CONF_CACHE_FOLDER
 LANGUAGE_TAGS = configus.COMMON_LANGUAGE_TAGS
 LOG = configus.CONF_LOGGER
 
 
+class LazyModule:
+    """Imports the module on first use, keeps the startup fast when the heavy
+    dependencies (and the langid model) aren't needed by the current run"""
+
+    def __init__(self, name: str) -> None:
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr: str):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+
+langcodes = LazyModule("langcodes")
+pyarr = LazyModule("pyarr")
+ass_parser = LazyModule("ass_parser")
+ass_tag_parser = LazyModule("ass_tag_parser")
+
+
 @dataclass
 class TrackInfo:
     trackId: str = ""
@@ -79,6 +119,23 @@ class AudioTrackInfo(TrackInfo):
     codec: str = ""
 
 
+@dataclass
+class MkvPlan:
+    """What has to change in a video: header edits per mkv trackId, done in
+    place with mkvpropedit, and the external tracks that need a remux"""
+
+    edits: dict = field(default_factory=dict)
+    remux: list[TrackInfo] = field(default_factory=list)
+
+    @property
+    def header_only(self) -> bool:
+        return len(self.remux) == 0 and len(self.edits) > 0
+
+    @property
+    def empty(self) -> bool:
+        return len(self.remux) == 0 and len(self.edits) == 0
+
+
 def check_forced(track_name: str) -> bool:
     keywords = ["signs", "songs", "forc", "s&s", "kara", "édit", "edit"]
     track_name_lower = track_name.lower()
@@ -151,7 +208,7 @@ def parse_subtitle_filename(file_path: str) -> TrackInfo:
         is_forced = True
         flags = flags.replace("forced", "")
     flags = flags.replace(".", "")
-    lang_ = standardize_tag(flags)
+    lang_ = langcodes.standardize_tag(flags)
     s.basedir = base_dir
     s.filename = file_name
     s.is_default = is_default
@@ -165,6 +222,11 @@ def parse_subtitle_filename(file_path: str) -> TrackInfo:
     return s
 
 
+SUB_CATALOG = SubtitleCatalog(
+    os.path.join(CACHE_FOLDER, "catalog.sqlite"), SUBTITLE_PATH, parse_subtitle_filename
+)
+
+
 def subtitle_export_name(t: TrackInfo) -> str:
     """Returns the file name for the subtitle without the parents dir
     In exemple:
@@ -246,7 +308,7 @@ def language_selector() -> str:
         v_list.append(value)
     txt = "BCP 47 tags are required: "
     lang = option_selector(k_list, v_list, txt)
-    lang = standardize_tag(lang)
+    lang = langcodes.standardize_tag(lang)
     return lang
 
 
@@ -322,15 +384,17 @@ def build_subtitle_tags(
     for sub in sub_list:
         fullpath = os.path.join(basedir, sub)
         if sub.endswith("ass"):
-            header = get_subtitle_header(fullpath, True)
+            sub_file = SubtitleFile(fullpath)
+            header = sub_file.header(True)
             title_parsed = parse_external_trackname(ep_path, sub)
-            title_parsed["identified_lang"] = identify_lang_in_dialog(fullpath)
+            title_parsed["identified_lang"] = identify_lang_in_dialog(sub_file)
             approuved_track = ask_user_input(header, title_parsed, guess)
             approuved_track.filepath = os.path.join(basedir, sub)
             sub_list_ok.append(approuved_track)
         if sub.endswith("srt") or sub.endswith("ssa"):
             title_parsed = parse_external_trackname(ep_path, sub)
-            title_parsed["identified_lang"] = identify_lang_in_dialog(fullpath)
+            sub_file = SubtitleFile(fullpath)
+            title_parsed["identified_lang"] = identify_lang_in_dialog(sub_file)
             approuved_track = ask_user_input({}, title_parsed, guess)
             approuved_track.filepath = os.path.join(basedir, sub)
             sub_list_ok.append(approuved_track)
@@ -366,14 +430,116 @@ def clean_header(sub: dict) -> dict:
     return sub
 
 
-def get_subtitle_header(sub_path: str, cleaning=False) -> dict:
+def track_key(track: TrackInfo) -> tuple[str, str, str]:
+    """(language, name, type) compared between external and MKV tracks"""
+    lang = str(track.language_ietf).lower().split("-")[0]
+    name = " ".join(str(track.trackname_combined).lower().split())
+    return lang, name, str(track.subtype).lower().lstrip(".")
+
+
+def subtitle_digest(sub_path: str) -> str:
+    """Hash of a subtitle file's content, text subtitles are decoded and
+    normalized first so encoding, case and whitespace don't matter.
+    Empty if the file can't be read"""
+    if sub_path == "":
+        return ""
+    try:
+        with open(sub_path, "rb") as file:
+            data = file.read()
+    except OSError:
+        return ""
+    if sub_path.endswith(("ass", "ssa", "srt", "vtt")):
+        return text_digest(decode_subtitle(data))
+    return hashlib.blake2b(data, digest_size=20).hexdigest()
+
+
+def decode_subtitle(data: bytes) -> str:
+    """Decodes a subtitle file, BOMs and UTF-8 are checked first because
+    they are the most common, the encoding is only detected otherwise"""
+    if data.startswith(codecs.BOM_UTF8):
+        return data[len(codecs.BOM_UTF8) :].decode("utf-8", errors="replace")
+    if data.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        return data.decode("utf-16", errors="replace")
     try:
-        content = get_subtitle_file_content(sub_path)
-        sub = read_ass(content)
-        sub = dict(sub.script_info)
+        return data.decode("utf-8")
+    except UnicodeDecodeError:
+        pass
+    try:
+        import cchardet as chardet
+    except ImportError:
+        import chardet
+    encoding = chardet.detect(data[:65536]).get("encoding") or "latin-1"
+    LOG.debug(f"Detected subtitle encoding: {encoding}")
+    try:
+        return data.decode(encoding, errors="replace")
+    except LookupError:
+        return data.decode("latin-1")
+
+
+class SubtitleFile:
+    """Reads an ass, ssa, srt or vtt file once and gives both its header
+    (Script Info) and a lazy iterator over its plain text dialog lines"""
+
+    def __init__(self, sub_path: str) -> None:
+        self._path = sub_path
+        self._ext = os.path.splitext(sub_path)[1].lstrip(".").lower()
+        self._text: str | None = None
+
+    @property
+    def path(self) -> str:
+        return self._path
+
+    @property
+    def ext(self) -> str:
+        return self._ext
+
+    @property
+    def text(self) -> str:
+        if self._text is None:
+            try:
+                with open(self._path, "rb") as file:
+                    self._text = decode_subtitle(file.read())
+            except OSError as e:
+                LOG.error(e)
+                self._text = ""
+        return self._text
+
+    def lines(self) -> Iterator[str]:
+        return iter(io.StringIO(self.text))
+
+    def header(self, cleaning=False) -> dict:
+        """Script Info of an ass/ssa file, parsing stops at the styles"""
+        header = {}
+        in_info = False
+        for line in self.lines():
+            line = line.strip()
+            if line.startswith("["):
+                if in_info:
+                    break
+                in_info = line.lower() == "[script info]"
+                continue
+            if not in_info or line == "" or line.startswith(";"):
+                continue
+            key, sep, value = line.partition(":")
+            if sep:
+                header[key.strip()] = value.strip()
         if cleaning:
-            sub = clean_header(sub)
-        return sub
+            header = clean_header(header)
+        return header
+
+    def dialogs(self) -> Iterator[str]:
+        if self._ext in ["ass", "ssa"]:
+            return iter_ass_lines_dialogs(self.lines())
+        if self._ext == "srt":
+            return iter_srt_dialogs(self.lines())
+        if self._ext == "vtt":
+            return iter_vtt_dialogs(self.lines())
+        return iter([])
+
+
+def get_subtitle_header(sub_path: str, cleaning=False) -> dict:
+    try:
+        return SubtitleFile(sub_path).header(cleaning)
     except Exception as e:
         LOG.error(f"Could not read subtitle header {e} on:")
         LOG.error(sub_path)
@@ -384,43 +550,144 @@ def get_subtitle_file_content(sub_path: str) -> str:
     return read_sub_file(sub_path)
 
 
-def identify_lang_in_dialog(sub_path: str) -> str:
-    content = get_subtitle_file_content(sub_path)
-    ext = str(os.path.splitext(sub_path)[1])
-    dialogs = ""
-    identify = ""
-    if ext.endswith("ass") or ext.endswith("ssa"):
-        dialogs = read_ass_dialogs(content)
-        identify = langid.classify(dialogs)[0]
-    elif ext.endswith("srt"):
-        dialogs = read_srt_dialogs(content)
-        identify = langid.classify(dialogs)[0]
-    else:
+def identify_lang_in_dialog(sub: str | SubtitleFile) -> str:
+    if isinstance(sub, str):
+        sub = SubtitleFile(sub)
+    if sub.ext not in ["ass", "ssa", "srt", "vtt"]:
         identify = "undefiend"
+    elif LANG_ADAPTIVE:
+        identify = classify_adaptive(sub.dialogs())[0]
+    else:
+        identify = identify_lang(" ".join(islice(sub.dialogs(), LANG_SAMPLE_LINES)))
     LOG.debug(f"Identified language={identify}")
     return str(identify)
 
 
-def read_ass_dialogs(ass_events) -> str:
+lang_identifier = None
+
+
+def classify(dialogs: str) -> tuple[str, float]:
+    """Returns langid's language and its probability (0 to 1)"""
+    global lang_identifier
+    with METRICS.span("langid"):
+        if lang_identifier is None:
+            from py3langid.langid import LanguageIdentifier, MODEL_FILE
+
+            lang_identifier = LanguageIdentifier.from_pickled_model(
+                MODEL_FILE, norm_probs=True
+            )
+        lang, probability = lang_identifier.classify(dialogs)
+    return str(lang), float(probability)
+
+
+def classify_cached(dialogs: str) -> tuple[str, float]:
+    """classify with a persistent cache keyed by the text hash"""
+    digest = text_digest(dialogs)
+    cached = LANG_CACHE.get(digest)
+    if cached is not None:
+        return cached
+    lang, probability = classify(dialogs)
+    LANG_CACHE.put(digest, lang, probability)
+    return lang, probability
+
+
+def identify_lang(dialogs: str) -> str:
+    return classify_cached(dialogs)[0]
+
+
+def classify_adaptive(
+    lines: Iterable[str],
+    threshold: float = LANG_CONFIDENCE,
+    first_chunk: int = LANG_FIRST_CHUNK,
+    max_lines: int = LANG_MAX_LINES,
+    cached: bool = True,
+) -> tuple[str, float]:
+    """Classifies growing samples (first_chunk lines, then twice as many...)
+    and stops as soon as the probability reaches threshold, so more lines
+    are only read when the result is ambiguous"""
+    classifier = classify_cached if cached else classify
+    result = ("und", 0.0)
+    sample: list[str] = []
+    classified = 0
+    target = first_chunk
+    for line in lines:
+        sample.append(line)
+        if len(sample) >= target or len(sample) >= max_lines:
+            result = classifier(" ".join(sample))
+            classified = len(sample)
+            LOG.debug(f"Language {result[0]} at {result[1]:.3f} on {classified} lines")
+            if result[1] >= threshold or classified >= max_lines:
+                return result
+            target *= 2
+    if len(sample) > classified:
+        result = classifier(" ".join(sample))
+    return result
+
+
+def iter_ass_dialogs(ass_events) -> Iterator[str]:
+    """Yields the plain text of every dialog line (event)"""
     try:
-        all_events = read_ass(ass_events).events
-        dialog_list = []
-        limit_line = 400
-        current_line = 0
+        all_events = ass_parser.read_ass(ass_events).events
         for dialog_line in all_events:
-            dialog_list.append(dialog_line.text)
-            current_line += 1
-            if current_line >= limit_line:
-                break
-        cleaned_list = []
-        for raw_dialog in dialog_list:
-            cleaning = ass_to_plaintext(raw_dialog)
-            cleaned_list.append(cleaning.replace("\n", " ").strip())
-        result = " ".join(cleaned_list)
-        return result
+            cleaning = ass_tag_parser.ass_to_plaintext(dialog_line.text)
+            cleaned = cleaning.replace("\n", " ").strip()
+            if cleaned != "":
+                yield cleaned
     except Exception as e:
         LOG.error(f"Could not read dialog lines (event) {e}")
-        return ""
+
+
+def iter_sub_file_dialogs(sub_path: str) -> Iterator[str]:
+    return SubtitleFile(sub_path).dialogs()
+
+
+def iter_ass_lines_dialogs(lines: Iterable[str]) -> Iterator[str]:
+    """Yields the plain text of the Dialogue lines of an ass/ssa file"""
+    for line in lines:
+        if not line.startswith("Dialogue:"):
+            continue
+        fields = line.rstrip("\r\n").split(",", 9)
+        if len(fields) < 10:
+            continue
+        try:
+            cleaned = ass_tag_parser.ass_to_plaintext(fields[9])
+        except Exception:
+            cleaned = re.sub(r"\{[^}]*\}", "", fields[9])
+        cleaned = cleaned.replace("\\N", " ").replace("\n", " ").strip()
+        if cleaned != "":
+            yield cleaned
+
+
+def iter_vtt_dialogs(lines: Iterable[str]) -> Iterator[str]:
+    in_note = False
+    for line in lines:
+        line = line.strip()
+        if line == "":
+            in_note = False
+            continue
+        if in_note or line.startswith(("WEBVTT", "STYLE", "REGION")):
+            continue
+        if line.startswith("NOTE"):
+            in_note = True
+            continue
+        if "-->" in line or line.isnumeric():
+            continue
+        yield re.sub(r"<[^>]*>", "", line)
+
+
+def iter_srt_dialogs(content: Iterable[str] | str) -> Iterator[str]:
+    timecode = r"^\d{2}:\d{2}:\d{2},\d{3} --> \d{2}:\d{2}:\d{2},\d{3}"
+    if isinstance(content, str):
+        content = content.splitlines()
+    for line in content:
+        line = line.strip()
+        if line == "" or line.isnumeric() or re.match(timecode, line):
+            continue
+        yield re.sub(r"<[^>]*>", "", line)
+
+
+def read_ass_dialogs(ass_events) -> str:
+    return " ".join(islice(iter_ass_dialogs(ass_events), 400))
 
 
 def read_srt_dialogs(content: str) -> str:
@@ -430,23 +697,158 @@ def read_srt_dialogs(content: str) -> str:
     return cleaned.replace("\n", " ")
 
 
-def read_sub_file(sub_path: str) -> str:
+def iter_stream_dialogs(pipe: Iterable[bytes], read: list[int]) -> Iterator[str]:
+    """Dialog lines of an srt stream written by ffmpeg, read[0] counts the
+    bytes read"""
+    timecode = r"^\d{2}:\d{2}:\d{2},\d{3} --> \d{2}:\d{2}:\d{2},\d{3}"
+    tags = r"\{[^}]*\}|<[^>]*>"
+    for raw_line in pipe:
+        read[0] += len(raw_line)
+        line = raw_line.decode("utf-8", errors="replace").strip()
+        if line == "" or line.isnumeric() or re.match(timecode, line):
+            continue
+        line = re.sub(tags, "", line).replace("\\N", " ").strip()
+        if line != "":
+            yield line
+
+
+def _stream_lang(pipe, read: list[int], identified: threading.Event) -> str | None:
+    """Language of the track written to pipe, None if it had no dialog.
+    The pipe is drained afterwards so ffmpeg never blocks on it"""
+    taken = 0
+
+    def sample() -> Iterator[str]:
+        nonlocal taken
+        for line in iter_stream_dialogs(pipe, read):
+            taken += 1
+            yield line
+
+    if LANG_ADAPTIVE:
+        lang = classify_adaptive(sample())[0]
+    else:
+        lines = list(islice(sample(), LANG_SAMPLE_LINES))
+        lang = identify_lang(" ".join(lines)) if len(lines) > 0 else ""
+    identified.set()
+    for _ in pipe:
+        pass
+    if taken == 0:
+        return None
+    LOG.debug(f"Language {lang} identified on {taken} streamed lines")
+    return lang
+
+
+def stream_tracks_lang(video_file: str, track_ids: list) -> dict[str, str]:
+    """Identifies the language of subtitle tracks straight from the
+    container, in one single ffmpeg pass whatever the number of tracks.
+    ffmpeg writes every track as srt to its own pipe, each pipe is
+    classified (see classify_adaptive) while it is read and ffmpeg is
+    stopped as soon as every track is identified. ffmpeg is used because
+    mkvextract only writes ASS tracks once the whole file was read, the
+    mkvmerge track ID is the ffmpeg stream index.
+    Returns trackId -> language, without the tracks that couldn't be read"""
+    if len(track_ids) == 0:
+        return {}
+    pipes = [os.pipe() for _ in track_ids]
+    cmd = ["ffmpeg", "-nostdin", "-v", "error", "-i", video_file]
+    for track_id, (_, w) in zip(track_ids, pipes):
+        cmd += ["-map", f"0:{track_id}", "-f", "srt", f"pipe:{w}"]
+    LOG.debug(cmd)
     try:
-        num_lines: int = 400
-        with open(sub_path, "r") as file:
-            file_content = ""
-            lines_read = 0
-            for line in file:
-                file_content += line
-                lines_read += 1
-                if num_lines is not None and lines_read >= num_lines:
-                    break
-            return file_content
+        proc = subprocess.Popen(
+            cmd,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            pass_fds=[w for _, w in pipes],
+        )
+    except OSError as e:
+        LOG.debug(f"Could not stream subtitle tracks: {e}")
+        for r, w in pipes:
+            os.close(r)
+            os.close(w)
+        return {}
+    for _, w in pipes:
+        os.close(w)
+    langs: dict[str, str | None] = {}
+    reads = [[0] for _ in track_ids]
+    events = [threading.Event() for _ in track_ids]
+
+    def read_track(track_id, r: int, read: list[int], event: threading.Event):
+        with os.fdopen(r, "rb") as pipe:
+            try:
+                langs[str(track_id)] = _stream_lang(pipe, read, event)
+            finally:
+                event.set()
+
+    threads = [
+        threading.Thread(target=read_track, args=(track_id, r, read, event))
+        for track_id, (r, _), read, event in zip(track_ids, pipes, reads, events)
+    ]
+    with METRICS.span("ffmpeg.stream") as span:
+        for thread in threads:
+            thread.start()
+        try:
+            # The pipes are closed by ffmpeg when it stops, so this ends
+            for event in events:
+                event.wait()
+        finally:
+            if proc.poll() is None:
+                proc.kill()
+            proc.wait()
+            for thread in threads:
+                thread.join()
+        span.read = sum(read[0] for read in reads)
+    return {k: v for k, v in langs.items() if v is not None}
+
+
+def read_sub_file(sub_path: str, num_lines: int | None = 400) -> str:
+    try:
+        lines = SubtitleFile(sub_path).lines()
+        if num_lines is not None:
+            lines = islice(lines, num_lines)
+        return "".join(lines)
     except Exception as e:
         LOG.error(e)
         return ""
 
 
+def legacy_language(tag: str) -> str:
+    """ISO 639-2/B code for the old Matroska language element"""
+    try:
+        return langcodes.Language.get(tag).to_alpha3(variant="B")
+    except Exception:
+        return "und"
+
+
+def build_propedit_flags(edits: dict) -> str:
+    """Flags for mkvpropedit from MkvPlan.edits, where the key is the
+    track number (mkvmerge -J properties.number)"""
+    flags = ""
+    for number, edit in edits.items():
+        flags = f"{flags} --edit track:@{number}"
+        if "language" in edit:
+            flags = f'{flags} --set language={legacy_language(edit["language"])}'
+            flags = f'{flags} --set language-ietf="{edit["language"]}"'
+        if "default" in edit:
+            flags = f'{flags} --set flag-default={int(edit["default"])}'
+        if "forced" in edit:
+            flags = f'{flags} --set flag-forced={int(edit["forced"])}'
+    return flags
+
+
+def build_source_flags(edits: dict) -> str:
+    """Same edits as mkvmerge options for the tracks of the source file,
+    here the key is the mkvmerge trackId"""
+    flags = ""
+    for track_id, edit in edits.items():
+        if "language" in edit:
+            flags = f'{flags} --language {track_id}:"{edit["language"]}"'
+        if "default" in edit:
+            flags = f'{flags} --default-track-flag {track_id}:{int(edit["default"])}'
+        if "forced" in edit:
+            flags = f'{flags} --forced-display-flag {track_id}:{int(edit["forced"])}'
+    return flags
+
+
 def build_track_flags(track: TrackInfo) -> str:
     i = "0"
     tn = f'--track-name {i}:"{track.trackname_combined}"'
@@ -464,41 +866,66 @@ def build_track_flags(track: TrackInfo) -> str:
     return fullstring
 
 
-def sync_subtitles(ref: str, unsync: str, cwdir: str = "") -> str:
-    bname = os.path.basename(unsync)
-    refbname = os.path.basename(ref)
-    sync_path = f"{TEMP_FOLDER}subs/synced.{bname}"
-    if cwdir == "":
-        cwdir = f"{TEMP_FOLDER}subs/"
-    if not os.path.exists(cwdir):
-        os.makedirs(cwdir)
-    ext = os.path.splitext(unsync)[1]
-    cmd = f'ffsubsync {refbname} -i "{bname}" -o s{ext}'
-    LOG.debug(cmd)
-    out = subprocess.run(
-        cmd,
-        shell=True,
-        check=True,
-        cwd=cwdir,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        text=True,
-    )
-    out_txt = f"{out.stdout}{out.stderr}"
-    LOG.info(out_txt)
-    if check_sync_offset(out_txt):
-        shutil.move(f"{cwdir}s{ext}", sync_path)
+def speech_reference(video_file: str, fingerprint_of: str = "") -> str | None:
+    """ffsubsync serialized speech of the whole video, the audio is only
+    decoded the first time. fingerprint_of is the file whose fingerprint
+    keys the cache when video_file is a temp copy of it"""
+    if fingerprint_of == "":
+        fingerprint_of = video_file
+    npz_path = SPEECH_CACHE.get(fingerprint_of)
+    if npz_path is not None:
+        LOG.debug(f"Speech reference cache hit for {fingerprint_of}")
+        return npz_path
+    npz_path = SPEECH_CACHE.path(fingerprint_of)
+    if npz_path == "":
+        return None
+    with SPEECH_CACHE.lock(npz_path):
+        if os.path.exists(npz_path):
+            return npz_path
+        folder = os.path.dirname(npz_path)
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        built = f"{os.path.splitext(npz_path)[0]}.{threading.get_ident()}.npz"
+        LOG.info(f"Extracting speech from the audio of {fingerprint_of}")
+        with METRICS.span("sync.speech", read=file_size(video_file)):
+            if not SYNC_ENGINE.serialize_speech(video_file, built):
+                return None
+        return SPEECH_CACHE.put(built, fingerprint_of)
+
+
+def keep_synced(result: SyncResult, cwdir: str) -> str:
+    """Keeps the ffsubsync output if the offset is acceptable"""
+    if result.error != "":
+        LOG.error(f"Could not synchronize {result.unsync}: {result.error}")
+    elif result.success:
+        LOG.info(
+            f"Synchronized {os.path.basename(result.unsync)}: offset "
+            f"{result.offset_seconds:.3f}s, framerate scale "
+            f"{result.framerate_scale_factor:.3f}"
+        )
+    if result.success and check_sync_offset(result.offset_seconds):
+        sync_path = f"{cwdir}synced.{os.path.basename(result.unsync)}"
+        shutil.move(result.output, sync_path)
         return sync_path
     else:
-        return unsync
+        if os.path.exists(result.output):
+            os.remove(result.output)
+        return result.unsync
+
+
+# The long running modes never wait on a prompt, see disable_prompts
+prompts = True
 
 
-def check_sync_offset(out: str) -> bool:
-    pattern = r"offset seconds: (-?\d+\.\d+)"
-    matchre = re.search(pattern, out)
-    offset: float = 0.0
-    if matchre:
-        offset: float = float(matchre.group(1))
+def disable_prompts() -> None:
+    """For the daemon modes: nobody answers a prompt there, under docker or
+    systemd stdin is closed. Questions get the default answer (no)"""
+    global prompts
+    prompts = False
+
+
+def check_sync_offset(offset: float | None) -> bool:
+    if offset is not None:
         if offset < -2.0 or offset > 2.0:
             LOG.warning(
                 "Subtitles won' be syncronized due too big offset"
@@ -508,7 +935,13 @@ def check_sync_offset(out: str) -> bool:
                 "You can still force the syncronization "
                 f"(current offset: {offset} seconds)"
             )
-            yn = input("[y/N]: ")
+            if not prompts or threading.current_thread() is not threading.main_thread():
+                LOG.warning("Can't ask for confirmation, synchronization skipped")
+                return False
+            try:
+                yn = input("[y/N]: ")
+            except EOFError:
+                return False
             if yn.lower().startswith("y"):
                 return True
             else:
@@ -519,28 +952,157 @@ def check_sync_offset(out: str) -> bool:
         return False
 
 
-def export(video_file: str, track_id: str | int, path: str) -> str:
-    cmd = [f'mkvextract tracks "{video_file}" {str(track_id)}:"{path}"']
-    LOG.debug(cmd)
-    subprocess.run(cmd, shell=True, check=True)
-    return path
+def export_batch(video_file: str, tracks: list[tuple[str | int, str]]) -> dict:
+    exported: dict[str, str] = {}
+    if len(tracks) == 0:
+        return exported
+    targets = ""
+    for track_id, path in tracks:
+        dirname = os.path.dirname(path)
+        if dirname != "" and not os.path.exists(dirname):
+            os.makedirs(dirname)
+        targets = f'{targets} {str(track_id)}:"{path}"'
+        exported[str(track_id)] = path
+    # mkvextract goes through the whole file whatever the tracks
+    with METRICS.span("mkvextract", read=file_size(video_file)) as span:
+        try:
+            cmd = [f'mkvextract tracks "{video_file}"{targets}']
+            LOG.debug(cmd)
+            subprocess.run(cmd, shell=True, check=True)
+        except Exception as e:
+            LOG.error(f"Could not export track(s): {e}")
+        span.written = sum(file_size(path) for path in exported.values())
+    return exported
+
+
+FICLONE = 0x40049409
+
+
+def reflink(src: str, dst: str) -> bool:
+    """Clone src into dst sharing the same extents (btrfs, xfs, zfs...)"""
+    try:
+        with open(src, "rb") as s, open(dst, "wb") as d:
+            fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+        return True
+    except OSError:
+        if os.path.exists(dst):
+            os.remove(dst)
+        return False
+
+
+def same_filesystem(src: str, dst_dir: str) -> bool:
+    try:
+        return os.stat(src).st_dev == os.stat(dst_dir).st_dev
+    except OSError:
+        return False
+
+
+class TempBudget:
+    """Shared accounting of the space used by the temp workspaces,
+    a job waits until its reservation fits into the budget"""
+
+    def __init__(self, budget: int) -> None:
+        self._budget = budget
+        self._used = 0
+        self._cond = threading.Condition()
+
+    def reserve(self, size: int) -> None:
+        if self._budget <= 0:
+            return
+        with self._cond:
+            # A job bigger than the whole budget still runs, but alone
+            while self._used > 0 and self._used + size > self._budget:
+                LOG.debug(f"Waiting for temp space ({size} bytes needed)")
+                self._cond.wait()
+            self._used += size
+
+    def release(self, size: int) -> None:
+        if self._budget <= 0:
+            return
+        with self._cond:
+            self._used -= size
+            self._cond.notify_all()
+
+
+TEMP_SPACE = TempBudget(TEMP_BUDGET)
+
+
+class TempWorkspace:
+    """Private temp folder for one episode job, removed on exit.
+    Usage:
+        with TempWorkspace(reserve) as temp_folder:
+            ...
+    """
+
+    def __init__(self, reserve: int = TEMP_JOB_RESERVE, root: str = TEMP_FOLDER):
+        self._reserve = reserve
+        self._root = root
+        self._path = ""
+
+    @staticmethod
+    def estimate(video_path: str) -> int:
+        """Temp space a job may need: the subtitle intermediates, plus the
+        whole video when it is copied in temp. Remuxes don't count, they
+        are written next to the original video"""
+        size = TEMP_JOB_RESERVE
+        try:
+            video_size = os.path.getsize(video_path)
+        except OSError:
+            return size
+        if TEMP_SOURCE_MODE == "copy" or TEMP_COPY_FALLBACK:
+            size += video_size
+        return size
+
+    @property
+    def path(self) -> str:
+        return self._path
+
+    def __enter__(self) -> str:
+        TEMP_SPACE.reserve(self._reserve)
+        if not os.path.exists(self._root):
+            os.makedirs(self._root)
+        self._path = os.path.join(tempfile.mkdtemp(prefix="job-", dir=self._root), "")
+        LOG.debug(f"Temp workspace: {self._path}")
+        return self._path
+
+    def __exit__(self, *exc) -> None:
+        shutil.rmtree(self._path, ignore_errors=True)
+        TEMP_SPACE.release(self._reserve)
 
 
 class SubSync:
-    def __init__(self, refmkv: list[TrackInfo], unsync: list[TrackInfo], vpath: str):
+    def __init__(
+        self,
+        refmkv: list[TrackInfo],
+        unsync: list[TrackInfo],
+        vpath: str,
+        temp_folder: str = TEMP_FOLDER,
+        extract=None,
+        speech=None,
+    ):
+        """extract(vpath, [(trackId, path)]) -> {trackId: path} pulls the
+        reference tracks, MkvAnalyzer.reference_tracks reuses the ones
+        the job already extracted.
+        speech(vpath) -> .npz path is the audio reference for the tracks
+        without a matching subtitle track (see SYNC_AUDIO)"""
         self._ref: list[TrackInfo] = refmkv
         self._un: list[TrackInfo] = unsync
+        self._temp_folder = f"{temp_folder}subs/"
         reflang: list[str] = []
-        refpath = f"{TEMP_FOLDER}subs/ref"
+        refpath = f"{self._temp_folder}ref"
+        if not os.path.exists(self._temp_folder):
+            os.makedirs(self._temp_folder)
         for r in refmkv:
             if "sup" not in r.subtype:
                 reflang.append(r.language_ietf)
+        to_sync: list[tuple[TrackInfo, TrackInfo]] = []
+        no_ref: list[TrackInfo] = []
         for t in unsync:
             if t.to_remux:
-                t.filepath = shutil.copy(t.filepath, f"{TEMP_FOLDER}subs/")
+                t.filepath = shutil.copy(t.filepath, self._temp_folder)
                 lngstr = t.language_ietf
-                lng_match = closest_match(lngstr, reflang, 100)
-                lngdiplay = Language.make(lng_match[0]).display_name()
+                lng_match = langcodes.closest_match(lngstr, reflang, 100)
+                lngdiplay = langcodes.Language.make(lng_match[0]).display_name()
                 LOG.debug(
                     f"Closest matching language: '{lngdiplay}' "
                     f"with distance {lng_match[1]}/100"
@@ -549,22 +1111,42 @@ class SubSync:
                     if r.language_ietf in lng_match or "und" in lng_match:
                         if r.is_forced == t.is_forced:
                             if "sup" not in r.subtype:
-                                ref = export(
-                                    vpath, str(r.trackId), f"{refpath}.{r.subtype}"
-                                )
-                                try:
-                                    t.filepath = sync_subtitles(ref, t.filepath)
-                                    break
-                                except Exception as e:
-                                    LOG.error(e)
-                                    break
+                                to_sync.append((t, r))
+                                break
+                if len(to_sync) == 0 or to_sync[-1][0] is not t:
+                    no_ref.append(t)
+        # Every reference track is pulled out of the video in one single pass
+        refs: dict[str, str] = {}
+        for t, r in to_sync:
+            refs[str(r.trackId)] = f"{refpath}{r.trackId}.{r.subtype}"
+        if extract is None:
+            extract = export_batch
+        exported = extract(vpath, list(refs.items()))
+        pairs = [(t, exported[str(r.trackId)]) for t, r in to_sync]
+        if len(no_ref) > 0 and SYNC_AUDIO:
+            if speech is None:
+                speech = speech_reference
+            npz_path = speech(vpath)
+            if npz_path is not None:
+                LOG.debug(f"{len(no_ref)} track(s) synchronized against the audio")
+                pairs += [(t, npz_path) for t in no_ref]
+        # The sync workers run in parallel, the offsets are checked one by
+        # one here as check_sync_offset may need to prompt
+        jobs = [
+            (ref, t.filepath, f"{self._temp_folder}out.{os.path.basename(t.filepath)}")
+            for t, ref in pairs
+        ]
+        with METRICS.span("sync"):
+            results = SYNC_ENGINE.sync_batch(jobs)
+        for (t, ref), result in zip(pairs, results):
+            t.filepath = keep_synced(result, self._temp_folder)
 
     @property
     def syncronized(self) -> list[TrackInfo]:
         return self._un
 
     def del_temp(self) -> None:
-        temp_folder = f"{TEMP_FOLDER}subs/"
+        temp_folder = self._temp_folder
         if os.path.exists(temp_folder) and os.path.isdir(temp_folder):
             files = os.listdir(temp_folder)
             if files:
@@ -575,7 +1157,7 @@ class SubSync:
 
 
 class Episode:
-    def __init__(self):
+    def __init__(self, temp_folder: str = TEMP_FOLDER):
         self._serie_id = ""
         self._serie_title = ""
         self._ep_id = ""
@@ -589,7 +1171,7 @@ class Episode:
         self._release = ""
         self.tvdbid = ""
         self._copy_temp_path = ""
-        self._temp_folder = TEMP_FOLDER
+        self._temp_folder = temp_folder
 
     @property
     def serie_id(self):
@@ -702,9 +1284,44 @@ class Episode:
         self._ep_id = value.get("sonarr_episodefile_episodeids")
         self._serie_title = value.get("sonarr_series_title")
 
-    def copy_temp(self) -> str:
-        LOG.debug(f"Make temp copy of {self._video_path}")
-        path = shutil.copy(self._video_path, self._temp_folder)
+    def copy_temp(self, mode: str = "") -> str:
+        """Returns a path to read the video from, avoiding a full copy
+        whenever possible (see CONF_TEMP_SOURCE_MODE)"""
+        if mode == "":
+            mode = TEMP_SOURCE_MODE
+        src = self._video_path
+        size = os.path.getsize(src)
+        dst = os.path.join(self._temp_folder, os.path.basename(src))
+        if mode == "inplace":
+            LOG.debug(f"Reading {src} in place, saved {size} bytes")
+            self._copy_temp_path = src
+            return src
+        if mode == "link":
+            if not os.path.exists(self._temp_folder):
+                os.makedirs(self._temp_folder)
+            if same_filesystem(src, self._temp_folder):
+                if os.path.exists(dst):
+                    os.remove(dst)
+                if reflink(src, dst):
+                    LOG.debug(f"Reflinked {src}, saved {size} bytes")
+                    self._copy_temp_path = dst
+                    return dst
+                try:
+                    os.link(src, dst)
+                    LOG.debug(f"Hardlinked {src}, saved {size} bytes")
+                    self._copy_temp_path = dst
+                    return dst
+                except OSError as e:
+                    LOG.debug(f"Could not hardlink {src}: {e}")
+            if not TEMP_COPY_FALLBACK:
+                LOG.debug(
+                    f"No link possible, reading {src} in place, saved {size} bytes"
+                )
+                self._copy_temp_path = src
+                return src
+        LOG.debug(f"Make temp copy of {src} ({size} bytes)")
+        with METRICS.span("copy_temp", read=size, written=size):
+            path = shutil.copy(src, self._temp_folder)
         self._copy_temp_path = path
         return path
 
@@ -720,12 +1337,15 @@ class Episode:
 
 
 class MkvAnalyzer:
-    def __init__(self):
+    def __init__(self, temp_folder: str = TEMP_FOLDER):
         self._audio = []
         self.__subs = []
         self._tracks = {}
+        self._cached_subs: list[dict] | None = None
         self._video_path = ""
-        self._temp_folder = TEMP_FOLDER
+        self._temp_folder = temp_folder
+        # (video, trackId) -> path of every track extracted during the job
+        self._extracted: dict[tuple[str, str], str] = {}
 
     @property
     def subs(self) -> list[TrackInfo]:
@@ -745,18 +1365,31 @@ class MkvAnalyzer:
             json_data = self._tracks
         if video_path == "":
             video_path = self._video_path
+        if json_data is self._tracks and self._cached_subs is not None:
+            self.__subs = [TrackInfo(**t) for t in self._cached_subs]
+            LOG.debug(f"Subtitle tracks of {video_path} read from cache")
+            return len(self.__subs) > 0
+        to_guess: list[TrackInfo] = []
         if json_data.get("tracks") is not None:
             for track in json_data["tracks"]:
                 if track["type"] == "subtitles":
                     subfounds = True
-                    self._analyze_sub_track(track, video_path)
+                    s = self._analyze_sub_track(track, video_path)
+                    if s is not None and s.language_ietf == "und":
+                        to_guess.append(s)
+        if len(to_guess) > 0:
+            self.guess_lang_harder_batch(video_path, to_guess)
+        for s in self.__subs:
+            self._finalize_sub_track(s)
+        if json_data is self._tracks and video_path == self._video_path:
+            IDENTIFY_CACHE.put(video_path, json_data, self.__subs)
         if subfounds:
             LOG.debug(f"Subtitles found for {video_path}")
         else:
             LOG.debug(f"No subtitle tracks for {video_path}")
         return subfounds
 
-    def _analyze_sub_track(self, track: dict, video_path: str) -> None:
+    def _analyze_sub_track(self, track: dict, video_path: str) -> TrackInfo | None:
         try:
             s = TrackInfo()
             s.filepath = video_path
@@ -777,33 +1410,48 @@ class MkvAnalyzer:
             if track_lang == "und":
                 track_lang = self.guess_lang(track_name)
             if track_lang == "und" or not track_lang:
-                track_lang = self.guess_lang_harder(
-                    video_path, track_id, sub_type_extention
-                )
-            if track_lang != "und" and track_name == "und":
-                track_name = (
-                    f"{Language.get(track_lang).display_name()} # "
-                    f"{Language.get(track_lang).display_name(track_lang)}"
-                )
-            if track_lang != "und":
-                if DEFAULT_LANG in track_lang:
-                    s.is_default = True
-            track_lang = standardize_tag(track_lang)
+                # Resolved later in a single extraction pass for all tracks
+                track_lang = "und"
             s.trackId = track_id
             s.subtype = sub_type_extention
             s.trackname = track_name
             s.is_forced = is_forced
-            s.language_ietf = track_lang
+            s.language_ietf = str(track_lang)
             self.__subs.append(s)
+            return s
+        except Exception as e:
+            LOG.error(f"Can't dertermine subtitle {e}")
+            return None
+
+    def _finalize_sub_track(self, s: TrackInfo) -> None:
+        try:
+            track_lang = s.language_ietf
+            if track_lang != "und" and s.trackname == "und":
+                s.trackname = (
+                    f"{langcodes.Language.get(track_lang).display_name()} # "
+                    f"{langcodes.Language.get(track_lang).display_name(track_lang)}"
+                )
+            if track_lang != "und":
+                if DEFAULT_LANG in track_lang:
+                    s.is_default = True
+            s.language_ietf = langcodes.standardize_tag(track_lang)
         except Exception as e:
             LOG.error(f"Can't dertermine subtitle {e}")
 
     def identify(self, video_file: str) -> bool:
+        self._cached_subs = None
+        cached = IDENTIFY_CACHE.get(video_file)
+        if cached is not None:
+            LOG.debug(f"Identify cache hit for {video_file}")
+            self._video_path = video_file
+            self._tracks, self._cached_subs = cached
+            return not self._tracks["errors"]
         json_data = ""
         cmd = [f'mkvmerge -i -J "{video_file}"']
         LOG.debug(cmd)
-        proc = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE)
-        json_data, err = proc.communicate()
+        with METRICS.span("mkvmerge.identify"):
+            proc = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE)
+            json_data, err = proc.communicate()
         json_data = json_data.decode("utf-8")
         json_data = json.loads(json_data)
         self._video_path = video_file
@@ -816,54 +1464,266 @@ class MkvAnalyzer:
 
     def guess_lang(self, track_name):
         try:
-            track_lang = Language.find(track_name)
+            track_lang = langcodes.Language.find(track_name)
             return track_lang
         except LookupError:
             LOG.warning("Unable to determine language for subtitle track")
             return False
 
     def guess_lang_harder(self, video_file, track_id, sub_extention):
-        text_subs = ["ass", "ssa", "srt"]
-        result = "und"
-        tempy = f"{TEMP_FOLDER}subid.{sub_extention}"
-        if sub_extention in text_subs:
-            LOG.debug("Extracting subtitle track to indentify lang from text")
-            sub_path = self.export(video_file, track_id, tempy)
-            result = identify_lang_in_dialog(sub_path)
-        return result
+        t = TrackInfo(trackId=track_id, subtype=sub_extention, language_ietf="und")
+        self.guess_lang_harder_batch(video_file, [t])
+        return t.language_ietf
+
+    def guess_lang_harder_batch(self, video_file: str, tracks: list[TrackInfo]):
+        """Identify the language of every given track from its dialogs.
+        Every text track is streamed from the container in one ffmpeg pass
+        (see stream_tracks_lang), tracks that can't be streamed are
+        extracted all together in one mkvextract pass.
+        The result is written in place to TrackInfo.language_ietf"""
+        with METRICS.span("guess_lang_harder"):
+            text_subs = ["ass", "ssa", "srt"]
+            to_stream = [t for t in tracks if t.subtype in text_subs]
+            streamed = stream_tracks_lang(video_file, [t.trackId for t in to_stream])
+            pairs: list[tuple[str | int, str]] = []
+            for t in to_stream:
+                lang = streamed.get(str(t.trackId))
+                if lang is not None:
+                    t.language_ietf = lang
+                    LOG.debug(f"Identified language={t.language_ietf}")
+                    continue
+                temp_path = f"{self._temp_folder}subid{t.trackId}.{t.subtype}"
+                pairs.append((t.trackId, temp_path))
+            if len(pairs) == 0:
+                return
+            LOG.debug("Extracting subtitle track(s) to indentify lang from text")
+            extracted = self.export_batch(video_file, pairs)
+            for t in tracks:
+                sub_path = extracted.get(str(t.trackId))
+                if sub_path is not None and os.path.exists(sub_path):
+                    t.language_ietf = identify_lang_in_dialog(sub_path)
+                    os.remove(sub_path)
 
     def export(self, v_file: str, track_id: str | int, path: str) -> str:
+        return self.export_batch(v_file, [(track_id, path)]).get(str(track_id), path)
+
+    def export_batch(
+        self, v_file: str, tracks: list[tuple[str | int, str]]
+    ) -> dict[str, str]:
+        """Extract every (trackId, destination) pair with a single mkvextract
+        call, so the container is read only once.
+        Returns a dict of trackId -> destination path"""
+        exported = export_batch(v_file, tracks)
+        for track_id, path in exported.items():
+            self._extracted[(v_file, track_id)] = path
+        return exported
+
+    def speech_reference(self, v_file: str) -> str | None:
+        """Speech of v_file, cached under the fingerprint of the original
+        video as v_file may be a temp copy"""
+        return speech_reference(v_file, self._video_path)
+
+    def extracted(self, v_file: str) -> dict[str, str]:
+        """trackId -> path of the tracks extracted from v_file so far"""
+        return {
+            track_id: path
+            for (video, track_id), path in self._extracted.items()
+            if video == v_file
+        }
+
+    def reference_tracks(
+        self, v_file: str, tracks: list[tuple[str | int, str]]
+    ) -> dict[str, str]:
+        """Same as export_batch but any track this analyzer already extracted
+        from v_file is reused where it is, whatever the destination asked"""
+        refs: dict[str, str] = {}
+        missing = []
+        for track_id, path in tracks:
+            done = self._extracted.get((v_file, str(track_id)), "")
+            if done != "" and os.path.exists(done):
+                refs[str(track_id)] = done
+            else:
+                missing.append((track_id, path))
+        LOG.debug(f"{len(refs)} reference track(s) reused, {len(missing)} to extract")
+        refs.update(self.export_batch(v_file, missing))
+        return refs
+
+    def _container_props(self, track_id: str | int) -> dict:
+        for track in self._tracks.get("tracks", []):
+            if str(track.get("id")) == str(track_id):
+                return track.get("properties", {})
+        return {}
+
+    def plan_changes(
+        self, ext_tracks: list[TrackInfo], own_files: Iterable[str] = ()
+    ) -> MkvPlan:
+        """Decides what can be fixed with a header edit and what needs a
+        remux. Header edits are:
+        - a language that was undefined in the container and was identified
+        - an external track with the same name, type and language as an mkv
+          track (or whose mkv twin is undefined) but a more precise language
+          tag or other flags: the mkv track is corrected instead of muxing
+          the same subtitle a second time
+        own_files are the files our export of this mkv wrote, their flags
+        were guessed from the mkv (DEFAULT_LANG, track name) so they are
+        never compared with the container"""
+        plan = MkvPlan()
+        own = {path.realpath(f) for f in own_files}
+        by_name: dict[tuple[str, str], list[TrackInfo]] = {}
+        for s in self.__subs:
+            by_name.setdefault((s.trackname_combined, s.subtype), []).append(s)
+            props = self._container_props(s.trackId)
+            lang = props.get("language_ietf", props.get("language", "und"))
+            if lang in ["und", ""] and s.language_ietf not in ["und", ""]:
+                plan.edits.setdefault(s.trackId, {})["language"] = s.language_ietf
+        for t in ext_tracks:
+            if path.realpath(t.filepath) in own:
+                t.to_remux = False
+                continue
+            m = None
+            for s in by_name.get((t.trackname_combined, t.subtype), []):
+                s_lang = str(s.language_ietf)
+                if s_lang in ["und", ""] or s_lang[:2] == str(t.language_ietf)[:2]:
+                    m = s
+                    break
+            if m is None:
+                if t.to_remux:
+                    plan.remux.append(t)
+                continue
+            t.to_remux = False
+            props = self._container_props(m.trackId)
+            edit = {}
+            t_lang = t.language_ietf
+            if t_lang not in ["und", ""] and t_lang != m.language_ietf:
+                edit["language"] = t_lang
+            if bool(t.is_default) != bool(props.get("default_track", False)):
+                edit["default"] = bool(t.is_default)
+            if bool(t.is_forced) != bool(props.get("forced_track", False)):
+                edit["forced"] = bool(t.is_forced)
+            if len(edit) > 0:
+                LOG.debug(f"Header edit instead of remux for {t.filepath}")
+                plan.edits.setdefault(m.trackId, {}).update(edit)
+        if plan.header_only:
+            LOG.info(f"{len(plan.edits)} track(s) fixed with a header edit")
+        elif len(plan.remux) > 0:
+            LOG.info(f"{len(plan.remux)} track(s) need a remux")
+        return plan
+
+    def edit_properties(self, edits: dict) -> bool:
+        """Applies MkvPlan.edits in place on the video with mkvpropedit"""
+        numbers = {}
+        for track_id, edit in edits.items():
+            number = self._container_props(track_id).get("number")
+            if number is None:
+                LOG.error(f"No track number for trackId {track_id}")
+                return False
+            numbers[number] = edit
+        cmd = f'mkvpropedit "{self._video_path}"{build_propedit_flags(numbers)}'
+        LOG.debug(f"Editing track properties of {self._video_path}")
+        LOG.debug(cmd)
         try:
-            cmd = [f'mkvextract tracks "{v_file}" {str(track_id)}:"{path}"']
-            LOG.debug(cmd)
-            subprocess.run(cmd, shell=True, check=True)
-            return path
+            with METRICS.span("mkvpropedit"):
+                subprocess.run(cmd, shell=True, check=True)
+            return True
         except Exception as e:
-            LOG.error(f"Could not export track: {e}")
-            return path
+            LOG.error(f"Could not edit track properties: {e}")
+            return False
 
-    def import_tracks(self, track_list: list[TrackInfo], vpath: str):
+    def verify_remux(self, output: str, source: str, new_tracks: int) -> bool:
+        """Checks with mkvmerge -J that output has every track of source plus
+        the new ones, and the same duration (1s tolerance)"""
+        result = {}
+        for name, video in [("source", source), ("output", output)]:
+            cmd = f'mkvmerge -J "{video}"'
+            with METRICS.span("mkvmerge.verify"):
+                proc = subprocess.run(cmd, shell=True, capture_output=True)
+            try:
+                result[name] = json.loads(proc.stdout)
+            except json.JSONDecodeError:
+                LOG.error(f"Could not read {video}: {proc.stderr}")
+                return False
+            if result[name].get("errors"):
+                LOG.error(f"Invalid {name} {video}: {result[name]['errors']}")
+                return False
+        expected = len(result["source"].get("tracks", [])) + new_tracks
+        got = len(result["output"].get("tracks", []))
+        if got != expected:
+            LOG.error(f"Remux has {got} track(s) instead of {expected}")
+            return False
+        durations = [
+            int(result[n].get("container", {}).get("properties", {}).get("duration", 0))
+            for n in ["source", "output"]
+        ]
+        if abs(durations[0] - durations[1]) > 1_000_000_000:
+            LOG.error(
+                f"Remux duration {durations[1] / 1e9:.1f}s doesn't match "
+                f"the source {durations[0] / 1e9:.1f}s"
+            )
+            return False
+        return True
+
+    def import_tracks(
+        self, track_list: list[TrackInfo], vpath: str, edits: dict | None = None
+    ) -> bool:
+        """Remuxes the new tracks into a hidden file next to the video, which
+        replaces it atomically once verified. The library never sees a
+        partial video and nothing is copied across filesystems.
+        False when the remux failed, the original video is then kept"""
         mkv_path: str = vpath
-        mkv_name: str = os.path.basename(mkv_path)
-        temp_dir: str = os.path.join(self._temp_folder, "import/", mkv_name)
+        video_dir, video_name = os.path.split(self._video_path)
+        output: str = os.path.join(video_dir, f".{video_name}.remux")
         i: int = 0
-        cmd: str = f'mkvmerge -o "{temp_dir}" "{mkv_path}"'
+        read: int = file_size(mkv_path)
+        source_flags = build_source_flags(edits) if edits else ""
+        cmd: str = f'mkvmerge -o "{output}"{source_flags} "{mkv_path}"'
         for t in track_list:
             if t.to_remux:
                 cmd = f"{cmd} {build_track_flags(t)}"
+                read += file_size(t.filepath)
                 i += 1
-        if i > 0:
-            LOG.debug(f"Muxing new track(s) into {self._video_path}")
-            LOG.debug(cmd)
-            subprocess.run(cmd, shell=True, check=True)
-            shutil.copy(temp_dir, os.path.dirname(self._video_path))
-            os.remove(temp_dir)
+        if i == 0:
+            return True
+        LOG.debug(f"Muxing new track(s) into {self._video_path}")
+        LOG.debug(cmd)
+        try:
+            # mkvmerge exits with 1 on warnings, the output is still complete
+            with METRICS.span("mkvmerge.remux", read=read) as span:
+                proc = subprocess.run(cmd, shell=True)
+                span.written = file_size(output)
+            if proc.returncode > 1 or not self.verify_remux(output, mkv_path, i):
+                LOG.error(f"Remux of {self._video_path} failed, original kept")
+                return False
+            keep_owner_and_mode(self._video_path, output)
+            os.replace(output, self._video_path)
+            LOG.info(f"Muxed {i} new track(s) into {self._video_path}")
+            return True
+        finally:
+            if os.path.exists(output):
+                os.remove(output)
+
+
+def keep_owner_and_mode(original: str, replacement: str) -> None:
+    """The replacement is a new file owned by us, it gets the permissions
+    and the owner of the original so Sonarr/Plex can still write to it"""
+    st = os.stat(original)
+    shutil.copymode(original, replacement)
+    try:
+        os.chown(replacement, st.st_uid, st.st_gid)
+    except OSError as e:
+        LOG.warning(f"Could not keep the owner of {original}: {e}")
+
+
+class SonarrError(Exception):
+    """Sonarr kept answering with an error instead of the expected data"""
 
 
 class Sonarr:
     def __init__(self, export_external_tracks=False) -> None:
         LOG.debug("init Sonarr()")
-        self._sonarr = SonarrAPI(SONARR_HOST_URL, SONARR_API)
+        # Every API call is a "sonarr.<method>" span
+        self._sonarr = METRICS.timed(
+            pyarr.SonarrAPI(SONARR_HOST_URL, SONARR_API), "sonarr"
+        )
         self._series = []
         self._episode_list = []
         self._bool_export_ext_tracks = export_external_tracks
@@ -898,28 +1758,49 @@ class Sonarr:
                     f_list.append(file)
         return True if len(f_list) > 0 else False
 
+    def _call(self, expected: type, method: str, *args, **kwargs):
+        """Calls the API until it answers with an expected (list, or dict
+        of a single object), an error answer comes back as the error body
+        ({"message": ...}) or an exception"""
+        delay = SONARR_RETRY_DELAY
+        for attempt in range(SONARR_RETRIES + 1):
+            try:
+                answer = getattr(self._sonarr, method)(*args, **kwargs)
+                if isinstance(answer, expected) and (
+                    expected is list or "id" in answer
+                ):
+                    return answer
+                error = f"unexpected answer {str(answer)[:200]}"
+            except Exception as e:
+                error = str(e)
+            if attempt < SONARR_RETRIES:
+                LOG.warning(f"Sonarr {method}{args}: {error}, retrying in {delay}s")
+                time.sleep(delay)
+                delay *= 2
+        raise SonarrError(f"Sonarr {method}{args} failed: {error}")
+
     @property
     def series(self) -> list:
-        series = self._sonarr.get_series()
+        series = self._call(list, "get_series")
         self._series = series
         LOG.debug(f"Get serie list from sonarr - Lenght: {len(series)}")
         return self._series
 
     def serie(self, id: int, tvdbid: bool = False):
         LOG.debug(f"Get serie from Sonarr: {id} / Is tvdbID={tvdbid}")
-        s = self._sonarr.get_series(id, tvdbid)
+        s = self._call(list if tvdbid else dict, "get_series", id, tvdbid)
         return s
 
     def episode_list(self, serie_id: int | str) -> list:
         self._serie_id = serie_id
-        ep_list = self._sonarr.get_episode(serie_id, series=True)
+        ep_list = self._call(list, "get_episode", serie_id, series=True)
         self._episode_list = ep_list
         LOG.debug(f"Get ep list for serie: {serie_id} - Lenght: {len(ep_list)} eps")
         return self._episode_list
 
     def episode(self, ep_id: int | str) -> Episode:
         ep = Episode()
-        sonarr_ep = self._sonarr.get_episode(ep_id, series=False)
+        sonarr_ep = self._call(dict, "get_episode", ep_id, series=False)
         ep.ep_id = ep_id
         ep.serie_id = self._serie_id
         ep.serie_title = sonarr_ep["series"].get("title")
@@ -942,9 +1823,50 @@ class Sonarr:
                 ep.ext_tracks = self._external_tracks
         return ep
 
+    def episodes(
+        self, ep_list: list, tvdbid: int | str, s_title: str, s_path: str
+    ) -> list[Episode]:
+        """Builds the Episode objects of a whole serie from the episode list
+        and one bulk episodefile call instead of one request per episode"""
+        ep_files = {}
+        if any(e.get("hasFile") for e in ep_list):
+            files = self._call(
+                list, "get_episode_file", self._serie_id, series=True
+            )
+            ep_files = {f.get("id"): f for f in files}
+            LOG.debug(
+                f"Get ep files for serie: {self._serie_id} - Lenght: {len(files)}"
+            )
+        episodes = []
+        for sonarr_ep in ep_list:
+            ep = Episode()
+            ep.ep_id = sonarr_ep.get("id")
+            ep.serie_id = self._serie_id
+            ep.serie_title = s_title
+            ep_file = ep_files.get(sonarr_ep.get("episodeFileId"))
+            if ep_file is None:
+                LOG.warning(
+                    f'No file for episodeID: {ep.ep_id} '
+                    f'S{sonarr_ep.get("seasonNumber")}'
+                    f'E{sonarr_ep.get("episodeNumber")}'
+                )
+            else:
+                ep.tvdbid = tvdbid
+                ep.season = sonarr_ep.get("seasonNumber")
+                ep.number = sonarr_ep.get("episodeNumber")
+                ep.video_path = ep_file.get("path")
+                ep.serie_path = s_path
+                ep.release = ep_file.get("releaseGroup", "")
+                if self._bool_export_ext_tracks:
+                    self._ep = ep
+                    self._list_ext_tracks(ep.video_path)
+                    ep.ext_tracks = self._external_tracks
+            episodes.append(ep)
+        return episodes
+
     def is_monitored(self, ep_id: int | str) -> bool:
         ep_id = int(ep_id)
-        ep = self._sonarr.get_episode(ep_id, series=False)
+        ep = self._call(dict, "get_episode", ep_id, series=False)
         return ep.get("monitored", True)
 
     def _list_ext_tracks(self, ep_path: str) -> None:
@@ -982,40 +1904,96 @@ class Subtitles:
     def subs_list(self) -> list[TrackInfo]:
         return self.__subs_list
 
-    def compare_with_mkv(self, mkv_tracks: list[TrackInfo]) -> list[TrackInfo]:
+    def compare_with_mkv(
+        self, mkv_tracks: list[TrackInfo], mkv_files: dict[str, str] | None = None
+    ) -> list[TrackInfo]:
+        """Marks to_remux the external tracks that aren't in the MKV yet.
+        A track is already there if an MKV track has the same normalized
+        (language, name, type), or the same content when mkv_files gives
+        the extracted file of MKV tracks (trackId -> path)"""
         LOG.debug("Comparing external tracks with MKV")
-        sub_tracks = self.subs_list
-        if len(sub_tracks) > 0:
-            for sub_track in sub_tracks:
-                lang = str(sub_track.language_ietf)[:2]
-                n = str(sub_track.trackname_combined)
-                e = str(sub_track.subtype)
-                if len(mkv_tracks) > 0:
-                    for mkv_track in mkv_tracks:
-                        mkv_lang = str(mkv_track.language_ietf)[:2]
-                        mkv_n = str(mkv_track.trackname_combined)
-                        mkv_e = str(mkv_track.subtype)
-                        if lang in mkv_lang and n in mkv_n and e in mkv_e:
-                            sub_track.to_remux = False
-                            LOG.debug(f"Track already exists: {mkv_n}")
-                            break
-                        else:
-                            sub_track.to_remux = True
-                else:
-                    sub_track.to_remux = True
-        self.__subs_list = sub_tracks
-        return sub_tracks
+        keys = {track_key(t) for t in mkv_tracks}
+        digests: dict[str, str] = {}
+        for t in mkv_tracks:
+            file = (mkv_files or {}).get(str(t.trackId), "")
+            digest = subtitle_digest(file)
+            if digest != "":
+                digests[digest] = t.trackname_combined
+        for sub_track in self.subs_list:
+            sub_track.to_remux = True
+            if track_key(sub_track) in keys:
+                sub_track.to_remux = False
+                LOG.debug(f"Track already exists: {sub_track.trackname_combined}")
+            elif len(digests) > 0:
+                digest = SUB_CATALOG.digest(sub_track.filepath, subtitle_digest)
+                same = digests.get(digest)
+                if same is not None:
+                    sub_track.to_remux = False
+                    LOG.debug(f"Same content already exists: {same}")
+        return self.subs_list
 
     def analyze_folder(self, folder_path: str) -> list[TrackInfo]:
-        if isdir(folder_path):
-            all_subs = os.listdir(folder_path)
-            if len(all_subs) > 0:
-                for subtitle in all_subs:
-                    f_path = path.join(folder_path, subtitle)
-                    subtitle_track = parse_subtitle_filename(f_path)
-                    self.__subs_list.append(subtitle_track)
+        """Tracks of the folder, read from the catalog which only lists the
+        folder again if it changed"""
+        for track in SUB_CATALOG.tracks(folder_path):
+            self.__subs_list.append(TrackInfo(**track))
         return self.subs_list
 
 
+class Manifest:
+    """Remembers, in a hidden file of the episode's subtitle folder, which
+    video file was exported there, which subtitle files it produced and
+    whether the remux pass ran"""
+
+    file_name = ".manifest.json"
+
+    def __init__(self, folder_path: str) -> None:
+        self._folder = folder_path
+        self._path = path.join(folder_path, self.file_name)
+
+    def _read(self) -> dict:
+        try:
+            with open(self._path, "r") as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return {}
+
+    def _subtitle_files(self) -> list[str]:
+        return [path.basename(f) for f in SUB_CATALOG.files(self._folder)]
+
+    def is_current(self, video_path: str, remux: bool = False) -> bool:
+        """True when the same video was already exported and every exported
+        file is still there. With remux, an export saved without the remux
+        pass or any new subtitle file in the folder makes it out of date"""
+        manifest = self._read()
+        if not manifest or manifest.get("video") != video_path:
+            return False
+        if remux and not manifest.get("remux", False):
+            return False
+        fingerprint = file_fingerprint(video_path)
+        if fingerprint is None or list(fingerprint) != manifest.get("fingerprint"):
+            return False
+        exported = set(manifest.get("files", []))
+        present = set(self._subtitle_files())
+        if not exported <= present:
+            return False
+        if remux and not present <= exported:
+            return False
+        return True
+
+    def save(self, video_path: str, remux: bool = False) -> None:
+        fingerprint = file_fingerprint(video_path)
+        if fingerprint is None or not isdir(self._folder):
+            return
+        manifest = {
+            "video": video_path,
+            "fingerprint": list(fingerprint),
+            "files": self._subtitle_files(),
+            "remux": remux,
+        }
+        with open(self._path, "w") as file:
+            json.dump(manifest, file, indent=2)
+
+
 if __name__ == "__main__":
     pass
@@ -1,22 +1,38 @@
 import os
 import argparse
+import queue
+import signal
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
 
 # from iso639 import Lang
 # from pysubparser import parser
 # import ass
 from episodus import Episode, SubSync, subtitle_export_name
 from episodus import MkvAnalyzer
-from episodus import Sonarr
+from episodus import Sonarr, SonarrError
 from episodus import Subtitles
+from episodus import TempWorkspace
+from episodus import Manifest, disable_prompts
+from episodus import SUB_CATALOG
+from cachus import IDENTIFY_CACHE, LANG_CACHE, SPEECH_CACHE
+from syncus import SYNC_ENGINE
+from metricus import METRICS
+from watchus import GrabWatcher
+from progressus import PROGRESS, DONE, FAILED, SKIPPED
 import configus
 
 GRABING_FOLDER = configus.CONF_GRABING_FOLDER
 SUBTITLE_PATH = configus.CONF_SUBTITLE_PATH
-PROGRESS_FOLDER = configus.CONF_PROGRESS_FOLDER
 LOG = configus.CONF_LOGGER
+JOB_FILTER = configus.CONF_JOB_FILTER
 
 to_remux = False
 export_external_tracks = False
+force_export = False
+jobs = 1
+executor: ThreadPoolExecutor | None = None
+in_flight: threading.BoundedSemaphore | None = None
 process_list = [
     "Extract everything from Sonarr",
     "Extract newly imported/upgraded episodes",
@@ -61,25 +77,43 @@ def what_do_you_want() -> None:
             export_specific_serie(int(serie_id), is_tvdb)
 
 
-def export_all_from_sonarr():
+def export_all_from_sonarr() -> list:
+    """Returns the IDs of the series Sonarr failed to answer for, their
+    progress isn't saved so the next run tries them again"""
     LOG.info("Exporting sonarr's entire collection")
     global export_external_tracks
     sonarr = Sonarr(export_external_tracks)
     all_series = sonarr.series
-    already_done = read_progress_sonarr()
     current_serie: int = 0
     total_series: int = len(all_series)
+    pending: dict[int, list[Future]] = {}
+    failed_series = []
     for serie in all_series:
         current_serie += 1
         serie_id = serie.get("id")
         serie_tvid = serie.get("tvdbId")
-        if str(serie_id) not in already_done:
+        if not PROGRESS.serie_is_done(serie_id):
             LOG.info(f"Current serie progress: {current_serie}/{total_series}")
-            ep_list = sonarr.episode_list(serie_id)
-            export_episodes(
-                ep_list, sonarr, serie.get("title"), serie_tvid, serie.get("path")
-            )
-            save_progress_sonarr(serie_id)
+            try:
+                ep_list = sonarr.episode_list(serie_id)
+                pending[serie_id] = export_episodes(
+                    ep_list,
+                    sonarr,
+                    serie.get("title"),
+                    serie_tvid,
+                    serie.get("path"),
+                    resume=True,
+                )
+            except SonarrError as e:
+                LOG.error(f"Serie ID: {serie_id} skipped: {e}")
+                failed_series.append(serie_id)
+                continue
+            save_finished_series(pending)
+    save_finished_series(pending, wait=True)
+    IDENTIFY_CACHE.evict_stale()
+    if len(failed_series) > 0:
+        LOG.error(f"{len(failed_series)} serie(s) skipped on Sonarr errors")
+    return failed_series
 
 
 def export_specific_serie(serieID: int, is_tvdbid: bool = False) -> None:
@@ -97,13 +131,16 @@ def export_specific_serie(serieID: int, is_tvdbid: bool = False) -> None:
         s_id = serieID
     s_title = s.get("title")
     s_path = s.get("path")
-    export_episodes(eps, so, s_title, tvid, s_path)
-    save_progress_sonarr(s_id)
+    pending = {s_id: export_episodes(eps, so, s_title, tvid, s_path)}
+    save_finished_series(pending, wait=True)
 
 
-def export_episodes(ep_list, sonarr: Sonarr, s_title: str, tvid, s_path: str) -> None:
+def export_episodes(
+    ep_list, sonarr: Sonarr, s_title: str, tvid, s_path: str, resume: bool = False
+) -> list[Future]:
     LOG.info(f"Treating tvdbId: {tvid} {s_title}")
     sonarr.external_tracks_guess_method(s_path)
+    monitored_list = []
     for episode in ep_list:
         monitored = episode.get("monitored")
         if not monitored:
@@ -112,55 +149,169 @@ def export_episodes(ep_list, sonarr: Sonarr, s_title: str, tvid, s_path: str) ->
                 f'E{episode.get("episodeNumber")} not monitored'
             )
         if monitored:
-            ep_id = episode.get("id")
-            ep = sonarr.episode(ep_id)
-            if ep.file_exist:
-                ep_path = ep.video_path
-                season_num = ep.season
-                ep_num = ep.number
-                release = ep.release
-                export_ep(ep_path, tvid, ep_num, season_num, release)
+            monitored_list.append(episode)
+    futures = []
+    for ep in sonarr.episodes(monitored_list, tvid, s_title, s_path):
+        if ep.file_exist:
+            ep_path = ep.video_path
+            if resume and PROGRESS.is_done(ep_path):
+                LOG.debug(f"Already exported: {ep_path}")
+                continue
+            season_num = ep.season
+            ep_num = ep.number
+            release = ep.release
+            futures.append(
+                submit_ep(ep_path, tvid, ep_num, season_num, release, ep.serie_id)
+            )
+    return futures
+
+
+def submit_ep(
+    ep_path: str,
+    tvid: str,
+    ep_num: str,
+    season: str,
+    rel_group: str,
+    serie_id: int | str = "",
+) -> Future:
+    """Runs export_ep in the worker pool when --jobs is greater than 1,
+    otherwise runs it right away. At most 2 x jobs episodes are queued"""
+    args = (ep_path, tvid, ep_num, season, rel_group, serie_id)
+    if executor is None or in_flight is None:
+        f = Future()
+        f.set_result(export_ep(*args))
+        return f
+    in_flight.acquire()
+    f = executor.submit(export_ep, *args)
+    f.add_done_callback(lambda _: in_flight.release())  # pyright: ignore
+    return f
+
+
+def save_finished_series(pending: dict, wait: bool = False) -> None:
+    """Saves progress for every serie whose episodes all succeeded. The
+    workers write the episode status, the serie-done marker is only ever
+    written from the main thread"""
+    for serie_id, futures in list(pending.items()):
+        if wait or all(f.done() for f in futures):
+            failed = False
+            for f in futures:
+                try:
+                    if f.result() == FAILED:
+                        failed = True
+                except Exception as e:
+                    LOG.exception(f"An error occured: {e}")
+                    failed = True
+            if not failed:
+                save_progress_sonarr(serie_id)
+            else:
+                LOG.error(f"Serie ID: {serie_id} had errors, progress not saved")
+            del pending[serie_id]
 
 
 def export_ep(
-    ep_path: str, tvid: str, ep_num: str, season: str, rel_group: str
-) -> None:
+    ep_path: str,
+    tvid: str,
+    ep_num: str,
+    season: str,
+    rel_group: str,
+    serie_id: int | str = "",
+) -> str:
+    """Returns the progress status of the episode"""
     LOG.info(f"Start: S{season}E{ep_num} from rel. group {rel_group}")
-    global to_remux
-    mkv = MkvAnalyzer()
-    subs = Subtitles()
-    ep = Episode()
+    reserve = TempWorkspace.estimate(ep_path)
+    try:
+        with METRICS.episode(ep_path) as totals:
+            with TempWorkspace(reserve) as temp_folder:
+                status = export_ep_with_temp(
+                    ep_path, tvid, ep_num, season, rel_group, temp_folder
+                )
+    except Exception:
+        PROGRESS.set_status(ep_path, FAILED, serie_id)
+        METRICS.count("episodes", FAILED)
+        raise
+    PROGRESS.set_status(ep_path, status, serie_id)
+    METRICS.count("episodes", status)
+    # Long running modes keep the metrics file fresh
+    METRICS.maybe_write()
+    LOG.debug(f"S{season}E{ep_num} took {totals['seconds']:.1f}s: {totals['stages']}")
+    return status
+
+
+def export_ep_with_temp(
+    ep_path: str, tvid: str, ep_num: str, season: str, rel_group: str, temp_folder: str
+) -> str:
+    """Returns the progress status of the episode"""
+    status = SKIPPED
     subs_folder = f"{SUBTITLE_PATH}{tvid}/S{season}/E{ep_num}/"
-    subs.analyze_folder(subs_folder)
+    manifest = Manifest(subs_folder)
+    if force_export:
+        # Subtitles edited in place don't change the folder's mtime
+        SUB_CATALOG.verify(subs_folder)
+    elif manifest.is_current(ep_path, to_remux):
+        LOG.info(f"S{season}E{ep_num} unchanged since last export, skipped")
+        return DONE
+    mkv = MkvAnalyzer(temp_folder)
+    subs = Subtitles()
+    ep = Episode(temp_folder)
+    with METRICS.span("analyze_folder"):
+        subs.analyze_folder(subs_folder)
     ep.video_path = ep_path
     if mkv.identify(ep_path):
         video_path = ep.video_path
-        if mkv.analyze():
+        with METRICS.span("analyze"):
+            analyzed = mkv.analyze()
+        if analyzed:
+            status = DONE
             if mkv.too_big:
                 video_path = ep.copy_temp()
             else:
                 video_path = ep.video_path
+            to_export = []
             for t in mkv.subs:
                 t.release = rel_group
                 t.episode = ep_num
                 t.season = season
                 sub_path_full = f"{subs_folder}{subtitle_export_name(t)}"
-                mkv.export(video_path, str(t.trackId), sub_path_full)
-                # if not args.all or args.reset, only on standard queue
+                to_export.append((str(t.trackId), sub_path_full))
+            mkv.export_batch(video_path, to_export)
+            # Files overwritten in place don't change the folder's mtime
+            SUB_CATALOG.invalidate(subs_folder)
+            # if not args.all or args.reset, only on standard queue
         if to_remux:
-            ok = False
-            subs.compare_with_mkv(mkv.subs)
-            for s in subs.subs_list:
-                if s.to_remux:
-                    ok = True
-                    break
-            if ok:
-                synced = SubSync(mkv.subs, subs.subs_list, video_path)
-                mkv.import_tracks(synced.syncronized, video_path)
+            exported = mkv.extracted(video_path)
+            with METRICS.span("compare_with_mkv"):
+                subs.compare_with_mkv(mkv.subs, exported)
+                plan = mkv.plan_changes(subs.subs_list, exported.values())
+            if len(plan.remux) > 0:
+                status = DONE
+                with METRICS.span("subsync"):
+                    synced = SubSync(
+                        mkv.subs,
+                        subs.subs_list,
+                        video_path,
+                        temp_folder,
+                        mkv.reference_tracks,
+                        mkv.speech_reference,
+                    )
+                with METRICS.span("import_tracks"):
+                    imported = mkv.import_tracks(
+                        synced.syncronized, video_path, plan.edits
+                    )
+                if not imported:
+                    # The original video is untouched, the next run retries
+                    status = FAILED
                 synced.del_temp()
+            elif plan.header_only:
+                status = DONE
+                if not mkv.edit_properties(plan.edits):
+                    # Not saved in the manifest, so the next run retries it
+                    status = FAILED
             else:
                 LOG.info("There is not track(s) to remux")
         ep.delete_temp()
+    if status == DONE:
+        manifest.save(ep_path, to_remux)
+    return status
 
 
 def get_sonarr_var(data_file_path):
@@ -178,58 +329,180 @@ def get_sonarr_var(data_file_path):
 def treat_queue_from_sonarr(source_folder) -> None:
     # Get a list of all files in the source folder
     LOG.info("Treating queue from last imported/upgraded episodes")
-    ep = Episode()
-    sonarr = Sonarr()
     files = os.listdir(source_folder)
+    if len(files) == 0:
+        LOG.info("Nothing in the queue")
+        return
+    sonarr = Sonarr()
+    pending: dict[str, Future] = {}
     for file in files:
         file_path_full = os.path.join(source_folder, file)
-        ep.sonarr_var = get_sonarr_var(file_path_full)
-        LOG.info(f"S{ep.season}E{ep.number} tvdbId: {ep.tvdbid} {ep.serie_title}")
-        monitored = sonarr.is_monitored(ep.ep_id)
-        if not monitored:
-            LOG.info(f"S{ep.season}E{ep.number} from {ep.tvdbid} isn't monitored")
-        if monitored:
-            export_ep(ep.video_path, ep.tvdbid, ep.number, ep.season, ep.release)
-        LOG.debug(f"Removing {file_path_full}")
-        if os.path.exists(file_path_full):
-            os.remove(file_path_full)
+        try:
+            f = treat_grab_file(file_path_full, sonarr)
+        except SonarrError as e:
+            # The grab file stays for the next run
+            LOG.error(f"{file} not treated: {e}")
+            continue
+        if f is not None:
+            pending[file_path_full] = f
+    for file_path_full, f in pending.items():
+        finish_grab_file(file_path_full, f)
 
 
-def save_progress_sonarr(serie_id: int | str) -> None:
+def watch_queue_from_sonarr(source_folder) -> None:
+    """Long running version of treat_queue_from_sonarr, every grab file is
+    treated seconds after subs.sh wrote it, until SIGTERM/SIGINT"""
+    LOG.info("Watching queue for imported/upgraded episodes")
+    disable_prompts()
+    sonarr = Sonarr()
+    watcher = GrabWatcher(source_folder)
+
+    def shutdown(signum, frame) -> None:
+        LOG.info(f"Received signal {signum}, stopping after current job(s)")
+        watcher.stop()
+
+    def finish(file_path_full: str, f: Future) -> None:
+        if not finish_grab_file(file_path_full, f):
+            watcher.retry(file_path_full)
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+    for file_path_full in watcher:
+        try:
+            f = treat_grab_file(file_path_full, sonarr)
+        except Exception as e:
+            LOG.exception(f"An error occured: {e}")
+            watcher.retry(file_path_full)
+            continue
+        if f is not None:
+            f.add_done_callback(lambda f, p=file_path_full: finish(p, f))
+
+
+def finish_grab_file(file_path_full: str, f: Future) -> bool:
+    """Failed grab files are left in place to be retried, returns False
+    for them"""
     try:
-        already_done = read_progress_sonarr()
-        with open(PROGRESS_FOLDER, "a+") as file:
-            if str(serie_id) not in already_done:
-                file.write(f"{str(serie_id)};")
-                LOG.info(f"Progress saved for serie ID: {serie_id}")
+        status = f.result()
     except Exception as e:
         LOG.exception(f"An error occured: {e}")
+        return False
+    if status == FAILED:
+        LOG.error(f"Export failed, {file_path_full} kept to retry")
+        return False
+    remove_grab_file(file_path_full)
+    return True
 
 
-def read_progress_sonarr() -> list:
+def serve_webhook_queue() -> None:
+    """Runs the webhook receiver, every Sonarr import/upgrade is queued in
+    memory and submitted to the workers, until SIGTERM/SIGINT"""
+    from webhookus import WebhookServer
+
+    LOG.info("Treating imported/upgraded episodes from Sonarr webhooks")
+    disable_prompts()
+    sonarr = Sonarr()
+    jobs_queue: queue.Queue = queue.Queue()
+    server = WebhookServer(jobs_queue)
+    stop = threading.Event()
+
+    def shutdown(signum, frame) -> None:
+        LOG.info(f"Received signal {signum}, stopping after current job(s)")
+        stop.set()
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+    server.start()
+    while not stop.is_set():
+        try:
+            sonarr_var = jobs_queue.get(timeout=1)
+        except queue.Empty:
+            continue
+        try:
+            f = treat_sonarr_var(sonarr_var, sonarr)
+        except Exception as e:
+            LOG.exception(f"An error occured: {e}")
+            continue
+        if f is not None:
+            ep_path = sonarr_var.get("sonarr_episodefile_path", "")
+            f.add_done_callback(lambda f, p=ep_path: finish_webhook_job(p, f))
+    server.stop()
+    # Sonarr won't send them again, tell which ones have to be redone
+    lost = []
+    while not jobs_queue.empty():
+        lost.append(jobs_queue.get_nowait().get("sonarr_episodefile_path", ""))
+    if len(lost) > 0:
+        LOG.warning(f"{len(lost)} queued webhook job(s) dropped at shutdown:")
+        for ep_path in lost:
+            LOG.warning(f"Not treated: {ep_path}")
+
+
+def finish_webhook_job(ep_path: str, f: Future) -> None:
+    """Worker errors would be lost with the Future otherwise"""
+    e = f.exception()
+    if e is not None:
+        LOG.error(f"An error occured for {ep_path}: {e}", exc_info=e)
+        PROGRESS.set_status(ep_path, FAILED)
+
+
+def treat_grab_file(file_path_full: str, sonarr: Sonarr) -> Future | None:
+    """Submits the episode described by a grab file,
+    unmonitored episodes are dropped right away"""
+    f = treat_sonarr_var(get_sonarr_var(file_path_full), sonarr)
+    if f is None:
+        remove_grab_file(file_path_full)
+    return f
+
+
+def treat_sonarr_var(sonarr_var: dict, sonarr: Sonarr) -> Future | None:
+    ep = Episode()
+    ep.sonarr_var = sonarr_var
+    LOG.info(f"S{ep.season}E{ep.number} tvdbId: {ep.tvdbid} {ep.serie_title}")
+    monitored = sonarr.is_monitored(ep.ep_id)
+    if not monitored:
+        LOG.info(f"S{ep.season}E{ep.number} from {ep.tvdbid} isn't monitored")
+        return None
+    return submit_ep(ep.video_path, ep.tvdbid, ep.number, ep.season, ep.release)
+
+
+def remove_grab_file(file_path_full: str) -> None:
+    LOG.debug(f"Removing {file_path_full}")
+    if os.path.exists(file_path_full):
+        os.remove(file_path_full)
+
+
+def save_progress_sonarr(serie_id: int | str) -> None:
     try:
-        with open(PROGRESS_FOLDER, "r") as file:
-            series = file.read()
-            serie_ids = [serie.strip() for serie in series.split(";") if serie.strip()]
-            LOG.debug(f"Last serieID saved in progress is: {serie_ids[-1]}")
-            return serie_ids
-    except FileNotFoundError:
-        LOG.info("Progress file not found")
-        return []
+        PROGRESS.serie_done(serie_id)
     except Exception as e:
         LOG.exception(f"An error occured: {e}")
-        return []
 
 
 def reset_progress_sonarr() -> None:
-    LOG.info("Resetting all progress from previous export")
-    with open(PROGRESS_FOLDER, "w") as file:
-        file.flush()
+    PROGRESS.reset()
+
+
+def start_workers(n: int) -> None:
+    global jobs
+    global executor
+    global in_flight
+    jobs = n
+    if jobs > 1:
+        LOG.info(f"Processing episodes with {jobs} workers")
+        executor = ThreadPoolExecutor(max_workers=jobs, thread_name_prefix="job")
+        in_flight = threading.BoundedSemaphore(jobs * 2)
+        JOB_FILTER.enabled = True
+
+
+def stop_workers() -> None:
+    if executor is not None:
+        executor.shutdown(wait=True)
+    SYNC_ENGINE.stop()
 
 
 def main():
     global to_remux
     global export_external_tracks
+    global force_export
     arg = argparse.ArgumentParser(description="Sonarr Subtitle (Auto)Managerr")
     arg.add_argument(
         "-a", "--all", action="store_true", help="Export all episode from Sonarr"
@@ -258,13 +531,40 @@ def main():
     arg.add_argument(
         "-T", "--tvdbid", type=int, nargs=1, help="Use tvdbId instead of SonarrID"
     )
+    arg.add_argument(
+        "-w",
+        "--watch",
+        action="store_true",
+        help="Keep running and treat the grabing folder as soon as files arrive",
+    )
+    arg.add_argument(
+        "-W",
+        "--webhook",
+        action="store_true",
+        help="Keep running and receive imported/upgraded episodes by webhook",
+    )
+    arg.add_argument(
+        "-f",
+        "--force",
+        action="store_true",
+        help="Export again episodes that didn't change since the last export "
+        "and compare their subtitle files one by one",
+    )
+    arg.add_argument(
+        "-j", "--jobs", type=int, default=1, help="Number of episodes treated at once"
+    )
     args = arg.parse_args()
+    configus.log_settings()
+    start_workers(args.jobs)
     if args.external:
         export_external_tracks = True
         LOG.info("Export external tracks is set to True")
     if args.remux:
         to_remux = True
         LOG.info("Remuxing back to the new video is set to True")
+    if args.force:
+        force_export = True
+        LOG.info("Unchanged episodes are exported again")
     if args.serie:
         serieID: int = args.serie[0]
         export_specific_serie(serieID, False)
@@ -278,8 +578,19 @@ def main():
         export_all_from_sonarr()
     if args.grabs:
         treat_queue_from_sonarr(GRABING_FOLDER)
-    if not any(vars(args).values()):
+    if args.watch:
+        watch_queue_from_sonarr(GRABING_FOLDER)
+    if args.webhook:
+        serve_webhook_queue()
+    if not any(v for k, v in vars(args).items() if k not in ["jobs", "force"]):
         what_do_you_want()
+    stop_workers()
+    IDENTIFY_CACHE.log_stats("Identify")
+    LANG_CACHE.log_stats("Language")
+    SPEECH_CACHE.log_stats("Speech")
+    SUB_CATALOG.log_stats("Subtitle catalog")
+    METRICS.log_summary()
+    METRICS.write()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,257 @@
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+import json
+import os
+import random
+import threading
+import time
+import configus
+
+METRICS_FILE = configus.CONF_METRICS_FILE
+METRICS_INTERVAL = configus.CONF_METRICS_INTERVAL
+LOG = configus.CONF_LOGGER
+
+PREFIX = "submanagerr"
+QUANTILES = [0.5, 0.9, 0.99]
+
+
+@dataclass
+class Span:
+    """Yielded by Metrics.span, bytes can be set once they are known"""
+
+    stage: str
+    read: int = 0
+    written: int = 0
+
+
+@dataclass
+class StageStats:
+    count: int = 0
+    total: float = 0.0
+    max: float = 0.0
+    read: int = 0
+    written: int = 0
+    samples: list[float] = field(default_factory=list)
+
+
+def quantile(sorted_samples: list[float], q: float) -> float:
+    if len(sorted_samples) == 0:
+        return 0.0
+    return sorted_samples[min(len(sorted_samples) - 1, int(q * len(sorted_samples)))]
+
+
+class Metrics:
+    """Timing spans and byte counters per stage, with per-episode totals.
+    Spans may nest (analyze contains langid...), each stage is counted on
+    its own. Percentiles come from a reservoir of max_samples per stage"""
+
+    def __init__(self, max_samples: int = 2048, max_episodes: int = 100) -> None:
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._stages: dict[str, StageStats] = {}
+        self._counters: dict[tuple[str, str], int] = {}
+        self._episodes: deque = deque(maxlen=max_episodes)
+        self._max_samples = max_samples
+        self._rand = random.Random(0)
+        self._started = time.time()
+        self._last_write = 0.0
+
+    def observe(self, stage: str, seconds: float, read: int = 0, written: int = 0):
+        with self._lock:
+            stats = self._stages.setdefault(stage, StageStats())
+            stats.count += 1
+            stats.total += seconds
+            stats.max = max(stats.max, seconds)
+            stats.read += read
+            stats.written += written
+            if len(stats.samples) < self._max_samples:
+                stats.samples.append(seconds)
+            else:
+                i = self._rand.randrange(stats.count)
+                if i < self._max_samples:
+                    stats.samples[i] = seconds
+        episode = getattr(self._local, "episode", None)
+        if episode is not None:
+            stages = episode["stages"]
+            stages[stage] = stages.get(stage, 0.0) + seconds
+            episode["read_bytes"] += read
+            episode["written_bytes"] += written
+
+    @contextmanager
+    def span(self, stage: str, read: int = 0, written: int = 0):
+        s = Span(stage, read, written)
+        start = time.perf_counter()
+        try:
+            yield s
+        finally:
+            self.observe(stage, time.perf_counter() - start, s.read, s.written)
+
+    def count(self, name: str, label: str = "", value: int = 1) -> None:
+        with self._lock:
+            self._counters[(name, label)] = self._counters.get((name, label), 0) + value
+
+    @contextmanager
+    def episode(self, key: str):
+        """Totals of every span of the calling thread until the end of the
+        block, kept for the last max_episodes episodes"""
+        episode = {"episode": key, "stages": {}, "read_bytes": 0, "written_bytes": 0}
+        self._local.episode = episode
+        start = time.perf_counter()
+        try:
+            yield episode
+        finally:
+            self._local.episode = None
+            episode["seconds"] = round(time.perf_counter() - start, 6)
+            episode["stages"] = {k: round(v, 6) for k, v in episode["stages"].items()}
+            self.observe(
+                "episode",
+                episode["seconds"],
+                episode["read_bytes"],
+                episode["written_bytes"],
+            )
+            with self._lock:
+                self._episodes.append(episode)
+
+    def timed(self, obj, prefix: str):
+        """Proxy of obj whose method calls are spans named prefix.method"""
+        return Timed(obj, prefix, self)
+
+    def _snapshot(self) -> dict[str, StageStats]:
+        with self._lock:
+            return {
+                stage: StageStats(
+                    s.count, s.total, s.max, s.read, s.written, sorted(s.samples)
+                )
+                for stage, s in self._stages.items()
+            }
+
+    def to_json(self) -> dict:
+        stages = {}
+        for stage, s in self._snapshot().items():
+            stages[stage] = {
+                "count": s.count,
+                "sum_s": round(s.total, 6),
+                "max_s": round(s.max, 6),
+                "read_bytes": s.read,
+                "written_bytes": s.written,
+            }
+            for q in QUANTILES:
+                stages[stage][f"p{int(q * 100)}_s"] = round(quantile(s.samples, q), 6)
+        counters: dict[str, dict[str, int]] = {}
+        with self._lock:
+            for (name, label), value in self._counters.items():
+                counters.setdefault(name, {})[label] = value
+            episodes = list(self._episodes)
+        return {
+            "uptime_s": round(time.time() - self._started, 3),
+            "stages": stages,
+            "counters": counters,
+            "episodes": episodes,
+        }
+
+    def to_prometheus(self) -> str:
+        lines = [
+            f"# HELP {PREFIX}_stage_seconds Time spent per stage",
+            f"# TYPE {PREFIX}_stage_seconds summary",
+        ]
+        snapshot = self._snapshot()
+        for stage, s in snapshot.items():
+            for q in QUANTILES:
+                lines.append(
+                    f'{PREFIX}_stage_seconds{{stage="{stage}",quantile="{q}"}} '
+                    f"{quantile(s.samples, q):.6f}"
+                )
+            lines.append(f'{PREFIX}_stage_seconds_sum{{stage="{stage}"}} {s.total:.6f}')
+            lines.append(f'{PREFIX}_stage_seconds_count{{stage="{stage}"}} {s.count}')
+        lines.append(f"# HELP {PREFIX}_bytes_total Bytes read and written per stage")
+        lines.append(f"# TYPE {PREFIX}_bytes_total counter")
+        for stage, s in snapshot.items():
+            for direction, value in [("read", s.read), ("written", s.written)]:
+                if value > 0:
+                    lines.append(
+                        f'{PREFIX}_bytes_total{{stage="{stage}",'
+                        f'direction="{direction}"}} {value}'
+                    )
+        with self._lock:
+            counters = sorted(self._counters.items())
+        names = []
+        for (name, label), value in counters:
+            if name not in names:
+                names.append(name)
+                lines.append(f"# TYPE {PREFIX}_{name}_total counter")
+            labels = f'{{status="{label}"}}' if label else ""
+            lines.append(f"{PREFIX}_{name}_total{labels} {value}")
+        lines.append(f"# TYPE {PREFIX}_uptime_seconds gauge")
+        lines.append(f"{PREFIX}_uptime_seconds {time.time() - self._started:.3f}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: str = METRICS_FILE) -> None:
+        """Prometheus text format, or JSON when path ends with .json"""
+        if path == "":
+            return
+        folder = os.path.dirname(path)
+        if folder != "" and not os.path.exists(folder):
+            os.makedirs(folder, exist_ok=True)
+        if path.endswith(".json"):
+            content = json.dumps(self.to_json(), indent=2)
+        else:
+            content = self.to_prometheus()
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        self._last_write = time.monotonic()
+        try:
+            with open(temp_path, "w") as file:
+                file.write(content)
+            os.replace(temp_path, path)
+        except OSError as e:
+            LOG.warning(f"Could not write metrics to {path}: {e}")
+
+    def maybe_write(self, path: str = METRICS_FILE) -> None:
+        """For the long running modes, writes every METRICS_INTERVAL seconds"""
+        if time.monotonic() - self._last_write >= METRICS_INTERVAL:
+            self.write(path)
+
+    def log_summary(self) -> None:
+        snapshot = self._snapshot()
+        if len(snapshot) == 0:
+            return
+        LOG.info(
+            f"{'stage':<24} {'count':>6} {'p50 ms':>9} {'p90 ms':>9} "
+            f"{'p99 ms':>9} {'max ms':>9} {'total s':>9} {'MB r/w':>13}"
+        )
+        ranked = sorted(snapshot.items(), key=lambda s: s[1].total, reverse=True)
+        for stage, s in ranked:
+            p50, p90, p99 = (quantile(s.samples, q) * 1000 for q in QUANTILES)
+            mb = f"{s.read / 1048576:.0f}/{s.written / 1048576:.0f}"
+            LOG.info(
+                f"{stage:<24} {s.count:>6} {p50:>9.1f} {p90:>9.1f} {p99:>9.1f} "
+                f"{s.max * 1000:>9.1f} {s.total:>9.2f} {mb:>13}"
+            )
+
+
+class Timed:
+    def __init__(self, obj, prefix: str, metrics: Metrics) -> None:
+        self._obj = obj
+        self._prefix = prefix
+        self._metrics = metrics
+
+    def __getattr__(self, name: str):
+        attr = getattr(self._obj, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            with self._metrics.span(f"{self._prefix}.{name}"):
+                return attr(*args, **kwargs)
+
+        return call
+
+
+def file_size(file_path: str) -> int:
+    try:
+        return os.path.getsize(file_path)
+    except OSError:
+        return 0
+
+
+METRICS = Metrics()
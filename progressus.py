@@ -0,0 +1,114 @@
+import os
+import threading
+import time
+from cachus import SqliteStore
+import configus
+
+PROGRESS_FOLDER = configus.CONF_PROGRESS_FOLDER
+PROGRESS_DB = configus.CONF_PROGRESS_DB
+LOG = configus.CONF_LOGGER
+
+DONE = "done"
+FAILED = "failed"
+SKIPPED = "skipped"
+
+
+class ProgressStore(SqliteStore):
+    """Export progress per episode file (done, failed or skipped) and per
+    serie. Everything is loaded in memory once so lookups are O(1), every
+    change is written through to sqlite right away"""
+
+    schema = """
+        CREATE TABLE IF NOT EXISTS episodes (
+            path TEXT PRIMARY KEY,
+            serie_id TEXT,
+            status TEXT,
+            updated REAL
+        );
+        CREATE TABLE IF NOT EXISTS series (
+            serie_id TEXT PRIMARY KEY,
+            updated REAL
+        );
+    """
+
+    def __init__(self, db_path: str, legacy_path: str = "") -> None:
+        super().__init__(db_path)
+        self._legacy_path = legacy_path
+        self._episodes: dict[str, str] | None = None
+        self._series: set[str] | None = None
+        self._load_lock = threading.Lock()
+
+    def _load(self) -> None:
+        if self._episodes is not None:
+            return
+        with self._load_lock:
+            if self._episodes is not None:
+                return
+            with self._lock:
+                rows = self.db.execute("SELECT path, status FROM episodes").fetchall()
+                rows_series = self.db.execute("SELECT serie_id FROM series").fetchall()
+                self._series = {row[0] for row in rows_series}
+                self._episodes = {row[0]: row[1] for row in rows}
+            self._import_legacy()
+        LOG.debug(
+            f"Progress loaded: {len(self._series)} serie(s), "  # type: ignore
+            f"{len(self._episodes)} episode file(s)"
+        )
+
+    def _import_legacy(self) -> None:
+        """Imports the old semicolon separated list of serie IDs once"""
+        if self._legacy_path == "" or not os.path.exists(self._legacy_path):
+            return
+        with open(self._legacy_path, "r") as file:
+            series = file.read()
+        serie_ids = [serie.strip() for serie in series.split(";") if serie.strip()]
+        for serie_id in serie_ids:
+            self.serie_done(serie_id)
+        os.rename(self._legacy_path, f"{self._legacy_path}.imported")
+        LOG.info(f"Imported {len(serie_ids)} serie(s) from {self._legacy_path}")
+
+    def serie_is_done(self, serie_id: int | str) -> bool:
+        self._load()
+        return str(serie_id) in self._series  # type: ignore
+
+    def serie_done(self, serie_id: int | str) -> None:
+        self._load()
+        with self._lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO series VALUES (?, ?)",
+                (str(serie_id), time.time()),
+            )
+            self.db.commit()
+            self._series.add(str(serie_id))  # type: ignore
+        LOG.info(f"Progress saved for serie ID: {serie_id}")
+
+    def status(self, path: str) -> str:
+        self._load()
+        return self._episodes.get(path, "")  # type: ignore
+
+    def is_done(self, path: str) -> bool:
+        return self.status(path) in [DONE, SKIPPED]
+
+    def set_status(self, path: str, status: str, serie_id: int | str = "") -> None:
+        self._load()
+        with self._lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO episodes VALUES (?, ?, ?, ?)",
+                (path, str(serie_id), status, time.time()),
+            )
+            self.db.commit()
+            self._episodes[path] = status  # type: ignore
+        LOG.debug(f"Progress: {status} for {path}")
+
+    def reset(self) -> None:
+        LOG.info("Resetting all progress from previous export")
+        self._load()
+        with self._lock:
+            self.db.execute("DELETE FROM episodes")
+            self.db.execute("DELETE FROM series")
+            self.db.commit()
+            self._episodes = {}
+            self._series = set()
+
+
+PROGRESS = ProgressStore(PROGRESS_DB, PROGRESS_FOLDER)
@@ -0,0 +1,143 @@
+from concurrent.futures import BrokenExecutor, Future
+from dataclasses import dataclass
+import threading
+import configus
+
+SYNC_JOBS = configus.CONF_SYNC_JOBS
+LOG = configus.CONF_LOGGER
+
+# ffsubsync module, imported once per worker process
+_ffsubsync = None
+
+
+@dataclass
+class SyncResult:
+    reference: str
+    unsync: str
+    output: str
+    success: bool = False
+    offset_seconds: float | None = None
+    framerate_scale_factor: float | None = None
+    error: str = ""
+
+
+def _load():
+    global _ffsubsync
+    if _ffsubsync is None:
+        import logging
+        from ffsubsync import ffsubsync
+
+        logging.getLogger("ffsubsync").setLevel(logging.WARNING)
+        _ffsubsync = ffsubsync
+    return _ffsubsync
+
+
+def _args(ffs, reference: str, unsync: str = "", output: str = ""):
+    argv = [reference]
+    if unsync != "":
+        argv += ["-i", unsync, "-o", output]
+    args = ffs.validate_and_transform_args(ffs.make_parser().parse_args(argv))
+    if args is None:
+        raise ValueError(f"Invalid ffsubsync arguments: {argv}")
+    return args
+
+
+def _reference_pipe(ffs, args):
+    pipe = ffs.make_reference_pipe(args)
+    pipe.fit(args.reference)
+    return pipe
+
+
+def _sync_pair(reference: str, unsync: str, output: str) -> SyncResult:
+    """Runs in a worker process. Subtitle and .npz references are cheap to
+    load, so every pair has its own job and pairs sharing a reference run
+    in parallel"""
+    ffs = _load()
+    result = SyncResult(reference, unsync, output)
+    out = {}
+    try:
+        args = _args(ffs, reference, unsync, output)
+        pipe = _reference_pipe(ffs, args)
+        result.success = ffs.try_sync(args, pipe, out)
+        result.offset_seconds = out.get("offset_seconds")
+        result.framerate_scale_factor = out.get("framerate_scale_factor")
+    except Exception as e:
+        result.error = str(e)
+    return result
+
+
+def _serialize_speech(video_file: str, npz_path: str) -> None:
+    """Runs in a worker process, same as ffsubsync --serialize-speech
+    but written where we want it"""
+    import numpy as np
+
+    ffs = _load()
+    args = _args(ffs, video_file)
+    pipe = _reference_pipe(ffs, args)
+    np.savez_compressed(npz_path, speech=pipe.transform(video_file))
+
+
+class SyncEngine:
+    """Long-lived worker processes running ffsubsync through its Python API,
+    so numpy, webrtcvad and ffsubsync itself are imported once per worker
+    instead of once per subtitle. Started on first use"""
+
+    def __init__(self, workers: int = SYNC_JOBS) -> None:
+        self._workers = max(1, workers)
+        self._pool = None
+        self._lock = threading.Lock()
+
+    @property
+    def pool(self):
+        with self._lock:
+            if self._pool is None:
+                # multiprocessing is only imported when a sync is needed
+                from concurrent.futures import ProcessPoolExecutor
+                import multiprocessing
+
+                LOG.debug(f"Starting {self._workers} sync worker(s)")
+                # Forking a process full of threads isn't safe
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self._workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+            return self._pool
+
+    def _submit(self, fn, *args) -> Future:
+        try:
+            return self.pool.submit(fn, *args)
+        except BrokenExecutor:
+            # A worker died (killed, out of memory...), start new ones
+            LOG.warning("Sync workers died, restarting them")
+            with self._lock:
+                self._pool = None
+            return self.pool.submit(fn, *args)
+
+    def sync_batch(self, jobs: list[tuple[str, str, str]]) -> list[SyncResult]:
+        """Synchronizes (reference, unsync, output) triples, one worker job
+        each. Results are in the order given"""
+        futures = [self._submit(_sync_pair, *job) for job in jobs]
+        results: list[SyncResult] = []
+        for job, f in zip(jobs, futures):
+            try:
+                results.append(f.result())
+            except Exception as e:
+                results.append(SyncResult(*job, error=str(e)))
+        return results
+
+    def serialize_speech(self, video_file: str, npz_path: str) -> bool:
+        try:
+            self._submit(_serialize_speech, video_file, npz_path).result()
+            return True
+        except Exception as e:
+            LOG.error(f"Could not extract speech from {video_file}: {e}")
+            return False
+
+    def stop(self) -> None:
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown()
+                self._pool = None
+
+
+SYNC_ENGINE = SyncEngine()
@@ -0,0 +1,15 @@
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# configus reads its settings on import and the caches, the progress store
+# and logs.log are relative to the working directory: keep them out of the
+# real setup
+WORKDIR = tempfile.mkdtemp(prefix="submanagerr-tests-")
+os.chdir(WORKDIR)
+os.environ["CACHE_FOLDER"] = os.path.join(WORKDIR, "cache", "")
+os.environ["TEMP_FOLDER"] = os.path.join(WORKDIR, "temp")
+os.environ["METRICS_FILE"] = ""
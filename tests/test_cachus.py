@@ -0,0 +1,70 @@
+from dataclasses import asdict
+import os
+import sqlite3
+
+from cachus import IdentifyCache, LangCache
+from episodus import TrackInfo
+
+
+def test_lang_cache_round_trip(tmp_path):
+    cache = LangCache(str(tmp_path / "lang.sqlite"), 2)
+    assert cache.get("a") is None
+    cache.put("a", "fr", 0.99)
+    cache.put("b", "en", 0.5)
+    assert cache.get("a") == ("fr", 0.99)
+    cache.put("c", "de", 0.7)
+    # "b" is the least recently used
+    assert cache.get("b") is None
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_lang_cache_drops_raw_scores(tmp_path):
+    db_path = str(tmp_path / "lang.sqlite")
+    old = sqlite3.connect(db_path)
+    old.execute(
+        "CREATE TABLE lang (digest TEXT PRIMARY KEY, lang TEXT, "
+        "confidence REAL, last_used REAL)"
+    )
+    old.execute("INSERT INTO lang VALUES ('a', 'fr', -1234.5, 0)")
+    old.commit()
+    old.close()
+    cache = LangCache(db_path, 10)
+    assert cache.get("a") is None
+    tables = {row[0] for row in cache.db.execute("SELECT name FROM sqlite_master")}
+    assert "lang" not in tables
+
+
+def test_identify_cache_is_invalidated_by_the_video(tmp_path):
+    video = tmp_path / "video.mkv"
+    video.write_bytes(b"video")
+    cache = IdentifyCache(str(tmp_path / "identify.sqlite"), 10)
+    tracks = {"tracks": [{"id": 2, "type": "subtitles"}]}
+    cache.put(str(video), tracks, [TrackInfo(trackId="2", language_ietf="fr")])
+    cached = cache.get(str(video))
+    assert cached is not None
+    assert cached[0] == tracks
+    assert cached[1] == [asdict(TrackInfo(trackId="2", language_ietf="fr"))]
+    # Replaced by an upgrade: the entry is stale and dropped
+    video.write_bytes(b"upgraded video")
+    assert cache.get(str(video)) is None
+    count = cache.db.execute("SELECT COUNT(*) FROM identify").fetchone()[0]
+    assert count == 0
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_identify_cache_evictions(tmp_path):
+    cache = IdentifyCache(str(tmp_path / "identify.sqlite"), 2)
+    videos = []
+    for name in ["a", "b", "c"]:
+        video = tmp_path / f"{name}.mkv"
+        video.write_bytes(name.encode())
+        videos.append(str(video))
+    cache.put(videos[0], {})
+    cache.put(videos[1], {})
+    assert cache.get(videos[0]) == ({}, None)
+    cache.put(videos[2], {})
+    # "b" is the least recently used
+    assert cache.get(videos[1]) is None
+    os.remove(videos[2])
+    assert cache.evict_stale() == 1
+    assert cache.get(videos[0]) == ({}, None)
@@ -0,0 +1,97 @@
+import os
+
+from cachus import SubtitleCatalog
+from episodus import parse_subtitle_filename
+
+
+def write(file_path, content="sub"):
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    with open(file_path, "w") as file:
+        file.write(content)
+
+
+def touch_folder(folder, shift_ns):
+    """Moves the folder mtime, some filesystems only keep it to the second"""
+    mtime_ns = os.stat(folder).st_mtime_ns + shift_ns
+    os.utime(folder, ns=(mtime_ns, mtime_ns))
+
+
+def catalog(tmp_path):
+    root = tmp_path / "subtitles"
+    episode = root / "123" / "S01" / "E03"
+    write(str(episode / "S01.E03.[Grp]-[Full].default.eng.ass"))
+    write(str(episode / "S01.E03.[Grp]-[Full].fr-CA.srt"))
+    write(str(episode / ".manifest.json"), "{}")
+    write(str(root / "456" / "S02" / "E01" / "S02.E01.[Grp]-[Full].fre.ass"))
+    write(str(root / "456" / "notes.txt"))
+    sub_catalog = SubtitleCatalog(
+        str(tmp_path / "catalog.sqlite"), str(root), parse_subtitle_filename
+    )
+    return sub_catalog, str(root), str(episode)
+
+
+def test_refresh_only_lists_changed_folders(tmp_path):
+    sub_catalog, root, episode = catalog(tmp_path)
+    assert sub_catalog.refresh() == 7
+    assert sub_catalog.refresh() == 0
+    write(os.path.join(episode, "S01.E03.[Grp]-[Signs].forced.eng.ass"))
+    touch_folder(episode, 1_000_000_000)
+    assert sub_catalog.refresh() == 1
+    assert len(sub_catalog.tracks(episode)) == 3
+    assert sub_catalog.refresh(os.path.join(root, "456")) == 0
+
+
+def test_query(tmp_path):
+    sub_catalog, root, _ = catalog(tmp_path)
+    sub_catalog.refresh()
+    assert len(sub_catalog.query()) == 3
+    assert len(sub_catalog.query(tvdbid="123", season="01", episode="03")) == 2
+    french = sub_catalog.query(language="fr")
+    assert sorted(t["language_ietf"] for t in french) == ["fr", "fr-CA"]
+    assert [t["filename"] for t in sub_catalog.query(language="en")] == [
+        "S01.E03.[Grp]-[Full].default.eng.ass"
+    ]
+    # Files that aren't subtitle exports are listed but have no track
+    assert len(sub_catalog.files(os.path.join(root, "456"))) == 1
+
+
+def test_rewritten_file_is_parsed_again(tmp_path):
+    sub_catalog, _, episode = catalog(tmp_path)
+    sub_catalog.refresh()
+    file_path = os.path.join(episode, "S01.E03.[Grp]-[Full].fr-CA.srt")
+    folder_mtime = os.stat(episode).st_mtime_ns
+    write(file_path, "a longer subtitle")
+    os.utime(episode, ns=(folder_mtime, folder_mtime))
+    calls = []
+
+    def compute(p):
+        calls.append(p)
+        return str(os.path.getsize(p))
+
+    # Only the folder mtimes are compared, the stale row stays
+    assert sub_catalog.refresh() == 0
+    assert len(sub_catalog.tracks(episode)) == 2
+    assert sub_catalog.digest(file_path, compute) == "17"
+    assert len(calls) == 1
+    # verify compares the files
+    assert sub_catalog.verify(episode)
+    assert not sub_catalog.verify(os.path.dirname(episode))
+    assert len(sub_catalog.tracks(episode)) == 2
+    assert not sub_catalog.verify(episode)
+    assert sub_catalog.digest(file_path, compute) == "17"
+    assert sub_catalog.digest(file_path, compute) == "17"
+    assert len(calls) == 2
+
+
+def test_invalidate_and_removed_folder(tmp_path):
+    sub_catalog, root, episode = catalog(tmp_path)
+    sub_catalog.refresh()
+    sub_catalog.invalidate(episode)
+    assert sub_catalog.refresh() == 1
+    for name in os.listdir(episode):
+        os.remove(os.path.join(episode, name))
+    os.rmdir(episode)
+    sub_catalog.refresh()
+    assert sub_catalog.tracks(episode) == []
+    assert sub_catalog.query(tvdbid="123") == []
+    assert len(sub_catalog.query()) == 1
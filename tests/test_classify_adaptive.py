@@ -0,0 +1,66 @@
+from itertools import count
+
+import pytest
+
+import episodus
+from episodus import classify_adaptive
+
+
+@pytest.fixture
+def samples(monkeypatch):
+    """Lengths of the samples classified, the probability grows with them"""
+    lengths = []
+
+    def classify(dialogs):
+        lengths.append(len(dialogs.split()))
+        return "fr", min(1.0, lengths[-1] / 20)
+
+    monkeypatch.setattr(episodus, "classify", classify)
+    return lengths
+
+
+def lines(n):
+    return (f"line{i}" for i in range(n))
+
+
+def test_stops_once_confident(samples):
+    assert classify_adaptive(lines(100), 0.5, 4, 64, cached=False) == ("fr", 0.8)
+    assert samples == [4, 8, 16]
+
+
+def test_confident_first_chunk_reads_nothing_more(samples):
+    read = count()
+    source = (f"line{next(read)}" for _ in range(100))
+    assert classify_adaptive(source, 0.2, 4, 64, cached=False) == ("fr", 0.2)
+    assert samples == [4]
+    assert next(read) == 4
+
+
+def test_max_lines(samples):
+    assert classify_adaptive(lines(100), 0.99, 4, 10, cached=False) == ("fr", 0.5)
+    assert samples == [4, 8, 10]
+
+
+def test_short_file_is_classified_whole(samples):
+    assert classify_adaptive(lines(6), 0.99, 4, 64, cached=False) == ("fr", 0.3)
+    assert samples == [4, 6]
+    assert classify_adaptive(lines(0), cached=False) == ("und", 0.0)
+
+
+def test_cached(samples):
+    text = ["Le chat du voisin dort sur le toit de la maison"] * 4
+    assert classify_adaptive(text, 0.1, 4, 64) == ("fr", 1.0)
+    assert classify_adaptive(text, 0.1, 4, 64) == ("fr", 1.0)
+    assert len(samples) == 1
+
+
+def test_real_identifier():
+    dialogs = [
+        "Je ne sais pas ce que tu veux dire.",
+        "On se retrouve demain matin devant la gare ?",
+        "Il faut que je parte avant qu'il ne soit trop tard.",
+        "Tu aurais dû me le dire plus tôt !",
+    ]
+    lang, probability = classify_adaptive(dialogs * 4, 0.9, 4, 64, cached=False)
+    assert lang == "fr"
+    assert 0.9 <= probability <= 1.0
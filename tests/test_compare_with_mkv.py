@@ -0,0 +1,65 @@
+import codecs
+
+from episodus import Subtitles, TrackInfo, track_key
+
+DIALOG = "[Events]\nDialogue: 0,0:00:01.00,0:00:02.00,Default,,0,0,0,,Ça va ?\n"
+
+
+def track(lang, name, subtype="ass", release="Group", **fields) -> TrackInfo:
+    t = TrackInfo(
+        trackname=name, release=release, subtype=subtype, language_ietf=lang
+    )
+    for key, value in fields.items():
+        setattr(t, key, value)
+    return t
+
+
+def subtitles(*tracks) -> Subtitles:
+    subs = Subtitles()
+    subs.subs_list.extend(tracks)
+    return subs
+
+
+def test_track_key_normalizes():
+    assert track_key(track("fr-FR", "French  Full", ".ASS")) == (
+        "fr",
+        "[group]-[french full]",
+        "ass",
+    )
+    assert track_key(track("fr", "[Group]-[French Full]")) == track_key(
+        track("FR-ca", "french full", release="group")
+    )
+    assert track_key(track("fr", "French", "srt")) != track_key(track("fr", "French"))
+
+
+def test_same_key_is_not_remuxed():
+    mkv = [track("fr", "French", trackId="2")]
+    subs = subtitles(track("fr-FR", "FRENCH"), track("en", "French"))
+    result = subs.compare_with_mkv(mkv)
+    assert [t.to_remux for t in result] == [False, True]
+
+
+def test_same_content_is_not_remuxed(tmp_path):
+    extracted = tmp_path / "track_2.ass"
+    extracted.write_bytes(codecs.BOM_UTF8 + DIALOG.encode("utf-8"))
+    same = tmp_path / "same.ass"
+    # Other encoding, line endings and case: still the same subtitle
+    same.write_bytes(DIALOG.upper().replace("\n", "\r\n").encode("latin-1"))
+    other = tmp_path / "other.ass"
+    other.write_text(DIALOG.replace("Ça va", "Bonjour"))
+    mkv = [track("fr", "French", trackId="2")]
+    subs = subtitles(
+        track("fr", "Renamed", filepath=str(same)),
+        track("fr", "Other", filepath=str(other)),
+    )
+    subs.compare_with_mkv(mkv, {"2": str(extracted)})
+    assert [t.to_remux for t in subs.subs_list] == [False, True]
+
+
+def test_without_extracted_files_only_keys_match(tmp_path):
+    same = tmp_path / "same.ass"
+    same.write_text(DIALOG)
+    mkv = [track("fr", "French", trackId="2")]
+    subs = subtitles(track("fr", "Renamed", filepath=str(same)))
+    subs.compare_with_mkv(mkv, {})
+    assert subs.subs_list[0].to_remux
@@ -0,0 +1,55 @@
+import os
+
+from episodus import Manifest
+
+
+def exported_folder(tmp_path, remux=False):
+    video = tmp_path / "Show - S01E03.mkv"
+    video.write_bytes(b"video")
+    folder = tmp_path / "subtitles"
+    folder.mkdir()
+    for name in ["S01.E03.[Grp]-[Full].eng.ass", "S01.E03.[Grp]-[Full].fre.ass"]:
+        (folder / name).write_text("sub")
+    manifest = Manifest(str(folder))
+    manifest.save(str(video), remux)
+    return manifest, str(video), folder
+
+
+def test_new_folder_is_not_current(tmp_path):
+    video = tmp_path / "Show - S01E03.mkv"
+    video.write_bytes(b"video")
+    assert not Manifest(str(tmp_path)).is_current(str(video))
+
+
+def test_saved_export_is_current(tmp_path):
+    manifest, video, _ = exported_folder(tmp_path)
+    assert manifest.is_current(video)
+    assert not manifest.is_current(video.replace("S01E03", "S01E04"))
+
+
+def test_export_without_remux_is_stale_for_remux(tmp_path):
+    manifest, video, _ = exported_folder(tmp_path)
+    assert not manifest.is_current(video, remux=True)
+    manifest.save(video, remux=True)
+    assert manifest.is_current(video, remux=True)
+    assert manifest.is_current(video)
+
+
+def test_changed_video_is_not_current(tmp_path):
+    manifest, video, _ = exported_folder(tmp_path)
+    with open(video, "ab") as file:
+        file.write(b"upgrade")
+    assert not manifest.is_current(video)
+
+
+def test_missing_export_is_not_current(tmp_path):
+    manifest, video, folder = exported_folder(tmp_path)
+    os.remove(folder / "S01.E03.[Grp]-[Full].fre.ass")
+    assert not manifest.is_current(video)
+
+
+def test_new_subtitle_only_matters_to_remux(tmp_path):
+    manifest, video, folder = exported_folder(tmp_path, remux=True)
+    (folder / "S01.E03.[Other]-[Full].spa.srt").write_text("sub")
+    assert manifest.is_current(video)
+    assert not manifest.is_current(video, remux=True)
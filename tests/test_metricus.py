@@ -0,0 +1,87 @@
+import json
+
+from metricus import Metrics, quantile
+
+
+def test_quantile():
+    samples = [float(i) for i in range(1, 101)]
+    assert quantile(samples, 0.5) == 51.0
+    assert quantile(samples, 0.9) == 91.0
+    assert quantile(samples, 0.99) == 100.0
+    assert quantile([3.0], 0.99) == 3.0
+    assert quantile([], 0.5) == 0.0
+
+
+def test_stage_stats():
+    metrics = Metrics()
+    for i in range(1, 101):
+        metrics.observe("export", i / 1000, read=10, written=1)
+    stage = metrics.to_json()["stages"]["export"]
+    assert stage["count"] == 100
+    assert stage["sum_s"] == 5.05
+    assert stage["max_s"] == 0.1
+    assert (stage["p50_s"], stage["p90_s"], stage["p99_s"]) == (0.051, 0.091, 0.1)
+    assert (stage["read_bytes"], stage["written_bytes"]) == (1000, 100)
+
+
+def test_reservoir_is_bounded():
+    metrics = Metrics(max_samples=16)
+    for i in range(1000):
+        metrics.observe("langid", i / 1000)
+    stats = metrics._snapshot()["langid"]
+    assert stats.count == 1000
+    assert len(stats.samples) == 16
+    assert stats.max == 0.999
+
+
+def test_episode_totals():
+    metrics = Metrics(max_episodes=1)
+    for key in ["S01E01", "S01E02"]:
+        with metrics.episode(key):
+            with metrics.span("analyze") as span:
+                with metrics.span("langid"):
+                    pass
+                span.read = 100
+    report = metrics.to_json()
+    assert [e["episode"] for e in report["episodes"]] == ["S01E02"]
+    assert set(report["episodes"][0]["stages"]) == {"analyze", "langid"}
+    assert report["episodes"][0]["read_bytes"] == 100
+    assert report["stages"]["episode"]["count"] == 2
+    assert report["stages"]["analyze"]["read_bytes"] == 200
+
+
+def test_prometheus_output():
+    metrics = Metrics()
+    metrics.observe("export", 0.5, written=2048)
+    metrics.count("episodes", "done", 2)
+    metrics.count("episodes", "failed")
+    metrics.count("webhooks")
+    lines = metrics.to_prometheus().splitlines()
+    assert lines[:2] == [
+        "# HELP submanagerr_stage_seconds Time spent per stage",
+        "# TYPE submanagerr_stage_seconds summary",
+    ]
+    assert 'submanagerr_stage_seconds{stage="export",quantile="0.9"} 0.500000' in lines
+    assert 'submanagerr_stage_seconds_sum{stage="export"} 0.500000' in lines
+    assert 'submanagerr_stage_seconds_count{stage="export"} 1' in lines
+    assert (
+        'submanagerr_bytes_total{stage="export",direction="written"} 2048' in lines
+    )
+    assert not any('direction="read"' in line for line in lines)
+    assert lines.count("# TYPE submanagerr_episodes_total counter") == 1
+    assert 'submanagerr_episodes_total{status="done"} 2' in lines
+    assert 'submanagerr_episodes_total{status="failed"} 1' in lines
+    assert "submanagerr_webhooks_total 1" in lines
+    assert lines[-1].startswith("submanagerr_uptime_seconds ")
+
+
+def test_write(tmp_path):
+    metrics = Metrics()
+    metrics.observe("export", 0.5)
+    metrics.write(str(tmp_path / "metrics" / "submanagerr.prom"))
+    prom = (tmp_path / "metrics" / "submanagerr.prom").read_text()
+    assert prom.endswith("\n")
+    metrics.write(str(tmp_path / "metrics.json"))
+    report = json.loads((tmp_path / "metrics.json").read_text())
+    assert report["stages"]["export"]["count"] == 1
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["metrics", "metrics.json"]
@@ -0,0 +1,79 @@
+import os
+
+from episodus import MkvAnalyzer, parse_subtitle_filename, subtitle_export_name
+
+VIDEO = "/tv/Show/Season 01/Show - S01E03.mkv"
+
+
+def mkv_track(track_id, number, lang, name, default=False, forced=False):
+    return {
+        "id": track_id,
+        "type": "subtitles",
+        "codec": "SubStationAlpha",
+        "properties": {
+            "number": number,
+            "codec_id": "S_TEXT/ASS",
+            "language": lang[:3],
+            "language_ietf": lang,
+            "track_name": name,
+            "default_track": default,
+            "forced_track": forced,
+        },
+    }
+
+
+def analyzer(tracks) -> MkvAnalyzer:
+    mkv = MkvAnalyzer()
+    mkv._video_path = VIDEO
+    mkv._tracks = {"errors": [], "tracks": tracks}
+    assert mkv.analyze()
+    for t in mkv.subs:
+        t.release = "Group"
+        t.season = "01"
+        t.episode = "03"
+    return mkv
+
+
+def store_track(folder, track):
+    """What analyze_folder reads back for a file of the subtitle store"""
+    file_path = os.path.join(folder, subtitle_export_name(track))
+    open(file_path, "w").close()
+    return parse_subtitle_filename(file_path)
+
+
+def test_unchanged_mkv_plans_nothing(tmp_path):
+    # The export flags are guessed: French is DEFAULT_LANG so its export is
+    # named default while the container says otherwise, "Signs" looks forced
+    mkv = analyzer(
+        [
+            mkv_track(2, 3, "fr", "French"),
+            mkv_track(3, 4, "en", "English", default=True),
+            mkv_track(4, 5, "en", "Signs"),
+        ]
+    )
+    own = [store_track(str(tmp_path), t) for t in mkv.subs]
+    assert own[0].is_default and own[2].is_forced
+    plan = mkv.plan_changes(own, [t.filepath for t in own])
+    assert plan.empty
+    assert not any(t.to_remux for t in own)
+
+
+def test_sidecar_flags_edit_the_header(tmp_path):
+    mkv = analyzer([mkv_track(2, 3, "fr", "French")])
+    sidecar = store_track(str(tmp_path), mkv.subs[0])
+    sidecar.is_forced = True
+    sidecar.language_ietf = "fr-CA"
+    plan = mkv.plan_changes([sidecar])
+    assert plan.header_only
+    assert plan.edits == {2: {"language": "fr-CA", "default": True, "forced": True}}
+
+
+def test_new_track_is_remuxed(tmp_path):
+    mkv = analyzer([mkv_track(2, 3, "fr", "French")])
+    new = store_track(str(tmp_path), mkv.subs[0])
+    new.trackname = "[Other]-[English]"
+    new.language_ietf = "en"
+    new.to_remux = True
+    plan = mkv.plan_changes([new])
+    assert plan.remux == [new]
+    assert plan.edits == {}
@@ -0,0 +1,36 @@
+from concurrent.futures import Future
+
+import main
+from progressus import DONE, FAILED, PROGRESS, SKIPPED
+
+
+def finished(result) -> Future:
+    f: Future = Future()
+    if isinstance(result, Exception):
+        f.set_exception(result)
+    else:
+        f.set_result(result)
+    return f
+
+
+def test_serie_is_done_when_every_episode_succeeded():
+    pending = {"101": [finished(DONE), finished(SKIPPED)]}
+    main.save_finished_series(pending, wait=True)
+    assert pending == {}
+    assert PROGRESS.serie_is_done("101")
+
+
+def test_failed_episode_keeps_the_serie_pending():
+    main.save_finished_series({"102": [finished(DONE), finished(FAILED)]}, wait=True)
+    main.save_finished_series({"103": [finished(RuntimeError("crash"))]}, wait=True)
+    assert not PROGRESS.serie_is_done("102")
+    assert not PROGRESS.serie_is_done("103")
+
+
+def test_failed_grab_file_is_kept(tmp_path):
+    grab = tmp_path / "grab"
+    grab.write_text("sonarr_episodefile_id=1\n")
+    assert not main.finish_grab_file(str(grab), finished(FAILED))
+    assert grab.exists()
+    assert main.finish_grab_file(str(grab), finished(DONE))
+    assert not grab.exists()
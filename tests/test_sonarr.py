@@ -0,0 +1,43 @@
+import pytest
+
+import episodus
+from episodus import Sonarr, SonarrError
+
+ERROR = {"message": "Service Unavailable"}
+
+
+class FakeApi:
+    """Answers with the given answers in turn"""
+
+    def __init__(self, *answers) -> None:
+        self.answers = list(answers)
+        self.calls = 0
+
+    def get_episode(self, *args, **kwargs):
+        self.calls += 1
+        return self.answers.pop(0)
+
+
+@pytest.fixture
+def sonarr(monkeypatch):
+    monkeypatch.setattr(episodus, "SONARR_RETRIES", 2)
+    monkeypatch.setattr(episodus, "SONARR_RETRY_DELAY", 0)
+    return Sonarr()
+
+
+def test_error_answers_are_retried(sonarr):
+    sonarr._sonarr = FakeApi(ERROR, [{"id": 1}])
+    assert sonarr.episode_list(7) == [{"id": 1}]
+    assert sonarr._sonarr.calls == 2
+
+
+def test_error_body_is_not_an_episode(sonarr):
+    sonarr._sonarr = FakeApi(ERROR, ERROR, {"id": 10, "monitored": False})
+    assert not sonarr.is_monitored(10)
+
+
+def test_persistent_errors_raise(sonarr):
+    sonarr._sonarr = FakeApi(ERROR, ERROR, ERROR)
+    with pytest.raises(SonarrError):
+        sonarr.episode_list(7)
+    assert sonarr._sonarr.calls == 3
@@ -0,0 +1,33 @@
+import os
+import shutil
+import subprocess
+import sys
+
+import pytest
+
+from episodus import stream_tracks_lang
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__)), "bench"))
+import fixtures  # noqa: E402
+
+pytestmark = pytest.mark.skipif(
+    shutil.which("ffmpeg") is None, reason="needs ffmpeg"
+)
+
+
+def test_every_track_in_one_pass(tmp_path):
+    inputs = []
+    for lang, ext in [("fr", "ass"), ("en", "srt"), ("de", "ass")]:
+        path = str(tmp_path / f"{lang}.{ext}")
+        fixtures.write_subtitle(path, fixtures.dialog_lines(lang, 200))
+        inputs += ["-i", path]
+    video = str(tmp_path / "episode.mkv")
+    cmd = ["ffmpeg", "-v", "error", "-f", "lavfi", "-i", "testsrc=size=32x18:rate=1"]
+    cmd += inputs + ["-map", "0", "-map", "1", "-map", "2", "-map", "3"]
+    cmd += ["-t", "500", "-c:s", "ass", video]
+    subprocess.run(cmd, check=True)
+    langs = stream_tracks_lang(video, [1, 2, 3])
+    assert langs == {"1": "fr", "2": "en", "3": "de"}
+    # A stream that doesn't exist stops ffmpeg, nothing is identified
+    assert stream_tracks_lang(video, [1, 7]) == {}
+    assert stream_tracks_lang(str(tmp_path / "gone.mkv"), [1]) == {}
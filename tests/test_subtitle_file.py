@@ -0,0 +1,62 @@
+import codecs
+
+from episodus import SubtitleFile, decode_subtitle
+
+ASS = """[Script Info]
+; comment
+Title: Épisode 3
+ScriptType: v4.00+
+
+[V4+ Styles]
+Format: Name, Fontname
+Style: Default,Arial
+
+[Events]
+Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text
+Dialogue: 0,0:00:01.00,0:00:02.00,Default,,0,0,0,,{\\i1}Déjà là ?{\\i0}
+Dialogue: 0,0:00:03.00,0:00:04.00,Default,,0,0,0,,Oui,\\Nj'arrive.
+Comment: 0,0:00:05.00,0:00:06.00,Default,,0,0,0,,not a dialog
+"""
+
+SRT = """1
+00:00:01,000 --> 00:00:02,000
+<i>Déjà là ?</i>
+
+2
+00:00:03,000 --> 00:00:04,000
+Oui, j'arrive.
+"""
+
+
+def test_decode_utf8_and_boms():
+    assert decode_subtitle(ASS.encode("utf-8")) == ASS
+    assert decode_subtitle(codecs.BOM_UTF8 + ASS.encode("utf-8")) == ASS
+    assert decode_subtitle(ASS.encode("utf-16")) == ASS
+    assert decode_subtitle(codecs.BOM_UTF16_BE + ASS.encode("utf-16-be")) == ASS
+
+
+def test_decode_legacy_encoding():
+    text = SRT * 20
+    assert decode_subtitle(text.encode("cp1252")) == text
+
+
+def test_ass_header_and_dialogs(tmp_path):
+    sub_path = tmp_path / "episode.ass"
+    sub_path.write_bytes(codecs.BOM_UTF8 + ASS.encode("utf-8"))
+    sub = SubtitleFile(str(sub_path))
+    assert sub.header() == {"Title": "Épisode 3", "ScriptType": "v4.00+"}
+    assert list(sub.dialogs()) == ["Déjà là ?", "Oui, j'arrive."]
+
+
+def test_srt_dialogs(tmp_path):
+    sub_path = tmp_path / "episode.srt"
+    sub_path.write_bytes(SRT.encode("cp1252"))
+    sub = SubtitleFile(str(sub_path))
+    assert sub.header() == {}
+    assert list(sub.dialogs()) == ["Déjà là ?", "Oui, j'arrive."]
+
+
+def test_missing_file(tmp_path):
+    sub = SubtitleFile(str(tmp_path / "gone.ass"))
+    assert sub.text == ""
+    assert list(sub.dialogs()) == []
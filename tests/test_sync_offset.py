@@ -0,0 +1,32 @@
+import builtins
+
+import episodus
+from episodus import check_sync_offset
+
+
+def test_small_offset_is_kept():
+    assert check_sync_offset(1.5)
+    assert not check_sync_offset(None)
+
+
+def test_big_offset_asks(monkeypatch):
+    monkeypatch.setattr(builtins, "input", lambda prompt: "y")
+    assert check_sync_offset(-5.0)
+
+
+def test_closed_stdin_keeps_the_unsynced_track(monkeypatch):
+    def closed(prompt):
+        raise EOFError
+
+    monkeypatch.setattr(builtins, "input", closed)
+    assert not check_sync_offset(5.0)
+
+
+def test_daemon_modes_never_ask(monkeypatch):
+    def asked(prompt):
+        raise AssertionError("prompted")
+
+    monkeypatch.setattr(builtins, "input", asked)
+    monkeypatch.setattr(episodus, "prompts", True)
+    episodus.disable_prompts()
+    assert not check_sync_offset(5.0)
@@ -0,0 +1,41 @@
+import random
+
+from syncus import SyncEngine
+
+
+def write_srt(path, starts, shift=0.0):
+    with open(path, "w") as file:
+        for i, start in enumerate(starts):
+            begin, end = start + shift, start + shift + 1.5
+            file.write(f"{i + 1}\n{timestamp(begin)} --> {timestamp(end)}\n")
+            file.write(f"line {i}\n\n")
+
+
+def timestamp(seconds):
+    ms = int(round(seconds * 1000))
+    return f"00:{ms // 60000:02d}:{ms // 1000 % 60:02d},{ms % 1000:03d}"
+
+
+def test_pairs_sharing_a_reference(tmp_path):
+    rand = random.Random(0)
+    starts, t = [], 1.0
+    for _ in range(150):
+        starts.append(t)
+        t += 1.5 + rand.uniform(0.2, 4)
+    reference = str(tmp_path / "ref.srt")
+    write_srt(reference, starts)
+    jobs = []
+    for name, shift in [("a", 3.0), ("b", -2.0)]:
+        unsync = str(tmp_path / f"{name}.srt")
+        write_srt(unsync, starts, shift)
+        jobs.append((reference, unsync, str(tmp_path / f"out.{name}.srt")))
+    jobs.append((reference, str(tmp_path / "gone.srt"), str(tmp_path / "out.srt")))
+    engine = SyncEngine(2)
+    try:
+        results = engine.sync_batch(jobs)
+    finally:
+        engine.stop()
+    assert [r.unsync for r in results] == [job[1] for job in jobs]
+    assert results[0].success and abs(results[0].offset_seconds + 3.0) < 0.1
+    assert results[1].success and abs(results[1].offset_seconds - 2.0) < 0.1
+    assert not results[2].success
@@ -0,0 +1,39 @@
+import threading
+
+from watchus import GrabWatcher
+
+
+def test_failed_grab_file_is_yielded_again(tmp_path):
+    grab = tmp_path / "grab"
+    grab.write_text("sonarr_episodefile_id=1\n")
+    watcher = GrabWatcher(str(tmp_path), debounce=0.05, poll_interval=0.05)
+    yielded = []
+
+    def watch():
+        for file_path in watcher:
+            yielded.append(file_path)
+            if len(yielded) == 1:
+                # As finish_grab_file does from a worker when the job failed
+                threading.Thread(target=watcher.retry, args=(file_path,)).start()
+            else:
+                watcher.stop()
+
+    thread = threading.Thread(target=watch)
+    thread.start()
+    thread.join(timeout=5)
+    watcher.stop()
+    thread.join(timeout=1)
+    assert yielded == [str(grab), str(grab)]
+
+
+def test_done_grab_file_is_yielded_once(tmp_path):
+    grab = tmp_path / "grab"
+    grab.write_text("sonarr_episodefile_id=1\n")
+    watcher = GrabWatcher(str(tmp_path), debounce=0.05, poll_interval=0.05)
+    yielded = []
+    thread = threading.Thread(target=lambda: yielded.extend(watcher))
+    thread.start()
+    thread.join(timeout=0.5)
+    watcher.stop()
+    thread.join(timeout=1)
+    assert yielded == [str(grab)]
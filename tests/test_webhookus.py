@@ -0,0 +1,49 @@
+from concurrent.futures import Future
+
+import main
+from episodus import Episode
+from progressus import FAILED, PROGRESS
+from webhookus import payload_to_sonarr_var
+
+PAYLOAD = {
+    "eventType": "Download",
+    "isUpgrade": True,
+    "series": {"id": 1, "title": "Show", "path": "/tv/Show", "tvdbId": 305074},
+    "episodes": [
+        {"id": 10, "seasonNumber": 1, "episodeNumber": 3},
+        {"id": 11, "seasonNumber": 1, "episodeNumber": 4},
+    ],
+    "episodeFile": {
+        "id": 5,
+        "path": "/tv/Show/Season 01/Show - S01E03E04.mkv",
+        "releaseGroup": "Group",
+    },
+}
+
+
+def test_payload_maps_to_grab_file_variables():
+    sonarr_var = payload_to_sonarr_var(PAYLOAD)
+    assert sonarr_var["sonarr_eventtype"] == "Download"
+    assert sonarr_var["sonarr_isupgrade"] == "True"
+    assert sonarr_var["sonarr_series_tvdbid"] == "305074"
+    assert sonarr_var["sonarr_episodefile_seasonnumber"] == "1"
+    assert sonarr_var["sonarr_episodefile_episodenumbers"] == "3,4"
+    assert sonarr_var["sonarr_episodefile_episodeids"] == "10,11"
+    ep = Episode()
+    ep.sonarr_var = sonarr_var
+    assert ep.video_path == PAYLOAD["episodeFile"]["path"]
+    assert ep.release == "Group"
+
+
+def test_payload_without_episodes():
+    sonarr_var = payload_to_sonarr_var({"eventType": "Test"})
+    assert sonarr_var["sonarr_eventtype"] == "Test"
+    assert sonarr_var["sonarr_episodefile_seasonnumber"] == ""
+    assert sonarr_var["sonarr_episodefile_episodeids"] == ""
+
+
+def test_failed_webhook_job_is_marked_failed():
+    f: Future = Future()
+    f.set_exception(RuntimeError("mkvmerge crashed"))
+    main.finish_webhook_job("/tv/Show/failed.mkv", f)
+    assert PROGRESS.status("/tv/Show/failed.mkv") == FAILED
@@ -0,0 +1,146 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import threading
+import time
+import configus
+
+WATCH_DEBOUNCE = configus.CONF_WATCH_DEBOUNCE
+WATCH_POLL_INTERVAL = configus.CONF_WATCH_POLL_INTERVAL
+LOG = configus.CONF_LOGGER
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+
+
+def inotify_init(folder: str) -> int | None:
+    """Returns an inotify file descriptor watching folder,
+    or None if inotify isn't available (not Linux, no libc...)"""
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            return None
+        mask = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+        wd = libc.inotify_add_watch(fd, os.fsencode(folder), mask)
+        if wd < 0:
+            os.close(fd)
+            return None
+        return fd
+    except (OSError, AttributeError):
+        return None
+
+
+class GrabWatcher:
+    """Yields the grab files written by subs.sh as soon as they are complete.
+    A file is considered complete once its size and mtime didn't change for
+    WATCH_DEBOUNCE seconds. Uses inotify to wake up, or polls the folder
+    every WATCH_POLL_INTERVAL seconds when inotify can't be used"""
+
+    def __init__(
+        self,
+        folder: str,
+        debounce: float = WATCH_DEBOUNCE,
+        poll_interval: float = WATCH_POLL_INTERVAL,
+    ) -> None:
+        self._folder = folder
+        self._debounce = debounce
+        self._poll_interval = poll_interval
+        self._stop = threading.Event()
+        self._candidates: dict[str, tuple[int, int, float]] = {}
+        self._yielded: set[str] = set()
+        self._yielded_lock = threading.Lock()
+        self._fd: int | None = None
+        self._wake_r, self._wake_w = os.pipe()
+
+    def stop(self) -> None:
+        """Safe to call from a signal handler"""
+        self._stop.set()
+        try:
+            os.write(self._wake_w, b"x")
+        except OSError:
+            pass
+
+    def retry(self, file_path: str) -> None:
+        """Yields file_path again on the next event or poll, for a grab file
+        whose job failed. Safe to call from the worker threads"""
+        with self._yielded_lock:
+            self._yielded.discard(file_path)
+
+    @property
+    def stopped(self) -> bool:
+        return self._stop.is_set()
+
+    def _scan(self) -> list[str]:
+        with self._yielded_lock:
+            return self._scan_folder()
+
+    def _scan_folder(self) -> list[str]:
+        ready = []
+        now = time.monotonic()
+        present = set()
+        for file in sorted(os.listdir(self._folder)):
+            file_path = os.path.join(self._folder, file)
+            try:
+                st = os.stat(file_path)
+            except FileNotFoundError:
+                continue
+            present.add(file_path)
+            if file_path in self._yielded:
+                continue
+            previous = self._candidates.get(file_path)
+            if previous is None or previous[:2] != (st.st_size, st.st_mtime_ns):
+                self._candidates[file_path] = (st.st_size, st.st_mtime_ns, now)
+            elif now - previous[2] >= self._debounce:
+                del self._candidates[file_path]
+                self._yielded.add(file_path)
+                ready.append(file_path)
+        for file_path in list(self._candidates):
+            if file_path not in present:
+                del self._candidates[file_path]
+        self._yielded &= present
+        return ready
+
+    def _wait(self) -> None:
+        timeout = self._poll_interval
+        if len(self._candidates) > 0:
+            timeout = min(timeout, self._debounce)
+        fds = [self._wake_r]
+        if self._fd is not None:
+            fds.append(self._fd)
+        try:
+            readable, _, _ = select.select(fds, [], [], timeout)
+            if self._fd in readable:
+                # The events themselves don't matter, the folder is rescanned
+                while True:
+                    try:
+                        if not os.read(self._fd, 4096):
+                            break
+                    except BlockingIOError:
+                        break
+        except InterruptedError:
+            pass
+
+    def __iter__(self):
+        if not os.path.exists(self._folder):
+            os.makedirs(self._folder)
+        self._fd = inotify_init(self._folder)
+        if self._fd is None:
+            LOG.info(f"Polling {self._folder} every {self._poll_interval}s")
+        else:
+            LOG.info(f"Watching {self._folder} with inotify")
+        try:
+            while not self._stop.is_set():
+                for file_path in self._scan():
+                    yield file_path
+                    if self._stop.is_set():
+                        return
+                self._wait()
+        finally:
+            if self._fd is not None:
+                os.close(self._fd)
+                self._fd = None
+            os.close(self._wake_r)
+            os.close(self._wake_w)
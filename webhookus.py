@@ -0,0 +1,129 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import base64
+import json
+import queue
+import threading
+import configus
+from metricus import METRICS
+
+WEBHOOK_HOST = configus.CONF_WEBHOOK_HOST
+WEBHOOK_PORT = configus.CONF_WEBHOOK_PORT
+WEBHOOK_USER = configus.CONF_WEBHOOK_USER
+WEBHOOK_PASSWORD = configus.CONF_WEBHOOK_PASSWORD
+LOG = configus.CONF_LOGGER
+
+# Sonarr sends "Download" for both On Import and On Upgrade
+HANDLED_EVENTS = ["Download"]
+
+
+def payload_to_sonarr_var(payload: dict) -> dict:
+    """Maps a Sonarr Webhook payload to the environment variables
+    subs.sh used to dump, as read by Episode.sonarr_var"""
+    series = payload.get("series", {})
+    episodes = payload.get("episodes", [])
+    ep_file = payload.get("episodeFile", {})
+    first_ep = episodes[0] if len(episodes) > 0 else {}
+    return {
+        "sonarr_eventtype": payload.get("eventType", ""),
+        "sonarr_isupgrade": str(payload.get("isUpgrade", False)),
+        "sonarr_series_id": str(series.get("id", "")),
+        "sonarr_series_title": series.get("title", ""),
+        "sonarr_series_path": series.get("path", ""),
+        "sonarr_series_tvdbid": str(series.get("tvdbId", "")),
+        "sonarr_episodefile_id": str(ep_file.get("id", "")),
+        "sonarr_episodefile_path": ep_file.get("path", ""),
+        "sonarr_episodefile_releasegroup": str(ep_file.get("releaseGroup", "")),
+        "sonarr_episodefile_seasonnumber": str(first_ep.get("seasonNumber", "")),
+        "sonarr_episodefile_episodenumbers": ",".join(
+            str(e.get("episodeNumber")) for e in episodes
+        ),
+        "sonarr_episodefile_episodeids": ",".join(str(e.get("id")) for e in episodes),
+    }
+
+
+class WebhookHandler(BaseHTTPRequestHandler):
+    server: "WebhookServer"
+
+    def _authorized(self) -> bool:
+        if WEBHOOK_USER == "" and WEBHOOK_PASSWORD == "":
+            return True
+        expected = base64.b64encode(
+            f"{WEBHOOK_USER}:{WEBHOOK_PASSWORD}".encode()
+        ).decode()
+        return self.headers.get("Authorization", "") == f"Basic {expected}"
+
+    def _reply(self, code: int, message: str) -> None:
+        body = json.dumps({"message": message}).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self) -> None:
+        if self.path.split("?")[0] == "/metrics":
+            # Prometheus scrape endpoint
+            body = METRICS.to_prometheus().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        self._reply(200, f"{self.server.jobs.qsize()} job(s) queued")
+
+    def do_POST(self) -> None:
+        if not self._authorized():
+            self._reply(401, "Unauthorized")
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            payload = json.loads(self.rfile.read(length))
+        except (ValueError, json.JSONDecodeError) as e:
+            LOG.warning(f"Invalid webhook payload: {e}")
+            self._reply(400, "Invalid payload")
+            return
+        event = payload.get("eventType", "")
+        if event == "Test":
+            LOG.info("Received test webhook from Sonarr")
+            self._reply(200, "Test received")
+            return
+        if event not in HANDLED_EVENTS or "episodeFile" not in payload:
+            LOG.debug(f"Ignoring webhook event: {event}")
+            self._reply(200, f"Event {event} ignored")
+            return
+        self.server.jobs.put(payload_to_sonarr_var(payload))
+        self._reply(202, "Queued")
+
+    def log_message(self, format: str, *args) -> None:
+        LOG.debug(f"Webhook {self.address_string()} {format % args}")
+
+
+class WebhookServer(ThreadingHTTPServer):
+    """Receives Sonarr's Webhook connection (On Import / On Upgrade)
+    and puts the equivalent of a grab file on the jobs queue"""
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        jobs: queue.Queue,
+        host: str = WEBHOOK_HOST,
+        port: int = WEBHOOK_PORT,
+    ) -> None:
+        super().__init__((host, port), WebhookHandler)
+        self.jobs = jobs
+        self._thread: threading.Thread | None = None
+
+    def start(self) -> None:
+        self._thread = threading.Thread(
+            target=self.serve_forever, name="webhook", daemon=True
+        )
+        self._thread.start()
+        LOG.info(f"Listening for Sonarr webhooks on {self.server_address}")
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+        if self._thread is not None:
+            self._thread.join()